@@ -1,9 +1,13 @@
 from datetime import datetime, timedelta
 from typing import Optional
 
+from app.repositories import adherent_repository
+from app.schemas import RoleEnum
+
 # importer secret_key de secret_key.py
 from app.secret_key import SECRET_KEY
-from jose import jwt
+from fastapi import Depends, HTTPException, status
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 
 # Normally, the secret key should be kept secret and ideally loaded from an environment variable
 # But to simplify, we are hardcoding it here
@@ -15,6 +19,9 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     """
     Create a JWT token with the provided data.
     """
+    # python-jose is only loaded when a token is first issued
+    from jose import jwt
+
     to_encode = data.copy()
     if expires_delta:
         expire = datetime.utcnow() + expires_delta
@@ -23,3 +30,47 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode.update({"exp": expire})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
+
+
+def decode_access_token(token: str) -> dict:
+    """
+    Return the claims of a token issued by ``create_access_token``.
+    Raise ValueError when it is invalid or expired.
+    """
+    from jose import JWTError, jwt
+
+    try:
+        return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError as error:
+        raise ValueError(str(error))
+
+
+bearer_scheme = HTTPBearer(auto_error=False)
+
+
+async def require_librarian(
+    credentials: HTTPAuthorizationCredentials = Depends(bearer_scheme),
+) -> dict:
+    """
+    Dependency restricting a route to the librarians.
+    The role is read from the database, so that a revoked librarian loses access at once.
+    """
+    unauthorized = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Not authenticated",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    if credentials is None:
+        raise unauthorized
+    try:
+        claims = decode_access_token(credentials.credentials)
+    except ValueError:
+        raise unauthorized
+    adherent = await adherent_repository.find_by_id(claims.get("adherent_id"))
+    if not adherent:
+        raise unauthorized
+    if adherent.get("role") != RoleEnum.librarian:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN, detail="Librarian role required"
+        )
+    return adherent
@@ -0,0 +1,321 @@
+"""Columnar in-memory snapshot of the books, serving the filtered book lists.
+
+Each book field is a column. The title, description, label and link, unique
+to each book, are lists of strings. The fields whose values repeat across
+books (type, language, publisher, location, author_id and author summary)
+are dictionary encoded: a 4-byte code per book into the table of their
+distinct values, interned, so that each value is stored once. The
+publication dates are day numbers.
+
+The rows of each type, language and author_id are kept in sorted arrays, and
+the (day, row) pairs in one sorted array. A query starts from the shortest
+index array of its filters and checks the other filters against the columns,
+so that only the returned page is turned back into documents. Rows follow
+the _id order of the load, then the insertion order.
+
+Books whose shape does not fit the columns (e.g. a date with a time) are
+kept as documents and filtered one by one. The rows of the deleted books
+stay empty until the next load.
+"""
+
+import heapq
+import re
+import sys
+from array import array
+from bisect import bisect_left, insort
+from datetime import date, datetime, time
+from itertools import islice
+
+from app.dates import date_range
+from app.schema_versions import VERSION_FIELD
+from bson import ObjectId
+
+TEXT_FIELDS = ("title", "description", "label", "link")
+CODED_FIELDS = ("type", "language", "publisher", "location", "author_id", "author")
+INDEXED_FIELDS = ("type", "language", "author_id")
+# Fields that must hold strings for a book to fit the columns
+STRING_FIELDS = ("title", "label", "link", "type", "language", "publisher", "location")
+AUTHOR_FIELDS = ("first_name", "last_name", "nationality")
+DOCUMENT_FIELDS = {"_id", VERSION_FIELD, "publishDate", *TEXT_FIELDS, *CODED_FIELDS}
+
+# Bits of the row in a (day << ROW_BITS | row) date index key
+ROW_BITS = 32
+ROW_MASK = (1 << ROW_BITS) - 1
+
+
+def intern(value):
+    if isinstance(value, tuple):
+        return tuple(intern(item) for item in value)
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def fits_columns(book: dict) -> bool:
+    """Whether ``book`` is read back unchanged from the columns."""
+    if not DOCUMENT_FIELDS.issuperset(book):
+        return False
+    if not all(isinstance(book.get(field), str) for field in STRING_FIELDS):
+        return False
+    if not isinstance(book.get("description"), (str, type(None))):
+        return False
+    publish_date = book.get("publishDate")
+    if not (
+        isinstance(publish_date, datetime)
+        and publish_date.tzinfo is None
+        and publish_date.time() == time.min
+    ):
+        return False
+    if not isinstance(book.get("author_id"), ObjectId):
+        return False
+    author = book.get("author")
+    return author is None or (
+        isinstance(author, dict)
+        and set(AUTHOR_FIELDS).issuperset(author)
+        and all(isinstance(value, (str, type(None))) for value in author.values())
+    )
+
+
+def author_key(author: dict):
+    if author is None:
+        return None
+    return tuple(author.get(field) for field in AUTHOR_FIELDS)
+
+
+class DictionaryColumn:
+    """Codes of the rows into the distinct values, with the sorted rows of each code if indexed."""
+
+    def __init__(self, indexed: bool = False):
+        self.codes = array("I")
+        self.values = []
+        self.value_codes = {}
+        self.index = [] if indexed else None
+
+    def code(self, value) -> int:
+        code = self.value_codes.get(value)
+        if code is None:
+            value = intern(value)
+            code = len(self.values)
+            self.values.append(value)
+            self.value_codes[value] = code
+            if self.index is not None:
+                self.index.append(array("I"))
+        return code
+
+    def set(self, row: int, value, indexed: bool = True):
+        code = self.code(value)
+        if row == len(self.codes):
+            self.codes.append(code)
+        else:
+            self.codes[row] = code
+        if self.index is not None and indexed:
+            insort(self.index[code], row)
+
+    def unindex(self, row: int):
+        if self.index is not None:
+            rows = self.index[self.codes[row]]
+            del rows[bisect_left(rows, row)]
+
+    def value(self, row: int):
+        return self.values[self.codes[row]]
+
+    def rows(self, codes: list) -> array:
+        """Sorted rows having one of ``codes``."""
+        if len(codes) == 1:
+            return self.index[codes[0]]
+        return array("I", sorted(row for code in codes for row in self.index[code]))
+
+
+class CatalogueSnapshot:
+    def __init__(self, max_books: int):
+        self.max_books = max_books
+        # False until fully loaded, or once the books outgrow max_books
+        self.ready = False
+        self.rows = {}
+        # Book id of each row, None once deleted
+        self.ids = []
+        self.text = {field: [] for field in TEXT_FIELDS}
+        self.coded = {
+            field: DictionaryColumn(indexed=field in INDEXED_FIELDS)
+            for field in CODED_FIELDS
+        }
+        self.days = array("i")
+        self.date_index = array("q")
+        # Documents of the books that do not fit the columns, by row
+        self.documents = {}
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def add_book(self, book_id: str, book: dict) -> bool:
+        """Add or replace a book, in the current shape; False once max_books is reached."""
+        row = self.rows.get(book_id)
+        if row is None:
+            if len(self.ids) >= self.max_books:
+                return False
+            row = len(self.ids)
+            self.ids.append(book_id)
+            for column in self.text.values():
+                column.append(None)
+            self.days.append(0)
+        else:
+            self.unindex(row)
+        self.rows[book_id] = row
+        regular = fits_columns(book)
+        if not regular:
+            self.documents[row] = book
+        for field, column in self.text.items():
+            column[row] = book.get(field) if regular else None
+        for field, column in self.coded.items():
+            value = book.get(field) if regular else None
+            column.set(row, author_key(value) if field == "author" else value, regular)
+        if regular:
+            day = book["publishDate"].toordinal()
+            self.days[row] = day
+            if self.ready:
+                insort(self.date_index, day << ROW_BITS | row)
+            else:
+                # Sorted at once when loaded
+                self.date_index.append(day << ROW_BITS | row)
+        return True
+
+    def loaded(self):
+        self.date_index = array("q", sorted(self.date_index))
+        self.ready = True
+
+    def remove_book(self, book_id: str):
+        row = self.rows.pop(book_id, None)
+        if row is not None:
+            self.unindex(row)
+            self.ids[row] = None
+
+    def unindex(self, row: int):
+        if self.documents.pop(row, None) is not None:
+            return
+        for column in self.coded.values():
+            column.unindex(row)
+        key = self.days[row] << ROW_BITS | row
+        del self.date_index[bisect_left(self.date_index, key)]
+
+    def document(self, row: int) -> dict:
+        if row in self.documents:
+            return dict(self.documents[row])
+        book = {"_id": ObjectId(self.ids[row])}
+        for field, column in self.text.items():
+            book[field] = column[row]
+        for field, column in self.coded.items():
+            book[field] = column.value(row)
+        book["publishDate"] = datetime.fromordinal(self.days[row])
+        author = book["author"]
+        book["author"] = None if author is None else dict(zip(AUTHOR_FIELDS, author))
+        return book
+
+    def find(
+        self,
+        type: str = None,
+        language: str = None,
+        author_id: ObjectId = None,
+        date_from: date = None,
+        date_to: date = None,
+        skip: int = 0,
+        limit: int = 10,
+    ) -> list:
+        """Page of the matching books, like the equivalent MongoDB query.
+
+        ``language`` is a case-insensitive regular expression, and the dates
+        are both included. None if the snapshot cannot answer the query.
+        """
+        if not self.ready:
+            return None
+        try:
+            pattern = re.compile(language, re.IGNORECASE) if language else None
+        except re.error:
+            return None
+        day_from = date_from.toordinal() if date_from else None
+        day_to = date_to.toordinal() if date_to else None
+        wanted = self.wanted_codes(type, pattern, author_id)
+
+        # Rows of the most selective filter, checked against the other ones
+        counts = {
+            field: sum(len(self.coded[field].index[code]) for code in codes)
+            for field, codes in wanted.items()
+        }
+        if day_from or day_to:
+            start = bisect_left(self.date_index, (day_from or 0) << ROW_BITS)
+            end = (
+                bisect_left(self.date_index, (day_to + 1) << ROW_BITS)
+                if day_to
+                else len(self.date_index)
+            )
+            counts["publishDate"] = end - start
+        if not counts:
+            rows = (
+                row
+                for row, book_id in enumerate(self.ids)
+                if book_id is not None and row not in self.documents
+            )
+        else:
+            field = min(counts, key=counts.get)
+            if field == "publishDate":
+                rows = sorted(key & ROW_MASK for key in self.date_index[start:end])
+            else:
+                rows = self.coded[field].rows(sorted(wanted.pop(field)))
+            check_days = field != "publishDate" and "publishDate" in counts
+            low, high = day_from or 0, day_to or sys.maxsize
+            rows = (
+                row
+                for row in rows
+                if self.row_matches(row, wanted)
+                and (not check_days or low <= self.days[row] <= high)
+            )
+
+        others = sorted(
+            row
+            for row, book in self.documents.items()
+            if document_matches(book, type, pattern, author_id, date_from, date_to)
+        )
+        page = islice(heapq.merge(rows, others), skip, skip + limit)
+        return [self.document(row) for row in page]
+
+    def wanted_codes(self, type, pattern, author_id) -> dict:
+        """Codes of the values matching each filter, by field."""
+        wanted = {}
+        if type:
+            wanted["type"] = [self.coded["type"].value_codes.get(type)]
+        if pattern:
+            wanted["language"] = [
+                code
+                for code, value in enumerate(self.coded["language"].values)
+                if isinstance(value, str) and pattern.search(value)
+            ]
+        if author_id:
+            wanted["author_id"] = [self.coded["author_id"].value_codes.get(author_id)]
+        return {
+            field: {code for code in codes if code is not None}
+            for field, codes in wanted.items()
+        }
+
+    def row_matches(self, row: int, wanted: dict) -> bool:
+        return all(
+            self.coded[field].codes[row] in codes for field, codes in wanted.items()
+        )
+
+
+def document_matches(book, type, pattern, author_id, date_from, date_to) -> bool:
+    """Whether MongoDB matches ``book``, which does not fit the columns."""
+    publish_date = book.get("publishDate")
+    if type and book.get("type") != type:
+        return False
+    language = book.get("language")
+    if pattern and not (isinstance(language, str) and pattern.search(language)):
+        return False
+    if author_id and book.get("author_id") != author_id:
+        return False
+    if date_from or date_to:
+        # A date range only matches dates
+        if not isinstance(publish_date, datetime):
+            return False
+        condition = date_range(date_from, date_to)
+        if "$gte" in condition and publish_date < condition["$gte"]:
+            return False
+        if "$lt" in condition and publish_date >= condition["$lt"]:
+            return False
+    return True
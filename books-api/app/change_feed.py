@@ -0,0 +1,198 @@
+"""Change notifications for the books, authors, adherents and loans collections.
+
+Changes come from a MongoDB change stream on replica sets. On a standalone
+mongod, the repositories record their writes in the capped ``change_log``
+collection, which is tailed instead. Each change is published as
+``{"collection", "operation", "id"}`` to the in-process listeners and to the
+``GET /events`` subscribers; an ``id`` of ``None`` means several documents.
+
+The position of the changes is marked before the caches following them are
+loaded, and the feed starts from there, so that the writes of the other
+workers during the load are replayed rather than missed.
+"""
+
+import asyncio
+import inspect
+import logging
+
+from app.database import client, database
+from pymongo import CursorType
+
+logger = logging.getLogger(__name__)
+
+WATCHED_COLLECTIONS = ["books", "authors", "adherents", "loans"]
+WATCH_PIPELINE = [{"$match": {"ns.coll": {"$in": WATCHED_COLLECTIONS}}}]
+
+# Capped collection used as change log on standalone servers
+CHANGE_LOG_NAME = "change_log"
+CHANGE_LOG_SIZE = 16 * 1024 * 1024
+
+# Pending notifications kept per subscriber before dropping the oldest ones
+SUBSCRIBER_QUEUE_SIZE = 1000
+
+# Delay before retrying after an error or when the change log is empty
+RETRY_DELAY_SECONDS = 1
+
+# In-process callbacks notified of every change, e.g. to invalidate caches
+listeners = []
+
+# Queues of the live subscribers, with the collections they follow
+subscribers = {}
+
+# True when the repositories must record their writes in the change log
+use_change_log = False
+
+# Position marked by mark_start(), where run() starts from
+start = {}
+
+
+def add_listener(callback):
+    """Call ``callback(change)`` (a function or coroutine) on every change."""
+    if callback not in listeners:
+        listeners.append(callback)
+
+
+def subscribe(collections: set) -> asyncio.Queue:
+    queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+    subscribers[queue] = collections
+    return queue
+
+
+def unsubscribe(queue: asyncio.Queue):
+    subscribers.pop(queue, None)
+
+
+async def publish(change: dict):
+    for callback in listeners:
+        try:
+            result = callback(change)
+            if inspect.isawaitable(result):
+                await result
+        except Exception:
+            logger.exception("Change listener failed")
+    for queue, collections in subscribers.items():
+        if change["collection"] not in collections:
+            continue
+        if queue.full():
+            # Slow subscriber: drop its oldest notification
+            queue.get_nowait()
+        queue.put_nowait(change)
+
+
+async def record_change(collection_name: str, operation: str, document_id=None):
+    """Record a write in the change log when change streams are not available."""
+    if not use_change_log:
+        return
+    await database[CHANGE_LOG_NAME].insert_one(
+        {
+            "collection": collection_name,
+            "operation": operation,
+            "id": str(document_id) if document_id is not None else None,
+        }
+    )
+
+
+async def record_changes(collection_name: str, operation: str, document_ids: list):
+    """Record a write of several known documents, as one change per document."""
+    if not use_change_log or not document_ids:
+        return
+    await database[CHANGE_LOG_NAME].insert_many(
+        [
+            {"collection": collection_name, "operation": operation, "id": str(oid)}
+            for oid in document_ids
+        ]
+    )
+
+
+async def supports_change_streams() -> bool:
+    hello = await client.admin.command("hello")
+    # Replica set members and mongos routers both support change streams
+    return "setName" in hello or hello.get("msg") == "isdbgrid"
+
+
+async def setup():
+    """Pick the change source; to call before serving requests."""
+    global use_change_log
+    use_change_log = not await supports_change_streams()
+    if use_change_log:
+        logger.info("No replica set, falling back to the change log collection")
+        if CHANGE_LOG_NAME not in await database.list_collection_names():
+            await database.create_collection(
+                CHANGE_LOG_NAME, capped=True, size=CHANGE_LOG_SIZE
+            )
+
+
+async def mark_start():
+    """Mark the current position of the changes; to call before loading the caches."""
+    if use_change_log:
+        last = await database[CHANGE_LOG_NAME].find_one(sort=[("$natural", -1)])
+        start["last_id"] = last["_id"] if last else None
+    else:
+        hello = await client.admin.command("hello")
+        start["operation_time"] = hello.get("operationTime")
+        # Opened now, so that it starts from here on any server
+        start["stream"] = open_stream(operation_time=start["operation_time"])
+
+
+def open_stream(resume_token=None, operation_time=None):
+    # After the last published change, or else from the marked position
+    if resume_token is not None:
+        return database.watch(WATCH_PIPELINE, resume_after=resume_token)
+    return database.watch(WATCH_PIPELINE, start_at_operation_time=operation_time)
+
+
+async def watch_change_stream(stream, operation_time=None):
+    resume_token = None
+    while True:
+        try:
+            async with stream:
+                async for event in stream:
+                    resume_token = stream.resume_token
+                    document_key = event.get("documentKey", {})
+                    await publish(
+                        {
+                            "collection": event["ns"]["coll"],
+                            "operation": event["operationType"],
+                            "id": str(document_key["_id"]) if document_key else None,
+                        }
+                    )
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Change stream interrupted, resuming")
+            await asyncio.sleep(RETRY_DELAY_SECONDS)
+        stream = open_stream(resume_token, operation_time)
+
+
+async def tail_change_log(last_id=None):
+    change_log = database[CHANGE_LOG_NAME]
+    while True:
+        try:
+            query = {"_id": {"$gt": last_id}} if last_id else {}
+            cursor = change_log.find(query, cursor_type=CursorType.TAILABLE_AWAIT)
+            while cursor.alive:
+                async for entry in cursor:
+                    last_id = entry["_id"]
+                    await publish(
+                        {
+                            "collection": entry["collection"],
+                            "operation": entry["operation"],
+                            "id": entry["id"],
+                        }
+                    )
+                await asyncio.sleep(RETRY_DELAY_SECONDS)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Change log tailing interrupted, resuming")
+        # A tailable cursor on an empty capped collection dies immediately
+        await asyncio.sleep(RETRY_DELAY_SECONDS)
+
+
+async def run():
+    if not start:
+        await mark_start()
+    if use_change_log:
+        await tail_change_log(start["last_id"])
+    else:
+        await watch_change_stream(start["stream"], start["operation_time"])
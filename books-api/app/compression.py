@@ -0,0 +1,199 @@
+"""Negotiated response compression: zstd, brotli or gzip.
+
+brotli and zstd are used when their optional packages (``brotli``,
+``zstandard``) are installed. Responses smaller than the minimum size stay
+uncompressed; streamed responses are compressed chunk by chunk and flushed
+so that the client receives each chunk as it is produced.
+"""
+
+import zlib
+from functools import partial
+
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Content types never compressed: already compressed, or event streams whose
+# keep-alive comments must reach the client unbuffered
+SKIPPED_CONTENT_TYPES = (
+    "image/",
+    "video/",
+    "audio/",
+    "application/zip",
+    "text/event-stream",
+)
+
+# Fast levels, favoring latency over ratio (see the COMPRESSION_*_LEVEL settings)
+DEFAULT_LEVELS = {"zstd": 3, "br": 4, "gzip": 6}
+
+
+class GzipEncoder:
+    def __init__(self, level: int):
+        # wbits=31: gzip container
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes, flush: bool) -> bytes:
+        output = self.compressor.compress(data)
+        return output + self.compressor.flush(zlib.Z_SYNC_FLUSH) if flush else output
+
+    def finish(self) -> bytes:
+        return self.compressor.flush()
+
+
+class BrotliEncoder:
+    def __init__(self, level: int):
+        self.compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data: bytes, flush: bool) -> bytes:
+        output = self.compressor.process(data)
+        return output + self.compressor.flush() if flush else output
+
+    def finish(self) -> bytes:
+        return self.compressor.finish()
+
+
+class ZstdEncoder:
+    def __init__(self, level: int):
+        self.compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data: bytes, flush: bool) -> bytes:
+        output = self.compressor.compress(data)
+        if flush:
+            output += self.compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+        return output
+
+    def finish(self) -> bytes:
+        return self.compressor.flush()
+
+
+def available_encoders() -> dict:
+    """Encoders of the installed codecs, in server preference order."""
+    encoders = {}
+    if zstandard is not None:
+        encoders["zstd"] = ZstdEncoder
+    if brotli is not None:
+        encoders["br"] = BrotliEncoder
+    encoders["gzip"] = GzipEncoder
+    return encoders
+
+
+def negotiate(accept_encoding: str, encodings: list) -> str:
+    """Pick the encoding with the highest client weight, ties going to the server order."""
+    weights = {}
+    for item in accept_encoding.lower().split(","):
+        name, _, parameters = item.partition(";")
+        weight = 1.0
+        parameter, _, value = parameters.strip().partition("=")
+        if parameter == "q":
+            try:
+                weight = float(value)
+            except ValueError:
+                weight = 0.0
+        weights[name.strip()] = weight
+    best, best_weight = None, 0.0
+    for encoding in encodings:
+        weight = weights.get(encoding, weights.get("*", 0.0))
+        if weight > best_weight:
+            best, best_weight = encoding, weight
+    return best
+
+
+def compressible(headers: Headers) -> bool:
+    content_type = headers.get("content-type", "")
+    return "content-encoding" not in headers and not content_type.startswith(
+        SKIPPED_CONTENT_TYPES
+    )
+
+
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size: int = 1024, levels: dict = None):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.levels = {**DEFAULT_LEVELS, **(levels or {})}
+        self.encoders = available_encoders()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        accept_encoding = Headers(scope=scope).get("accept-encoding", "")
+        encoding = negotiate(accept_encoding, list(self.encoders))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        encoder_factory = partial(self.encoders[encoding], self.levels[encoding])
+        responder = CompressionResponder(
+            send, encoder_factory, encoding, self.minimum_size
+        )
+        await self.app(scope, receive, responder.send)
+
+
+class CompressionResponder:
+    """Wrap the ``send`` of one response, compressing its body when worth it."""
+
+    def __init__(self, send, encoder_factory, encoding: str, minimum_size: int):
+        self.downstream = send
+        self.encoder_factory = encoder_factory
+        self.encoding = encoding
+        self.minimum_size = minimum_size
+        self.start_message = None
+        self.started = False
+        self.encoder = None
+
+    async def send(self, message):
+        if message["type"] == "http.response.start":
+            # Held back until the first body chunk tells the response size
+            self.start_message = message
+            return
+        if message["type"] != "http.response.body":
+            await self.downstream(message)
+            return
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if not self.started:
+            self.started = True
+            await self.start(body, more_body)
+            return
+        if self.encoder is None:
+            await self.downstream(message)
+            return
+        if more_body:
+            body = self.encoder.compress(body, flush=True)
+        else:
+            body = self.encoder.compress(body, flush=False) + self.encoder.finish()
+        await self.downstream(
+            {"type": "http.response.body", "body": body, "more_body": more_body}
+        )
+
+    async def start(self, body: bytes, more_body: bool):
+        headers = MutableHeaders(raw=self.start_message["headers"])
+        if not compressible(headers) or (
+            not more_body and len(body) < self.minimum_size
+        ):
+            await self.downstream(self.start_message)
+            await self.downstream(
+                {"type": "http.response.body", "body": body, "more_body": more_body}
+            )
+            return
+        self.encoder = self.encoder_factory()
+        headers["Content-Encoding"] = self.encoding
+        headers.add_vary_header("Accept-Encoding")
+        if more_body:
+            # Streamed: the compressed length is unknown
+            del headers["Content-Length"]
+            body = self.encoder.compress(body, flush=True)
+        else:
+            body = self.encoder.compress(body, flush=False) + self.encoder.finish()
+            headers["Content-Length"] = str(len(body))
+        await self.downstream(self.start_message)
+        await self.downstream(
+            {"type": "http.response.body", "body": body, "more_body": more_body}
+        )
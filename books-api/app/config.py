@@ -0,0 +1,95 @@
+"""Runtime settings, read from the environment."""
+
+import os
+
+# Storage backend: "motor" (MongoDB) or "memory" (in-process, for tests and benchmarks)
+DB_BACKEND = os.getenv("DB_BACKEND", "motor")
+MONGO_DETAILS = os.getenv("MONGO_DETAILS", "mongodb://mongodb:27017")
+
+# Pool connections opened at startup, before taking traffic (0 to disable)
+WARMUP_CONNECTIONS = int(os.getenv("WARMUP_CONNECTIONS", "4"))
+
+# Overdue loans detection
+OVERDUE_SCHEDULER_ENABLED = os.getenv("OVERDUE_SCHEDULER_ENABLED", "true") == "true"
+OVERDUE_CHECK_INTERVAL_SECONDS = int(
+    os.getenv("OVERDUE_CHECK_INTERVAL_SECONDS", "3600")
+)
+
+# Change notifications (change stream, or change log on standalone servers)
+CHANGE_FEED_ENABLED = os.getenv("CHANGE_FEED_ENABLED", "true") == "true"
+
+# Loan purges: deleted in batches, with a pause between two batches
+PURGE_BATCH_SIZE = int(os.getenv("PURGE_BATCH_SIZE", "500"))
+PURGE_BATCH_DELAY_SECONDS = float(os.getenv("PURGE_BATCH_DELAY_SECONDS", "0.1"))
+
+# Loan history tiering: returned loans move to loans_archive after this age
+LOANS_ARCHIVE_ENABLED = os.getenv("LOANS_ARCHIVE_ENABLED", "true") == "true"
+LOANS_ARCHIVE_AFTER_DAYS = int(os.getenv("LOANS_ARCHIVE_AFTER_DAYS", "365"))
+LOANS_ARCHIVE_INTERVAL_SECONDS = int(
+    os.getenv("LOANS_ARCHIVE_INTERVAL_SECONDS", "86400")
+)
+LOANS_ARCHIVE_BATCH_SIZE = int(os.getenv("LOANS_ARCHIVE_BATCH_SIZE", "1000"))
+
+# Books updated per update_many when an author change is fanned out to their books
+AUTHOR_SUMMARY_BATCH_SIZE = int(os.getenv("AUTHOR_SUMMARY_BATCH_SIZE", "500"))
+
+# Response compression; zstd and brotli need the zstandard and brotli packages
+COMPRESSION_ENABLED = os.getenv("COMPRESSION_ENABLED", "true") == "true"
+COMPRESSION_MINIMUM_SIZE = int(os.getenv("COMPRESSION_MINIMUM_SIZE", "1024"))
+COMPRESSION_GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "6"))
+COMPRESSION_BROTLI_LEVEL = int(os.getenv("COMPRESSION_BROTLI_LEVEL", "4"))
+COMPRESSION_ZSTD_LEVEL = int(os.getenv("COMPRESSION_ZSTD_LEVEL", "3"))
+
+# Idempotency-Key support on the POST endpoints: responses are replayed for this
+# long, and a request still pending after the lock delay may be retried
+IDEMPOTENCY_ENABLED = os.getenv("IDEMPOTENCY_ENABLED", "true") == "true"
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+IDEMPOTENCY_LOCK_SECONDS = int(os.getenv("IDEMPOTENCY_LOCK_SECONDS", "60"))
+
+# OpenTelemetry tracing (needs opentelemetry-sdk): exporter "otlp" (to the
+# OTEL_EXPORTER_OTLP_ENDPOINT collector), "console" or "file" (JSON lines)
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "false") == "true"
+TRACING_EXPORTER = os.getenv("TRACING_EXPORTER", "otlp")
+TRACING_FILE = os.getenv("TRACING_FILE", "traces.jsonl")
+TRACING_SAMPLE_RATIO = float(os.getenv("TRACING_SAMPLE_RATIO", "1.0"))
+
+# Profiling endpoints under /admin/profile (librarians only) and per-route CPU counters
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false") == "true"
+PROFILE_MAX_SECONDS = int(os.getenv("PROFILE_MAX_SECONDS", "60"))
+
+# Read routing: list, search, export and report reads go to the secondaries
+# (falling back to the primary) when not lagging more than the max staleness
+# (90 s at least); READ_ROUTES overrides the route of repository functions,
+# e.g. "books_repository.find_all=primary,loans_repository.count_loans=secondary"
+SECONDARY_READS_ENABLED = os.getenv("SECONDARY_READS_ENABLED", "true") == "true"
+SECONDARY_READS_MAX_STALENESS_SECONDS = int(
+    os.getenv("SECONDARY_READS_MAX_STALENESS_SECONDS", "90")
+)
+READ_ROUTES = os.getenv("READ_ROUTES", "")
+
+# Write-behind batching of the loan inserts: concurrent POST /loans/ wait for
+# at most the window (or a full batch) and are written with one insert_many.
+# The write concern ("1", "majority"...) and journal ("true"/"false") of the
+# batches default to the client's
+LOAN_INSERT_BATCHING_ENABLED = (
+    os.getenv("LOAN_INSERT_BATCHING_ENABLED", "false") == "true"
+)
+LOAN_INSERT_BATCH_SIZE = int(os.getenv("LOAN_INSERT_BATCH_SIZE", "100"))
+LOAN_INSERT_BATCH_WINDOW_MS = float(os.getenv("LOAN_INSERT_BATCH_WINDOW_MS", "5"))
+LOAN_INSERT_WRITE_CONCERN = os.getenv("LOAN_INSERT_WRITE_CONCERN", "")
+LOAN_INSERT_JOURNAL = os.getenv("LOAN_INSERT_JOURNAL", "")
+
+# Background upgrade of the books and loans to the current schema version, by
+# batches with a pause in between (the documents read are upgraded on the fly)
+SCHEMA_MIGRATION_ENABLED = os.getenv("SCHEMA_MIGRATION_ENABLED", "true") == "true"
+SCHEMA_MIGRATION_BATCH_SIZE = int(os.getenv("SCHEMA_MIGRATION_BATCH_SIZE", "200"))
+SCHEMA_MIGRATION_BATCH_DELAY_SECONDS = float(
+    os.getenv("SCHEMA_MIGRATION_BATCH_DELAY_SECONDS", "0.5")
+)
+
+# In-process columnar snapshot of all the books, serving the GET /books/ lists
+# filtered on type, language, author_id and publication date only (needs the
+# change feed to stay current). Above the max books, each worker drops it and
+# reads the lists from MongoDB, which bounds its memory
+CATALOGUE_SNAPSHOT_ENABLED = os.getenv("CATALOGUE_SNAPSHOT_ENABLED", "false") == "true"
+CATALOGUE_SNAPSHOT_MAX_BOOKS = int(os.getenv("CATALOGUE_SNAPSHOT_MAX_BOOKS", "1000000"))
@@ -1,12 +1,53 @@
 from typing import List, Optional
 
-from app.schemas import Adherent, AdherentCreate, Loan, LoginRequest, Token
+from app.pagination import MAX_PAGE_SIZE
+from app.schemas import (
+    Adherent,
+    AdherentCreate,
+    Loan,
+    LoginRequest,
+    SortOrder,
+    Token,
+)
+from app.text import SEARCH_MAX_RESULTS
 from app.use_cases import adherent_use_case
-from fastapi import APIRouter, HTTPException, status
+from fastapi import APIRouter, HTTPException, Query, Response, status
 
 router = APIRouter()
 
 
+@router.get(
+    "/search",
+    response_model=List[Adherent],
+    summary="Search adherents",
+)
+async def search_adherents(
+    q: str = Query(..., min_length=1),
+    limit: int = Query(10, ge=1, le=SEARCH_MAX_RESULTS),
+):
+    """
+    Find adherents by the beginning of their last name, first name,
+    membership number or login, ignoring case and accents.
+
+    - **q**: Searched text; every word must start one of the adherent's names or identifiers.
+    - **limit**: Maximum number of adherents to return (at most 50).
+
+    Exact membership number or login matches come first, then last name
+    matches, then first name matches.
+
+    **Example Request:**
+    ```
+    GET /adherents/search?q=dupo
+    ```
+    """
+    adherents = await adherent_use_case.search_adherents_use_case(q, limit)
+    if adherents:
+        return adherents
+    raise HTTPException(
+        status_code=status.HTTP_404_NOT_FOUND, detail="No adherents found"
+    )
+
+
 @router.get(
     "/{adherent_id}",
     response_model=Adherent,
@@ -208,16 +249,39 @@ async def login(login_request: LoginRequest):
     response_model=List[Loan],
     summary="Retrieve loans for an adherent",
 )
-async def get_loans_for_adherent(adherent_id: str):
+async def get_loans_for_adherent(
+    adherent_id: str,
+    response: Response,
+    limit: int = Query(10, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+    order: SortOrder = SortOrder.desc,
+):
     """
-    Retrieve a list of loans for a specific adherent.
+    Retrieve the loans of a specific adherent, most recent first.
+
+    **Query Parameters:**
+    - **limit**: Maximum number of loans to return (at most 100).
+    - **after**: Cursor returned in the `X-Next-Cursor` header of the previous page.
+    - **order**: `desc` (default, most recent loans first) or `asc`.
+
+    When more loans are available, the response carries an `X-Next-Cursor`
+    header to pass as `after` to fetch the next page.
 
     **Exemple :**
     ```
-    GET /adherents/60b725f10c9f1e23d8f3a3e9/loans
+    GET /adherents/60b725f10c9f1e23d8f3a3e9/loans?limit=20
     ```
     """
-    loans = await adherent_use_case.get_loans_by_adherent_use_case(adherent_id)
+    try:
+        loans, next_cursor = await adherent_use_case.get_loans_by_adherent_use_case(
+            adherent_id, limit, after, order
+        )
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor"
+        )
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
     if loans:
         return loans
     raise HTTPException(
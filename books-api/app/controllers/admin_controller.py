@@ -0,0 +1,188 @@
+import asyncio
+from typing import List
+
+from app import profiling, sharding
+from app.auth import require_librarian
+from app.config import PROFILE_MAX_SECONDS
+from app.schemas import AllocationDiff, QueryShape, RouteCpuTime
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.responses import PlainTextResponse
+
+# Every route below requires a librarian's bearer token. The profiling routes
+# are mounted with PROFILING_ENABLED only; the query shapes are always served,
+# as they are always recorded
+router = APIRouter(dependencies=[Depends(require_librarian)])
+query_shapes_router = APIRouter(dependencies=[Depends(require_librarian)])
+
+
+@router.post(
+    "/profile/cpu",
+    response_class=PlainTextResponse,
+    summary="Sample the CPU profile of this worker",
+)
+async def profile_cpu(
+    seconds: float = Query(10, gt=0, le=PROFILE_MAX_SECONDS),
+    interval_ms: float = Query(10, ge=1, le=1000),
+    include_idle: bool = False,
+):
+    """
+    Sample the Python stacks of the worker serving the request for a few
+    seconds, and return them as folded stacks (`frame;frame;frame count`),
+    the input format of flamegraph.pl, speedscope and inferno.
+
+    - **seconds**: Sampling duration (at most `PROFILE_MAX_SECONDS`).
+    - **interval_ms**: Delay between two samples.
+    - **include_idle**: Keep the samples of threads waiting for work.
+
+    Only one profile runs at a time per worker; with several workers, each
+    request profiles the worker that receives it.
+
+    **Example Request:**
+    ```
+    POST /admin/profile/cpu?seconds=30
+    ```
+    """
+    try:
+        stacks = await asyncio.to_thread(
+            profiling.sample_stacks, seconds, interval_ms / 1000, include_idle
+        )
+    except RuntimeError as error:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(error))
+    return profiling.format_folded(stacks)
+
+
+@router.post(
+    "/profile/memory",
+    status_code=status.HTTP_204_NO_CONTENT,
+    summary="Start tracing the memory allocations",
+)
+async def start_memory_profile():
+    """
+    Start tracing the memory allocations of this worker with tracemalloc, and
+    take the base snapshot. Tracing slows the allocations down: stop it when
+    done.
+
+    **Example Request:**
+    ```
+    POST /admin/profile/memory
+    ```
+    """
+    profiling.start_allocations()
+
+
+@router.get(
+    "/profile/memory",
+    response_model=List[AllocationDiff],
+    summary="Top allocators since the previous snapshot",
+)
+async def get_memory_profile(
+    top: int = Query(20, ge=1, le=100),
+    group_by: str = Query("lineno", pattern="^(lineno|filename|traceback)$"),
+):
+    """
+    Take a tracemalloc snapshot and return the locations whose allocated
+    memory grew the most since the previous snapshot, which it replaces.
+
+    - **top**: Number of locations to return.
+    - **group_by**: `lineno` (default), `filename` or `traceback`.
+
+    **Example Request:**
+    ```
+    GET /admin/profile/memory?top=10
+    ```
+    """
+    try:
+        return profiling.take_allocations(top, group_by)
+    except RuntimeError as error:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(error))
+
+
+@router.delete(
+    "/profile/memory",
+    status_code=status.HTTP_204_NO_CONTENT,
+    summary="Stop tracing the memory allocations",
+)
+async def stop_memory_profile():
+    """
+    Stop tracing the memory allocations and drop the snapshots.
+
+    **Example Request:**
+    ```
+    DELETE /admin/profile/memory
+    ```
+    """
+    profiling.stop_allocations()
+
+
+@router.get(
+    "/profile/routes",
+    response_model=List[RouteCpuTime],
+    summary="CPU time per route",
+)
+async def get_route_cpu_time():
+    """
+    Retrieve the CPU time spent serving each route by this worker since it
+    started (or since the counters were reset), most expensive first.
+    Requests in flight at the same time share the CPU time used meanwhile.
+
+    **Example Request:**
+    ```
+    GET /admin/profile/routes
+    ```
+    """
+    return profiling.route_cpu.report()
+
+
+@router.delete(
+    "/profile/routes",
+    status_code=status.HTTP_204_NO_CONTENT,
+    summary="Reset the CPU time per route",
+)
+async def reset_route_cpu_time():
+    """
+    Reset the CPU time counters of this worker.
+
+    **Example Request:**
+    ```
+    DELETE /admin/profile/routes
+    ```
+    """
+    profiling.route_cpu.reset()
+
+
+@query_shapes_router.get(
+    "/query-shapes",
+    response_model=List[QueryShape],
+    summary="Shapes of the loans queries",
+)
+async def get_query_shapes():
+    """
+    Retrieve the shapes of the loans queries sent by this worker (filtered
+    fields and operators, without the values), per repository function,
+    with how many times each was sent. The loans are sharded on a hash of
+    `adherent_id`: the shapes that do not filter on it (`targeted: false`)
+    are sent to every shard, and come first.
+
+    **Example Request:**
+    ```
+    GET /admin/query-shapes
+    ```
+    """
+    return sharding.query_shapes.report()
+
+
+@query_shapes_router.delete(
+    "/query-shapes",
+    status_code=status.HTTP_204_NO_CONTENT,
+    summary="Reset the shapes of the loans queries",
+)
+async def reset_query_shapes():
+    """
+    Reset the loans query shape counters of this worker.
+
+    **Example Request:**
+    ```
+    DELETE /admin/query-shapes
+    ```
+    """
+    sharding.query_shapes.reset()
@@ -1,12 +1,47 @@
 from typing import List, Optional
 
-from app.schemas import Author, AuthorCreate
+from app.pagination import MAX_PAGE_SIZE
+from app.references import ReferenceInUseError
+from app.schemas import Author, AuthorCreate, SortOrder
+from app.text import SEARCH_MAX_RESULTS
 from app.use_cases import authors_use_case
-from fastapi import APIRouter, HTTPException, status
+from fastapi import APIRouter, HTTPException, Query, Response, status
 
 router = APIRouter()
 
 
+@router.get(
+    "/search",
+    response_model=List[Author],
+    summary="Search authors",
+)
+async def search_authors(
+    q: str = Query(..., min_length=1),
+    limit: int = Query(10, ge=1, le=SEARCH_MAX_RESULTS),
+):
+    """
+    Autocomplete authors by name, ignoring case and accents: every word of
+    the query must start a word of the author's first or last name.
+
+    - **q**: Searched text, e.g. the beginning of a full name (`victor hu`).
+    - **limit**: Maximum number of authors to return (at most 50).
+
+    Authors whose full name (first then last, or last then first) starts
+    with the query come first, then last name matches.
+
+    **Example Request:**
+    ```
+    GET /authors/search?q=hug
+    ```
+    """
+    authors = await authors_use_case.search_authors_use_case(q, limit)
+    if authors:
+        return authors
+    raise HTTPException(
+        status_code=status.HTTP_404_NOT_FOUND, detail="No authors found"
+    )
+
+
 @router.get(
     "/{author_id}",
     response_model=Author,
@@ -141,9 +176,12 @@ async def delete_author(author_id: str):
     ```
 
     **Response:**
-    HTTP 204 No Content
+    HTTP 204 No Content, or 409 Conflict when books still reference the author.
     """
-    success = await authors_use_case.delete_author_use_case(author_id)
+    try:
+        success = await authors_use_case.delete_author_use_case(author_id)
+    except ReferenceInUseError as error:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(error))
     if success:
         return  # HTTP 204 No Content
     raise HTTPException(
@@ -155,18 +193,39 @@ async def delete_author(author_id: str):
     "/{author_id}/books",
     summary="Retrieve books by author",
 )
-async def get_books_by_author(author_id: str):
+async def get_books_by_author(
+    author_id: str,
+    response: Response,
+    limit: int = Query(10, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+    order: SortOrder = SortOrder.asc,
+):
     """
-    Retrieve all books linked to a specific author.
+    Retrieve the books linked to a specific author, one page at a time.
 
     - **author_id**: Unique identifier of the author.
+    - **limit**: Maximum number of books to return (at most 100).
+    - **after**: Cursor returned in the `X-Next-Cursor` header of the previous page.
+    - **order**: `asc` (default) or `desc` insertion order.
+
+    When more books are available, the response carries an `X-Next-Cursor`
+    header to pass as `after` to fetch the next page.
 
     **Example Request:**
     ```
-    GET /authors/60b725f10c9f1e23d8f3a3e9/books
+    GET /authors/60b725f10c9f1e23d8f3a3e9/books?limit=20
     ```
     """
-    books = await authors_use_case.get_books_by_author_use_case(author_id)
+    try:
+        books, next_cursor = await authors_use_case.get_books_by_author_use_case(
+            author_id, limit, after, order
+        )
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor"
+        )
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
     if books:
         return books
     raise HTTPException(
@@ -1,12 +1,87 @@
+from datetime import date
 from typing import List, Optional
 
-from app.schemas import Book, BookCreate, TypeEnum
+from app.export import ndjson
+from app.references import InvalidReferenceError
+from app.schemas import Book, BookCreate, Suggestion, TypeEnum
+from app.text import SEARCH_MAX_RESULTS
 from app.use_cases import books_use_case
-from fastapi import APIRouter, HTTPException, status
+from fastapi import APIRouter, HTTPException, Query, status
+from fastapi.responses import StreamingResponse
 
 router = APIRouter()
 
 
+@router.get(
+    "/suggest",
+    response_model=List[Suggestion],
+    summary="Suggest book titles, publishers and labels",
+)
+async def suggest_books(
+    prefix: str = Query(..., min_length=1),
+    limit: int = Query(10, ge=1, le=SEARCH_MAX_RESULTS),
+):
+    """
+    Autocomplete the catalogue search box, ignoring case and accents.
+
+    - **prefix**: Beginning of a title, publisher or label, or of one of their words.
+    - **limit**: Maximum number of suggestions to return (at most 50).
+
+    Values starting with the prefix come first, then values with a later word
+    starting with it. Suggestions are served from memory and follow the book
+    changes through the change feed; without it, they are read from MongoDB,
+    where accents are not ignored.
+
+    **Example Request:**
+    ```
+    GET /books/suggest?prefix=harry
+    ```
+    """
+    suggestions = await books_use_case.suggest_books_use_case(prefix, limit)
+    if suggestions:
+        return suggestions
+    raise HTTPException(
+        status_code=status.HTTP_404_NOT_FOUND, detail="No suggestions found"
+    )
+
+
+@router.get(
+    "/export",
+    summary="Export books",
+    response_class=StreamingResponse,
+)
+async def export_books(
+    type: Optional[TypeEnum] = None,
+    author_id: Optional[str] = None,
+    publishDate_from: Optional[date] = None,
+    publishDate_to: Optional[date] = None,
+):
+    """
+    Stream all the books matching the filters as newline-delimited JSON
+    (`application/x-ndjson`), one book per line, without pagination.
+
+    - **type**: Filter books by type.
+    - **author_id**: Filter books by author.
+    - **publishDate_from** / **publishDate_to**: Publication date range (YYYY-MM-DD),
+      both bounds included.
+
+    The export is compressed when the client accepts it (`zstd`, `br` or `gzip`).
+    Responds 400 when `author_id` is not a valid identifier.
+
+    **Example Request:**
+    ```
+    GET /books/export?type=web
+    ```
+    """
+    try:
+        books = await books_use_case.export_books_use_case(
+            type, author_id, publishDate_from, publishDate_to
+        )
+    except ValueError as error:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(error))
+    return StreamingResponse(ndjson(books), media_type="application/x-ndjson")
+
+
 @router.get(
     "/{book_id}",
     response_model=Book,
@@ -40,13 +115,15 @@ async def get_books(
     location: Optional[str] = None,
     label: Optional[str] = None,
     type: Optional[TypeEnum] = None,
-    publishDate: Optional[str] = None,
+    publishDate: Optional[date] = None,
     publisher: Optional[str] = None,
     language: Optional[str] = None,
     link: Optional[str] = None,
     author_id: Optional[str] = None,
     skip: int = 0,
     limit: int = 10,
+    publishDate_from: Optional[date] = None,
+    publishDate_to: Optional[date] = None,
 ):
     """
     Retrieve a list of books with optional filtering.
@@ -57,6 +134,8 @@ async def get_books(
     - **label**: Filter books by label.
     - **type**: Filter books by type.
     - **publishDate**: Filter books by publication date.
+    - **publishDate_from**: Only books published on or after this date.
+    - **publishDate_to**: Only books published on or before this date.
     - **publisher**: Filter books by publisher.
     - **language**: Filter books by language.
     - **link**: Filter books by link.
@@ -67,22 +146,29 @@ async def get_books(
     **Example Request:**
     ```
     GET /books/?title=Introduction%20to%20Data%20Science&location=Shelf%20A1&skip=0&limit=10
+    GET /books/?publishDate_from=2020-01-01&publishDate_to=2020-12-31
     ```
     """
-    books = await books_use_case.list_books_use_case(
-        title,
-        description,
-        location,
-        label,
-        type,
-        publishDate,
-        publisher,
-        language,
-        link,
-        author_id,
-        skip,
-        limit,
-    )
+    try:
+        books = await books_use_case.list_books_use_case(
+            title,
+            description,
+            location,
+            label,
+            type,
+            publishDate,
+            publisher,
+            language,
+            link,
+            author_id,
+            skip,
+            limit,
+            publishDate_from,
+            publishDate_to,
+        )
+    except ValueError:
+        # No book can reference an invalid author id
+        books = None
     if books:
         return books
     raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No books found")
@@ -126,8 +212,15 @@ async def create_book(book: BookCreate):
          "author_id": "67a9d9fb635513c2db4d794d"
      }
      ```
+
+    Responds 422 when the author does not exist.
     """
-    created_book = await books_use_case.create_book_use_case(book)
+    try:
+        created_book = await books_use_case.create_book_use_case(book)
+    except InvalidReferenceError as error:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(error)
+        )
     return created_book
 
 
@@ -158,8 +251,15 @@ async def update_book(book_id: str, book: BookCreate):
         "author_id": "67a9d9fb635513c2db4d794d"
     }
     ```
+
+    Responds 422 when the author does not exist.
     """
-    updated_book = await books_use_case.update_book_use_case(book_id, book)
+    try:
+        updated_book = await books_use_case.update_book_use_case(book_id, book)
+    except InvalidReferenceError as error:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(error)
+        )
     if updated_book:
         return updated_book
     raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Book not found")
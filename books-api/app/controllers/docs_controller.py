@@ -0,0 +1,45 @@
+from app import openapi_schema
+from app.compression import negotiate
+from fastapi import APIRouter, Request, Response, status
+from fastapi.openapi.docs import get_redoc_html, get_swagger_ui_html
+
+router = APIRouter()
+
+
+def schema_url(request: Request) -> str:
+    return request.scope.get("root_path", "") + "/openapi.json"
+
+
+@router.get("/openapi.json", include_in_schema=False)
+async def get_openapi(request: Request):
+    """Serve the pre-generated schema; clients revalidate it with its ETag."""
+    schema = openapi_schema.load(request.app)
+    encoding = negotiate(request.headers.get("accept-encoding", ""), ["gzip"])
+    # Each encoding is a distinct representation, with its own strong ETag
+    etag = schema["etag"] if encoding is None else schema["etag"][:-1] + '-gzip"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "public, no-cache",
+        "Vary": "Accept-Encoding",
+    }
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    if encoding is not None:
+        headers["Content-Encoding"] = encoding
+        return Response(schema["gzip"], media_type="application/json", headers=headers)
+    return Response(schema["body"], media_type="application/json", headers=headers)
+
+
+@router.get("/docs", include_in_schema=False)
+async def get_swagger_ui(request: Request):
+    return get_swagger_ui_html(
+        openapi_url=schema_url(request), title=f"{request.app.title} - Swagger UI"
+    )
+
+
+@router.get("/redoc", include_in_schema=False)
+async def get_redoc(request: Request):
+    return get_redoc_html(
+        openapi_url=schema_url(request), title=f"{request.app.title} - ReDoc"
+    )
@@ -0,0 +1,66 @@
+import asyncio
+import json
+
+from app import change_feed
+from fastapi import APIRouter, HTTPException, status
+from fastapi.responses import StreamingResponse
+
+router = APIRouter()
+
+# Comment line sent when idle so that proxies keep the connection open
+KEEP_ALIVE_SECONDS = 15
+
+
+async def stream_changes(queue: asyncio.Queue):
+    try:
+        while True:
+            try:
+                change = await asyncio.wait_for(queue.get(), KEEP_ALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            yield f"event: change\ndata: {json.dumps(change)}\n\n"
+    finally:
+        change_feed.unsubscribe(queue)
+
+
+@router.get(
+    "/",
+    summary="Follow changes",
+    response_class=StreamingResponse,
+)
+async def get_events(collections: str = ",".join(change_feed.WATCHED_COLLECTIONS)):
+    """
+    Stream the changes made to the collections as Server-Sent Events.
+
+    - **collections**: Comma-separated list among `books`, `authors`,
+      `adherents` and `loans` (all of them by default).
+
+    Each event carries the collection, the operation (`insert`, `update`,
+    `replace` or `delete`) and the document identifier, which is `null`
+    when several documents changed at once.
+
+    **Example Request:**
+    ```
+    GET /events?collections=books,loans
+    ```
+
+    **Example Event:**
+    ```
+    event: change
+    data: {"collection": "books", "operation": "update", "id": "67a36d9a198cd394f628c25c"}
+    ```
+    """
+    requested = {name.strip() for name in collections.split(",") if name.strip()}
+    unknown = requested - set(change_feed.WATCHED_COLLECTIONS)
+    if not requested or unknown:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown collections: {', '.join(sorted(unknown))}",
+        )
+    queue = change_feed.subscribe(requested)
+    return StreamingResponse(
+        stream_changes(queue),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
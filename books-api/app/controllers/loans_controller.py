@@ -1,13 +1,100 @@
-import re
+from datetime import date
 from typing import List, Optional
 
-from app.schemas import Loan, LoanCreate
+from app.export import ndjson
+from app.pagination import MAX_PAGE_SIZE
+from app.references import InvalidReferenceError
+from app.schemas import Loan, LoanCreate, PurgeJob
 from app.use_cases import loans_use_case
-from fastapi import APIRouter, HTTPException, status
+from fastapi import APIRouter, HTTPException, Query, Response, status
+from fastapi.responses import StreamingResponse
 
 router = APIRouter()
 
 
+@router.get(
+    "/overdue",
+    response_model=List[Loan],
+    summary="List overdue loans",
+)
+async def get_overdue_loans(
+    response: Response,
+    limit: int = Query(10, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+):
+    """
+    Retrieve the loans not returned before their deadline, oldest deadline first.
+
+    - **limit**: Maximum number of loans to return (at most 100).
+    - **after**: Cursor returned in the `X-Next-Cursor` header of the previous page.
+
+    Loans are flagged as overdue when created or updated, and by a background
+    job that runs periodically.
+
+    **Example Request:**
+    ```
+    GET /loans/overdue?limit=50
+    ```
+    """
+    try:
+        loans, next_cursor = await loans_use_case.list_overdue_loans_use_case(
+            limit, after
+        )
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor"
+        )
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    if loans:
+        return loans
+    raise HTTPException(
+        status_code=status.HTTP_404_NOT_FOUND, detail="No overdue loans found"
+    )
+
+
+@router.get(
+    "/export",
+    summary="Export loans",
+    response_class=StreamingResponse,
+)
+async def export_loans(
+    book_id: Optional[str] = None,
+    adherent_id: Optional[str] = None,
+    loanDate_from: Optional[date] = None,
+    loanDate_to: Optional[date] = None,
+    overdue: bool = False,
+):
+    """
+    Stream all the loans matching the filters as newline-delimited JSON
+    (`application/x-ndjson`), one loan per line, without pagination.
+
+    - **book_id**: Filter loans by book.
+    - **adherent_id**: Filter loans by adherent.
+    - **loanDate_from** / **loanDate_to**: Loan date range (YYYY-MM-DD), both bounds included.
+    - **overdue**: Only export the loans not returned before their deadline.
+
+    Responds 400 when `book_id` or `adherent_id` is not a valid identifier.
+
+    Without filters, only the loans not archived yet are exported. Archived
+    loans are included unless the filters exclude them (open loans, or dates
+    after the archive cutoff).
+    The export is compressed when the client accepts it (`zstd`, `br` or `gzip`).
+
+    **Example Request:**
+    ```
+    GET /loans/export?loanDate_from=2024-09-01&loanDate_to=2025-06-30
+    ```
+    """
+    try:
+        loans = await loans_use_case.export_loans_use_case(
+            book_id, adherent_id, loanDate_from, loanDate_to, overdue
+        )
+    except ValueError as error:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(error))
+    return StreamingResponse(ndjson(loans), media_type="application/x-ndjson")
+
+
 @router.get(
     "/{loan_id}",
     response_model=Loan,
@@ -36,12 +123,15 @@ async def get_loan(loan_id: str):
     summary="List loans",
 )
 async def get_loans(
-    loanDate: Optional[str] = None,
-    returnDate: Optional[str] = None,
+    loanDate: Optional[date] = None,
+    returnDate: Optional[date] = None,
     book_id: Optional[str] = None,
     adherent_id: Optional[str] = None,
     skip: int = 0,
     limit: int = 10,
+    loanDate_from: Optional[date] = None,
+    loanDate_to: Optional[date] = None,
+    overdue: bool = False,
 ):
     """
     Retrieve a list of loans.
@@ -52,25 +142,32 @@ async def get_loans(
     - **adherent_id**: Filter loans by adherent.
     - **skip**: Number of records to skip.
     - **limit**: Maximum number of records to return.
+    - **loanDate_from**: Only loans made on or after this date.
+    - **loanDate_to**: Only loans made on or before this date.
+    - **overdue**: Only loans not returned before their deadline.
+
+    Responds 400 when `book_id` or `adherent_id` is not a valid identifier.
 
     **Example Request:**
     ```
     GET /loans?loanDate=2024-12-26&skip=0&limit=10
+    GET /loans?loanDate_from=2024-09-01&loanDate_to=2024-12-31&overdue=true
     ```
     """
-    if loanDate and not re.match("^[0-9]{4}-[0-1][0-9]-[0-9]{2}$", f"{loanDate}"):
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Invalid loan date format",
-        )
-    if returnDate and not re.match("^[0-9]{4}-[0-1][0-9]-[0-9]{2}$", f"{returnDate}"):
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Invalid return date format",
+    try:
+        loans = await loans_use_case.list_loans_use_case(
+            loanDate,
+            returnDate,
+            book_id,
+            adherent_id,
+            skip,
+            limit,
+            loanDate_from,
+            loanDate_to,
+            overdue,
         )
-    loans = await loans_use_case.list_loans_use_case(
-        loanDate, returnDate, book_id, adherent_id, skip, limit
-    )
+    except ValueError as error:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(error))
     if loans:
         return loans
     raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No loans found")
@@ -89,6 +186,7 @@ async def create_loan(loan: LoanCreate):
     **Request Body:**
     - **loanDate**: loan's date.
     - **returnDate**: loan's return date.
+    - **returned**: whether the book has been returned (defaults to false).
     - **book_id**: borrowed book.
     - **adherent_id**: borrower.
 
@@ -102,8 +200,15 @@ async def create_loan(loan: LoanCreate):
       "adherent_id": "67a9d24b635513c2db4d7946"
     }
     ```
+
+    Responds 422 when the book or the adherent does not exist.
     """
-    created_loan = await loans_use_case.create_loan_use_case(loan)
+    try:
+        created_loan = await loans_use_case.create_loan_use_case(loan)
+    except InvalidReferenceError as error:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(error)
+        )
     return created_loan
 
 
@@ -128,8 +233,15 @@ async def update_loan(loan_id: str, loan: LoanCreate):
       "adherent_id": "67a9d24b635513c2db4d7946"
     }
     ```
+
+    Responds 422 when the book or the adherent does not exist.
     """
-    updated_loan = await loans_use_case.update_loan_use_case(loan_id, loan)
+    try:
+        updated_loan = await loans_use_case.update_loan_use_case(loan_id, loan)
+    except InvalidReferenceError as error:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(error)
+        )
     if updated_loan:
         return updated_loan
     raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="loan not found")
@@ -160,40 +272,79 @@ async def delete_loan(loan_id: str):
 
 @router.delete(
     "/",
-    status_code=status.HTTP_204_NO_CONTENT,
-    summary="Delete an loan",
+    response_model=PurgeJob,
+    status_code=status.HTTP_202_ACCEPTED,
+    summary="Delete loans in bulk",
 )
 async def delete_all_loan(
-    loanDate: Optional[str] = None,
-    returnDate: Optional[str] = None,
+    response: Response,
+    loanDate: Optional[date] = None,
+    returnDate: Optional[date] = None,
     book_id: Optional[str] = None,
     adherent_id: Optional[str] = None,
+    dry_run: bool = False,
+    archive: bool = False,
 ):
     """
-    Deletes all loans matching the provided filters.
-    Returns the number of deleted loans.
+    Deletes all loans matching the provided filters, as a background job.
+
+    The loans are deleted in small batches so that large purges do not slow
+    down the other requests. Follow the progress with `GET /loans/purges/{job_id}`.
+
+    - **dry_run**: Only count the matching loans (HTTP 200, nothing is deleted).
+    - **archive**: Keep the loans in the `loans_archive` collection, hidden from
+      every read, rather than deleting them.
 
     **Example Request:**
     ```
-    DELETE http://localhost:8000/loans?loanDate=2012-10-10&book_id=0
+    DELETE http://localhost:8000/loans?loanDate=2012-10-10&archive=true
     ```
 
     **Response:**
-    HTTP 204 No Content
+    HTTP 202 Accepted
+    ```
+    {
+      "id": "67b0d2c4e5a1f2b3c4d5e6f7",
+      "status": "pending",
+      "dry_run": false,
+      "archive": true,
+      "matched": 1200,
+      "deleted": 0,
+      "archived": 0,
+      "created_at": "2025-03-26T10:00:00Z"
+    }
+    ```
     """
-    if loanDate and not re.match("^[0-9]{4}-[0-1][0-9]-[0-9]{2}$", f"{loanDate}"):
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Invalid loan date format",
+    try:
+        job = await loans_use_case.delete_all_loan_use_case(
+            loanDate, returnDate, book_id, adherent_id, dry_run, archive
         )
-    if returnDate and not re.match("^[0-9]{4}-[0-1][0-9]-[0-9]{2}$", f"{returnDate}"):
+    except ValueError as error:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(error))
+    if not job["matched"]:
         raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Invalid loan date format",
+            status_code=status.HTTP_404_NOT_FOUND, detail="loan not found"
         )
-    success = await loans_use_case.delete_all_loan_use_case(
-        loanDate, returnDate, book_id, adherent_id
-    )
-    if success:
-        return  # HTTP 204 No Content
-    raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="loan not found")
+    if dry_run:
+        response.status_code = status.HTTP_200_OK
+    return job
+
+
+@router.get(
+    "/purges/{job_id}",
+    response_model=PurgeJob,
+    summary="Retrieve a loan purge",
+)
+async def get_purge_job(job_id: str):
+    """
+    Retrieve the progress of a bulk loan deletion.
+
+    **Example Request:**
+    ```
+    GET /loans/purges/67b0d2c4e5a1f2b3c4d5e6f7
+    ```
+    """
+    job = await loans_use_case.get_purge_job_use_case(job_id)
+    if job:
+        return job
+    raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found")
@@ -0,0 +1,98 @@
+from datetime import date
+from typing import List, Optional
+
+from app.schemas import StatCount
+from app.use_cases import stats_use_case
+from fastapi import APIRouter, HTTPException, Query, status
+
+router = APIRouter()
+
+
+@router.get(
+    "/loans/daily",
+    response_model=List[StatCount],
+    summary="Loans per day",
+)
+async def get_daily_loans(
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+):
+    """
+    Retrieve the number of loans made each day.
+
+    - **date_from**: First day of the period.
+    - **date_to**: Last day of the period.
+
+    **Example Request:**
+    ```
+    GET /stats/loans/daily?date_from=2025-01-01&date_to=2025-01-31
+    ```
+    """
+    stats = await stats_use_case.daily_loans_use_case(date_from, date_to)
+    if stats:
+        return stats
+    raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No loans found")
+
+
+@router.get(
+    "/loans/types",
+    response_model=List[StatCount],
+    summary="Loans per book type",
+)
+async def get_loans_by_type():
+    """
+    Retrieve the number of loans for each book type.
+
+    **Example Request:**
+    ```
+    GET /stats/loans/types
+    ```
+    """
+    stats = await stats_use_case.loans_by_type_use_case()
+    if stats:
+        return stats
+    raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No loans found")
+
+
+@router.get(
+    "/books/top",
+    response_model=List[StatCount],
+    summary="Most borrowed books",
+)
+async def get_top_books(limit: int = Query(10, ge=1, le=100)):
+    """
+    Retrieve the most borrowed books, keyed by book identifier.
+
+    - **limit**: Maximum number of books to return.
+
+    **Example Request:**
+    ```
+    GET /stats/books/top?limit=10
+    ```
+    """
+    stats = await stats_use_case.top_books_use_case(limit)
+    if stats:
+        return stats
+    raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No loans found")
+
+
+@router.get(
+    "/adherents/top",
+    response_model=List[StatCount],
+    summary="Most active adherents",
+)
+async def get_top_adherents(limit: int = Query(10, ge=1, le=100)):
+    """
+    Retrieve the adherents with the most loans, keyed by adherent identifier.
+
+    - **limit**: Maximum number of adherents to return.
+
+    **Example Request:**
+    ```
+    GET /stats/adherents/top?limit=10
+    ```
+    """
+    stats = await stats_use_case.top_adherents_use_case(limit)
+    if stats:
+        return stats
+    raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No loans found")
@@ -1,16 +1,204 @@
-"""Module that provide the database connection."""
+"""Module that provide the database connection.
 
-import motor.motor_asyncio
+The collections below follow the ``Collection`` protocol, implemented by
+Motor and by the in-memory backend (``DB_BACKEND=memory``).
+"""
 
-# Connection details
-MONGO_DETAILS = "mongodb://mongodb:27017"
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Protocol
 
-# Creating an asynchronous client for MongoDB
-client = motor.motor_asyncio.AsyncIOMotorClient(MONGO_DETAILS)
+from app.config import (
+    DB_BACKEND,
+    IDEMPOTENCY_TTL_SECONDS,
+    MONGO_DETAILS,
+    READ_ROUTES,
+    SECONDARY_READS_ENABLED,
+    SECONDARY_READS_MAX_STALENESS_SECONDS,
+)
+from app.tracing import command_listeners
+from pymongo.read_preferences import SecondaryPreferred
+
+
+class Collection(Protocol):
+    """Subset of the Motor collection API the repositories rely on."""
+
+    name: str
+
+    def find(self, filter=None, projection=None, **kwargs): ...
+
+    def aggregate(self, pipeline: list, **kwargs): ...
+
+    def with_options(self, **options): ...
+
+    async def find_one(self, filter=None, projection=None, **kwargs): ...
+
+    async def count_documents(self, filter, **kwargs) -> int: ...
+
+    async def insert_one(self, document: dict, **kwargs): ...
+
+    async def insert_many(self, documents: list, **kwargs): ...
+
+    async def update_one(self, filter, update, **kwargs): ...
+
+    async def update_many(self, filter, update, **kwargs): ...
+
+    async def find_one_and_update(self, filter, update, **kwargs): ...
+
+    async def find_one_and_delete(self, filter, **kwargs): ...
+
+    async def delete_one(self, filter, **kwargs): ...
+
+    async def delete_many(self, filter, **kwargs): ...
+
+    async def bulk_write(self, requests: list, **kwargs): ...
+
+    async def create_index(self, keys, **kwargs): ...
+
+
+if DB_BACKEND == "memory":
+    from app.memory_db import MemoryClient
+
+    client = MemoryClient()
+else:
+    import motor.motor_asyncio
+
+    # Creating an asynchronous client for MongoDB; it connects on the first
+    # operation (the startup warm-up) rather than at import time
+    client = motor.motor_asyncio.AsyncIOMotorClient(
+        MONGO_DETAILS, connect=False, event_listeners=command_listeners()
+    )
 
 database = client.books_api
 
-books_collection = database.get_collection("books")
-authors_collection = database.get_collection("authors")
-adherents_collection = database.get_collection("adherents")
-loans_collection = database.get_collection("loans")
+books_collection: Collection = database.get_collection("books")
+authors_collection: Collection = database.get_collection("authors")
+adherents_collection: Collection = database.get_collection("adherents")
+loans_collection: Collection = database.get_collection("loans")
+
+# Cold tier of the loan history: returned loans older than the configured age,
+# and the loans kept by the purges (flagged, hidden from the reads)
+loans_archive_collection: Collection = database.get_collection("loans_archive")
+
+# Background jobs status (loan purges)
+jobs_collection: Collection = database.get_collection("jobs")
+
+# Pre-aggregated loan counters (per day, book type, book and adherent)
+loan_stats_collection: Collection = database.get_collection("loan_stats")
+
+# Responses of the POST requests sent with an Idempotency-Key header
+idempotency_collection: Collection = database.get_collection("idempotency_keys")
+
+PRIMARY = "primary"
+SECONDARY = "secondary"
+
+# Repository reads served by the secondaries: catalogue lists, searches, exports
+# and reports, which tolerate a few seconds of lag. The others stay on the
+# primary, e.g. the reads by id returning a document just written, the login,
+# and the existence checks of the referenced documents.
+SECONDARY_READS = {
+    "adherent_repository.find_all",
+    "adherent_repository.search",
+    "authors_repository.find_all",
+    "authors_repository.find_books_by_author",
+    "authors_repository.search",
+    "books_repository.find_all",
+    "books_repository.iter_all",
+    "loans_repository.find_all",
+    "loans_repository.find_overdue",
+    "loans_repository.iter_all",
+    "stats_repository.find_by_kind",
+    "stats_repository.find_range",
+    "stats_repository.find_top",
+}
+
+
+def parse_read_routes(overrides: str) -> dict:
+    """Route of each repository function: the defaults, then the overrides."""
+    routes = {operation: SECONDARY for operation in SECONDARY_READS}
+    for override in filter(None, (item.strip() for item in overrides.split(","))):
+        operation, _, route = override.partition("=")
+        if route not in (PRIMARY, SECONDARY):
+            raise ValueError(f"Invalid READ_ROUTES entry: {override}")
+        routes[operation.strip()] = route
+    return routes
+
+
+read_routes = parse_read_routes(READ_ROUTES) if SECONDARY_READS_ENABLED else {}
+
+secondary_preference = SecondaryPreferred(
+    max_staleness=SECONDARY_READS_MAX_STALENESS_SECONDS
+)
+
+# Secondary-reading copies of the collections, by name
+secondary_collections = {}
+
+# Set while loading state that must be current, e.g. caches followed by the change feed
+primary_reads_only = ContextVar("primary_reads_only", default=False)
+
+
+def read_collection(collection: Collection, operation: str) -> Collection:
+    """``collection`` with the read preference of the repository function ``operation``."""
+    if primary_reads_only.get() or read_routes.get(operation) != SECONDARY:
+        return collection
+    secondary = secondary_collections.get(collection.name)
+    if secondary is None:
+        secondary = collection.with_options(read_preference=secondary_preference)
+        secondary_collections[collection.name] = secondary
+    return secondary
+
+
+@contextmanager
+def primary_reads():
+    """Send all the reads made in this block (and the tasks it starts) to the primary."""
+    token = primary_reads_only.set(True)
+    try:
+        yield
+    finally:
+        primary_reads_only.reset(token)
+
+
+async def create_indexes():
+    """Create the indexes backing the API queries (no-op when they already exist)."""
+    # Author's books listing, paginated on _id
+    await books_collection.create_index([("author_id", 1), ("_id", 1)])
+    # Publication date range filters
+    await books_collection.create_index([("publishDate", 1)])
+    # Adherent's loan history, paginated on (loanDate, _id)
+    await loans_collection.create_index(
+        [("adherent_id", 1), ("loanDate", -1), ("_id", -1)]
+    )
+    # Loan period reports and overdue filters
+    await loans_collection.create_index([("loanDate", 1)])
+    await loans_collection.create_index([("returnDate", 1)])
+    # Open loans only: overdue detection job and overdue loans report
+    await loans_collection.create_index(
+        [("overdue", 1), ("returnDate", 1), ("_id", 1)],
+        partialFilterExpression={"returned": False},
+    )
+    # Returned loans due for the cold tier
+    await loans_collection.create_index(
+        [("returnDate", 1), ("_id", 1)],
+        partialFilterExpression={"returned": True},
+    )
+    # Cold tier: adherent history and date range reports
+    await loans_archive_collection.create_index(
+        [("adherent_id", 1), ("loanDate", -1), ("_id", -1)]
+    )
+    await loans_archive_collection.create_index([("loanDate", 1)])
+    await loans_archive_collection.create_index([("returnDate", 1)])
+    # Purge jobs left behind by a stopped worker
+    await jobs_collection.create_index(
+        [("type", 1), ("status", 1), ("heartbeat_at", 1)]
+    )
+    # Author autocomplete: prefix range scans on the normalized name words
+    await authors_collection.create_index([("name_tokens", 1)])
+    # Adherent search: prefix range scans on the normalized name and identifier keys
+    await adherents_collection.create_index([("search_keys", 1)])
+    # Rollups: top lists by count and daily ranges by key
+    await loan_stats_collection.create_index([("kind", 1), ("count", -1)])
+    await loan_stats_collection.create_index([("kind", 1), ("key", 1)])
+    # Stored idempotent responses expire once clients stopped retrying
+    await idempotency_collection.create_index(
+        [("created_at", 1)], expireAfterSeconds=IDEMPOTENCY_TTL_SECONDS
+    )
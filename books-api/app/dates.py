@@ -0,0 +1,23 @@
+"""Helpers to store and query calendar dates as native BSON dates."""
+
+from datetime import date, datetime, time, timedelta, timezone
+
+
+def to_datetime(value: date) -> datetime:
+    """Return ``value`` at midnight, as BSON has no date-only type."""
+    return datetime.combine(value, time.min)
+
+
+def today() -> datetime:
+    """Return the current UTC day at midnight."""
+    return to_datetime(datetime.now(timezone.utc).date())
+
+
+def date_range(date_from: date = None, date_to: date = None) -> dict:
+    """Build a range condition covering whole days, both bounds included."""
+    condition = {}
+    if date_from:
+        condition["$gte"] = to_datetime(date_from)
+    if date_to:
+        condition["$lt"] = to_datetime(date_to) + timedelta(days=1)
+    return condition
@@ -0,0 +1,19 @@
+"""Newline-delimited JSON exports, streamed chunk by chunk."""
+
+import json
+
+# Documents fetched per cursor batch, and serialized per response chunk
+BATCH_SIZE = 500
+
+
+async def ndjson(documents, chunk_size: int = BATCH_SIZE):
+    """Serialize an async iterable of documents as NDJSON text chunks."""
+    lines = []
+    async for document in documents:
+        # default=str: ObjectIds and dates
+        lines.append(json.dumps(document, default=str))
+        if len(lines) >= chunk_size:
+            yield "\n".join(lines) + "\n"
+            lines = []
+    if lines:
+        yield "\n".join(lines) + "\n"
@@ -0,0 +1,185 @@
+"""Idempotency-Key support for the POST endpoints creating documents.
+
+The first response to a key is stored in the ``idempotency_keys`` collection
+(TTL indexed) and replayed to the retries, which then cost a lookup instead
+of a write. Concurrent duplicates are coalesced: within the process they
+wait for the first request, across processes they get a 409 asking them to
+retry. Server errors are not stored, so that the key can be retried.
+"""
+
+import asyncio
+import hashlib
+from datetime import datetime, timedelta, timezone
+
+from app.repositories import idempotency_repository
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+
+IDEMPOTENT_PATHS = ("/books/", "/loans/", "/adherents/")
+
+MAX_KEY_LENGTH = 255
+
+# Response headers recomputed when a stored response is replayed
+SKIPPED_HEADERS = {"content-length", "content-encoding", "date", "server"}
+
+
+def record_id(headers: Headers, path: str, key: str) -> str:
+    # Keys are scoped to the caller credentials, which are not stored as such
+    scope = "\n".join([headers.get("authorization", ""), path, key])
+    return hashlib.sha256(scope.encode()).hexdigest()
+
+
+async def read_body(receive) -> bytes:
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body", False):
+            return b"".join(chunks)
+
+
+class IdempotencyMiddleware:
+    def __init__(self, app, paths: tuple = IDEMPOTENT_PATHS, lock_seconds: int = 60):
+        self.app = app
+        self.paths = paths
+        self.lock_seconds = lock_seconds
+        # Futures of the requests in progress in this process, by record id
+        self.in_flight = {}
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or scope["method"] != "POST"
+            or scope["path"] not in self.paths
+        ):
+            await self.app(scope, receive, send)
+            return
+        headers = Headers(scope=scope)
+        key = headers.get("idempotency-key")
+        if key is None:
+            await self.app(scope, receive, send)
+            return
+        if not key or len(key) > MAX_KEY_LENGTH:
+            response = JSONResponse(
+                {
+                    "detail": f"Idempotency-Key must be 1 to {MAX_KEY_LENGTH} characters long"
+                },
+                status_code=400,
+            )
+            await response(scope, receive, send)
+            return
+        body = await read_body(receive)
+        fingerprint = hashlib.sha256(body).hexdigest()
+        request_id = record_id(headers, scope["path"], key)
+
+        first = self.in_flight.get(request_id)
+        if first is not None:
+            # Duplicate of a request in progress here: answered with its response
+            record = await asyncio.shield(first)
+            await self.reply(record, fingerprint, scope, receive, send)
+            return
+        future = asyncio.get_running_loop().create_future()
+        self.in_flight[request_id] = future
+        record = None
+        try:
+            record = await self.process(
+                request_id, fingerprint, body, scope, receive, send
+            )
+        finally:
+            del self.in_flight[request_id]
+            future.set_result(record)
+
+    async def process(
+        self, request_id, fingerprint, body, scope, receive, send
+    ) -> dict:
+        """Run the request once per key, or answer from the stored record."""
+        now = datetime.now(timezone.utc)
+        if not await idempotency_repository.insert_pending(
+            request_id, fingerprint, now
+        ):
+            record = await idempotency_repository.find_by_id(request_id)
+            if (
+                record is None
+                or record["status"] == "completed"
+                or record["fingerprint"] != fingerprint
+            ):
+                await self.reply(record, fingerprint, scope, receive, send)
+                return record
+            stale_before = now - timedelta(seconds=self.lock_seconds)
+            if not await idempotency_repository.claim_stale_pending(
+                request_id, stale_before, now
+            ):
+                await self.reply(record, fingerprint, scope, receive, send)
+                return record
+
+        try:
+            response = await self.run(body, scope, receive, send)
+        except Exception:
+            await idempotency_repository.delete(request_id)
+            raise
+        if response["status"] < 500:
+            await idempotency_repository.complete(request_id, response)
+        else:
+            await idempotency_repository.delete(request_id)
+        return {"status": "completed", "fingerprint": fingerprint, "response": response}
+
+    async def run(self, body: bytes, scope, receive, send) -> dict:
+        """Call the application, forwarding and capturing its response."""
+        response = {"status": None, "headers": [], "body": b""}
+        chunks = []
+        body_sent = False
+
+        async def receive_body():
+            nonlocal body_sent
+            if body_sent:
+                return await receive()
+            body_sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        async def capture(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                response["headers"] = [
+                    [name.decode("latin-1"), value.decode("latin-1")]
+                    for name, value in message.get("headers", [])
+                    if name.decode("latin-1").lower() not in SKIPPED_HEADERS
+                ]
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+            await send(message)
+
+        await self.app(scope, receive_body, capture)
+        response["body"] = b"".join(chunks)
+        return response
+
+    async def reply(self, record: dict, fingerprint: str, scope, receive, send):
+        if record is None or record["status"] != "completed":
+            response = JSONResponse(
+                {"detail": "A request with this Idempotency-Key is in progress"},
+                status_code=409,
+                headers={"Retry-After": "1"},
+            )
+            await response(scope, receive, send)
+            return
+        if record["fingerprint"] != fingerprint:
+            response = JSONResponse(
+                {"detail": "Idempotency-Key already used with another request body"},
+                status_code=422,
+            )
+            await response(scope, receive, send)
+            return
+        stored = record["response"]
+        headers = [
+            (name.encode("latin-1"), value.encode("latin-1"))
+            for name, value in stored["headers"]
+        ]
+        headers.append((b"content-length", str(len(stored["body"])).encode()))
+        headers.append((b"idempotent-replayed", b"true"))
+        await send(
+            {
+                "type": "http.response.start",
+                "status": stored["status"],
+                "headers": headers,
+            }
+        )
+        await send({"type": "http.response.body", "body": stored["body"]})
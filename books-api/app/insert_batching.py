@@ -0,0 +1,116 @@
+"""Coalesce the concurrent inserts into a collection into ``insert_many`` batches.
+
+Each ``insert`` waits for at most the batch window (or for the batch to fill
+up), then all the documents waiting are written with a single unordered
+``insert_many``: one round trip and one journal commit for the whole batch
+instead of one per document. The ids are assigned on the client, like
+``insert_one`` does, and each caller gets its own result back: its id, or the
+error of its document (e.g. a duplicate key), so that a failed document does
+not fail the others.
+"""
+
+import asyncio
+
+from bson import ObjectId
+from pymongo.errors import (
+    BulkWriteError,
+    DuplicateKeyError,
+    WriteConcernError,
+    WriteError,
+)
+from pymongo.write_concern import WriteConcern
+
+
+def write_concern(w: str, journal: str) -> WriteConcern:
+    """Write concern from its settings; empty ones keep the client default."""
+    return WriteConcern(
+        w=int(w) if w.isdigit() else (w or None),
+        j=(journal == "true") if journal else None,
+    )
+
+
+def write_error(error: dict) -> WriteError:
+    error_class = DuplicateKeyError if error["code"] == 11000 else WriteError
+    return error_class(error["errmsg"], error["code"], error)
+
+
+class InsertBatcher:
+    def __init__(
+        self,
+        collection,
+        max_batch_size: int,
+        window_seconds: float,
+        concern: WriteConcern = None,
+    ):
+        if concern is not None and concern.document:
+            collection = collection.with_options(write_concern=concern)
+        self.collection = collection
+        self.max_batch_size = max_batch_size
+        self.window_seconds = window_seconds
+        # (document, future) waiting for the next batch
+        self.pending = []
+        self.timer = None
+        # Keep a reference to the running batches so that they are not garbage collected
+        self.running_tasks = set()
+
+    async def insert(self, document: dict) -> ObjectId:
+        """Insert ``document`` with the next batch and return its id."""
+        document.setdefault("_id", ObjectId())
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((document, future))
+        if len(self.pending) >= self.max_batch_size:
+            self.flush()
+        elif self.timer is None:
+            self.timer = asyncio.get_running_loop().call_later(
+                self.window_seconds, self.flush
+            )
+        return await future
+
+    def flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        batch, self.pending = self.pending, []
+        if batch:
+            task = asyncio.create_task(self.write(batch))
+            self.running_tasks.add(task)
+            task.add_done_callback(self.running_tasks.discard)
+
+    async def close(self):
+        """Write the documents still waiting for their batch, and wait for all the batches."""
+        self.flush()
+        await asyncio.gather(*self.running_tasks, return_exceptions=True)
+
+    async def write(self, batch: list):
+        errors = {}
+        try:
+            await self.collection.insert_many(
+                [document for document, _ in batch], ordered=False
+            )
+        except BulkWriteError as error:
+            errors = {
+                write["index"]: write_error(write)
+                for write in error.details.get("writeErrors", [])
+            }
+            # The other documents were written, but without the durability asked for
+            concern_errors = error.details.get("writeConcernErrors")
+            if concern_errors:
+                concern_error = WriteConcernError(
+                    concern_errors[0]["errmsg"],
+                    concern_errors[0].get("code"),
+                    concern_errors[0],
+                )
+                errors = {
+                    index: errors.get(index, concern_error)
+                    for index in range(len(batch))
+                }
+        except Exception as error:
+            errors = {index: error for index in range(len(batch))}
+        for index, (document, future) in enumerate(batch):
+            if future.done():
+                # The request was cancelled meanwhile
+                continue
+            if index in errors:
+                future.set_exception(errors[index])
+            else:
+                future.set_result(document["_id"])
@@ -0,0 +1 @@
+"""Background jobs, run by the application lifespan or as ``python -m app.jobs.<name>``."""
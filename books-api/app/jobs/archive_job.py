@@ -0,0 +1,68 @@
+"""Move the loans returned long ago from ``loans`` to ``loans_archive``.
+
+The hot ``loans`` collection then only holds open and recently returned
+loans. Queries read the archive only when their date range reaches before
+the archive watermark. The scheduler runs inside the application lifespan,
+or on its own with:
+
+    python -m app.jobs.archive_job
+"""
+
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+
+from app.config import (
+    LOANS_ARCHIVE_AFTER_DAYS,
+    LOANS_ARCHIVE_BATCH_SIZE,
+    LOANS_ARCHIVE_INTERVAL_SECONDS,
+)
+from app.dates import today
+from app.repositories import jobs_repository, loans_repository
+
+logger = logging.getLogger(__name__)
+
+# How long the archive watermark is cached by each worker
+WATERMARK_CACHE_SECONDS = 60
+
+watermark_cache = {"value": None, "expires_at": 0.0}
+
+
+async def archived_before() -> datetime:
+    """Date before which returned loans may live in the archive, if any."""
+    if time.monotonic() >= watermark_cache["expires_at"]:
+        watermark_cache["value"] = await jobs_repository.find_archive_watermark()
+        watermark_cache["expires_at"] = time.monotonic() + WATERMARK_CACHE_SECONDS
+    return watermark_cache["value"]
+
+
+async def archive_returned_loans() -> int:
+    cutoff = today() - timedelta(days=LOANS_ARCHIVE_AFTER_DAYS)
+    # Raised first: queries must read the archive as soon as a loan can be there
+    await jobs_repository.raise_archive_watermark(cutoff, datetime.now(timezone.utc))
+    moved_count = 0
+    while True:
+        loans = await loans_repository.find_batch(
+            {"returned": True, "returnDate": {"$lt": cutoff}},
+            LOANS_ARCHIVE_BATCH_SIZE,
+        )
+        if not loans:
+            return moved_count
+        moved_count += await loans_repository.move_to_archive(loans)
+
+
+async def run_scheduler(interval: int = LOANS_ARCHIVE_INTERVAL_SECONDS):
+    while True:
+        try:
+            moved_count = await archive_returned_loans()
+            logger.info("%d loans moved to the archive", moved_count)
+        except Exception:
+            # A failed run is retried at the next tick
+            logger.exception("Loan archiving failed")
+        await asyncio.sleep(interval)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(run_scheduler())
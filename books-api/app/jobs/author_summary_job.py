@@ -0,0 +1,98 @@
+"""Keep the author summary embedded in the books consistent with the authors.
+
+Books carry ``author: {first_name, last_name, nationality}`` so that catalogue
+reads need no author lookup. An author update is fanned out to their books in
+the background, by batches of ``update_many``. The consistency checker reports
+the books whose summary is missing or stale (e.g. after an interrupted fan-out,
+or for books created before the summaries) and fixes them with ``--repair``:
+
+    python -m app.jobs.author_summary_job [--repair]
+"""
+
+import argparse
+import asyncio
+import logging
+import sys
+
+from app.config import AUTHOR_SUMMARY_BATCH_SIZE
+from app.repositories import authors_repository, books_repository
+from bson import ObjectId
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_FIELDS = ("first_name", "last_name", "nationality")
+
+# Keep a reference to the running fan-outs so that they are not garbage collected
+running_tasks = set()
+
+
+def author_summary(author: dict) -> dict:
+    return {field: author.get(field) for field in SUMMARY_FIELDS}
+
+
+async def propagate(author_id: ObjectId) -> int:
+    """Copy the current summary of the author to their books, by batches."""
+    updated_count = 0
+    last_id = None
+    while True:
+        # Reloaded for each batch: a fan-out racing a newer update of the same
+        # author converges to the newest summary instead of restoring its own
+        # (the books before last_id are covered by the fan-out of that update)
+        author = await authors_repository.find_by_id(str(author_id))
+        if not author:
+            return updated_count
+        summary = author_summary(author)
+        book_ids = await books_repository.find_ids_with_stale_author(
+            author_id, summary, AUTHOR_SUMMARY_BATCH_SIZE, last_id
+        )
+        if not book_ids:
+            return updated_count
+        last_id = book_ids[-1]
+        updated_count += await books_repository.set_author_summary(book_ids, summary)
+
+
+async def run_propagation(author_id: ObjectId):
+    try:
+        updated_count = await propagate(author_id)
+    except Exception:
+        # The books left behind are reported and repaired by the checker
+        logger.exception("Author summary fan-out of %s failed", author_id)
+        return
+    logger.info("Author summary of %s copied to %d books", author_id, updated_count)
+
+
+def start_propagation(author_id: ObjectId):
+    task = asyncio.create_task(run_propagation(author_id))
+    running_tasks.add(task)
+    task.add_done_callback(running_tasks.discard)
+
+
+async def check(repair: bool = False) -> dict:
+    report = {"authors": 0, "stale": 0, "repaired": 0, "orphans": 0}
+    async for author in authors_repository.iter_all():
+        report["authors"] += 1
+        stale_count = await books_repository.count_stale_author(
+            author["_id"], author_summary(author)
+        )
+        report["stale"] += stale_count
+        if stale_count and repair:
+            report["repaired"] += await propagate(author["_id"])
+    report["orphans"] = await books_repository.count_orphans()
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Check the author summaries embedded in the books"
+    )
+    parser.add_argument(
+        "--repair", action="store_true", help="update the stale summaries"
+    )
+    args = parser.parse_args()
+    report = asyncio.run(check(args.repair))
+    print(
+        f"{report['authors']} authors, {report['stale']} books with a stale summary "
+        f"({report['repaired']} repaired), {report['orphans']} books without author"
+    )
+    if report["stale"] > report["repaired"]:
+        sys.exit(1)
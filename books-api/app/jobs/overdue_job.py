@@ -0,0 +1,35 @@
+"""Periodically flag the open loans whose return deadline has passed.
+
+The scheduler runs inside the application lifespan, or on its own with:
+
+    python -m app.jobs.overdue_job
+"""
+
+import asyncio
+import logging
+
+from app.config import OVERDUE_CHECK_INTERVAL_SECONDS
+from app.dates import today
+from app.repositories import loans_repository
+
+logger = logging.getLogger(__name__)
+
+
+async def mark_overdue_loans() -> int:
+    return await loans_repository.mark_overdue(today())
+
+
+async def run_scheduler(interval: int = OVERDUE_CHECK_INTERVAL_SECONDS):
+    while True:
+        try:
+            marked_count = await mark_overdue_loans()
+            logger.info("%d loans marked overdue", marked_count)
+        except Exception:
+            # A failed run is retried at the next tick
+            logger.exception("Overdue loans detection failed")
+        await asyncio.sleep(interval)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(run_scheduler())
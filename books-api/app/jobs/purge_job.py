@@ -0,0 +1,85 @@
+"""Delete the loans matching a filter in bounded batches, in the background.
+
+The archived loans are purged first, then the hot ones, and the rounds are
+repeated until none is left, so that the loans archived meanwhile are purged
+too. With ``archive``, the loans are kept in the ``loans_archive`` collection,
+flagged so that no read returns them, rather than deleted. The job pauses
+between two batches so that a large purge does not starve the live traffic.
+Progress is stored in the ``jobs`` collection.
+"""
+
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+
+from app.config import PURGE_BATCH_DELAY_SECONDS, PURGE_BATCH_SIZE
+from app.repositories import jobs_repository, loans_repository
+from app.use_cases import stats_use_case
+
+logger = logging.getLogger(__name__)
+
+JOB_TYPE = "loan_purge"
+
+# A running job without heartbeat for this long is taken over by another worker
+STALE_AFTER = timedelta(minutes=1)
+
+# Keep a reference to the running purges so that they are not garbage collected
+running_tasks = set()
+
+
+async def run_purge(job: dict, query: dict):
+    job_id = job["_id"]
+    deleted_count = job.get("deleted", 0)
+    archived_count = job.get("archived", 0)
+    await jobs_repository.update_job(
+        job_id, {"status": "running", "heartbeat_at": datetime.now(timezone.utc)}
+    )
+    try:
+        purged = True
+        while purged:
+            purged = False
+            for in_archive in (True, False):
+                while loans := await loans_repository.find_batch(
+                    query, PURGE_BATCH_SIZE, in_archive
+                ):
+                    purged = True
+                    deleted, archived = await loans_repository.purge_batch(
+                        loans, in_archive, job["archive"]
+                    )
+                    deleted_count += deleted
+                    archived_count += archived
+                    await stats_use_case.remove_loans_from_counters(loans)
+                    await jobs_repository.update_job(
+                        job_id,
+                        {
+                            "deleted": deleted_count,
+                            "archived": archived_count,
+                            "heartbeat_at": datetime.now(timezone.utc),
+                        },
+                    )
+                    await asyncio.sleep(PURGE_BATCH_DELAY_SECONDS)
+    except Exception as error:
+        logger.exception("Loan purge %s failed", job_id)
+        await jobs_repository.update_job(
+            job_id,
+            {
+                "status": "failed",
+                "error": str(error),
+                "finished_at": datetime.now(timezone.utc),
+            },
+        )
+        return
+    await jobs_repository.update_job(
+        job_id, {"status": "done", "finished_at": datetime.now(timezone.utc)}
+    )
+
+
+def start_purge(job: dict, query: dict):
+    task = asyncio.create_task(run_purge(job, query))
+    running_tasks.add(task)
+    task.add_done_callback(running_tasks.discard)
+
+
+async def claim_stale_purge() -> dict:
+    now = datetime.now(timezone.utc)
+    return await jobs_repository.claim_stale_job(JOB_TYPE, now - STALE_AFTER, now)
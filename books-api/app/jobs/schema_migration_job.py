@@ -0,0 +1,89 @@
+"""Upgrade the books and loans not read since their shape changed.
+
+The documents read by the API are upgraded on the fly (see
+``app.schema_versions``); this job upgrades the others to the current
+version, by small batches with a pause in between, so that it never competes
+much with the live traffic. It runs in the background once the application
+has started, or on its own with:
+
+    python -m app.jobs.schema_migration_job
+"""
+
+import asyncio
+import logging
+
+from app.config import (
+    SCHEMA_MIGRATION_BATCH_DELAY_SECONDS,
+    SCHEMA_MIGRATION_BATCH_SIZE,
+)
+from app.database import books_collection, loans_archive_collection, loans_collection
+from app.schema_versions import (
+    current_version,
+    outdated_query,
+    upgrade_document,
+    write_back,
+    write_back_operation,
+)
+
+logger = logging.getLogger(__name__)
+
+# Collections to upgrade, with the name of their shapes
+VERSIONED_COLLECTIONS = [
+    ("books", books_collection),
+    ("loans", loans_collection),
+    ("loans", loans_archive_collection),
+]
+
+
+async def migrate_collection(
+    collection_name: str,
+    collection,
+    batch_size: int = SCHEMA_MIGRATION_BATCH_SIZE,
+    delay: float = SCHEMA_MIGRATION_BATCH_DELAY_SECONDS,
+) -> int:
+    upgraded_count = 0
+    after = None
+    while True:
+        query = outdated_query(collection_name)
+        # Each document is visited once, even if its write back is skipped
+        if after is not None:
+            query["_id"] = {"$gt": after}
+        cursor = collection.find(query).sort("_id", 1).limit(batch_size)
+        documents = await cursor.to_list(length=batch_size)
+        if not documents:
+            return upgraded_count
+        after = documents[-1]["_id"]
+        upgraded_count += await write_back(
+            collection,
+            [
+                write_back_operation(
+                    document, upgrade_document(collection_name, document)
+                )
+                for document in documents
+            ],
+        )
+        await asyncio.sleep(delay)
+
+
+async def migrate_all():
+    for collection_name, collection in VERSIONED_COLLECTIONS:
+        upgraded_count = await migrate_collection(collection_name, collection)
+        logger.info(
+            "%s: %d documents upgraded to version %d",
+            collection.name,
+            upgraded_count,
+            current_version(collection_name),
+        )
+
+
+async def run_migration():
+    try:
+        await migrate_all()
+    except Exception:
+        # The documents left behind are upgraded when read, or at the next start
+        logger.exception("Schema migration failed")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(migrate_all())
@@ -0,0 +1,26 @@
+"""Rebuild the loan rollup counters from the loans collection.
+
+The counters are maintained incrementally by the loan use cases and the
+purge job; this job recomputes them with ``$merge`` to repair drift:
+
+    python -m app.jobs.stats_job
+"""
+
+import asyncio
+import logging
+from datetime import datetime, timezone
+
+from app.repositories import stats_repository
+
+logger = logging.getLogger(__name__)
+
+
+async def rebuild_rollups():
+    rebuilt_at = datetime.now(timezone.utc)
+    await stats_repository.rebuild(rebuilt_at)
+    logger.info("Loan rollups rebuilt")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(rebuild_rollups())
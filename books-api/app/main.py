@@ -1,18 +1,92 @@
 """Main program of the API. Manage roots and web server"""
 
+import asyncio
+from contextlib import asynccontextmanager
+
+from app import (
+    change_feed,
+    config,
+    database,
+    profiling,
+    references,
+    schema_versions,
+    startup,
+    tracing,
+)
+from app.compression import CompressionMiddleware
 from app.controllers import (
     adherent_controller,
+    admin_controller,
     authors_controller,
     books_controller,
+    docs_controller,
+    events_controller,
     loans_controller,
+    stats_controller,
 )
+from app.idempotency import IdempotencyMiddleware
+from app.jobs import archive_job, overdue_job, schema_migration_job
+from app.repositories import loans_repository
+from app.use_cases import books_use_case, loans_use_case
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Prepare the database, warm the process up and start the background jobs."""
+    with startup.phase("warm-up"):
+        await startup.warm_up(app)
+    with startup.phase("indexes"):
+        await database.create_indexes()
+    with startup.phase("purges"):
+        await loans_use_case.resume_purges_use_case()
+    tasks = []
+    if config.CHANGE_FEED_ENABLED:
+        with startup.phase("change feed"):
+            await change_feed.setup()
+            # Replayed from here: the writes made during the loads are not missed
+            await change_feed.mark_start()
+        # Without the change feed, the suggestions are read from MongoDB
+        with startup.phase("suggestions"):
+            await books_use_case.load_suggestions_use_case()
+        change_feed.add_listener(books_use_case.refresh_suggestions)
+        # The cached ids need the change feed to stay current
+        with startup.phase("references"):
+            await references.load_all()
+        change_feed.add_listener(references.refresh)
+        if config.CATALOGUE_SNAPSHOT_ENABLED:
+            with startup.phase("catalogue"):
+                await books_use_case.load_catalogue_use_case()
+            change_feed.add_listener(books_use_case.refresh_catalogue)
+        tasks.append(asyncio.create_task(change_feed.run()))
+    if config.OVERDUE_SCHEDULER_ENABLED:
+        tasks.append(asyncio.create_task(overdue_job.run_scheduler()))
+    if config.LOANS_ARCHIVE_ENABLED:
+        tasks.append(asyncio.create_task(archive_job.run_scheduler()))
+    if config.SCHEMA_MIGRATION_ENABLED:
+        tasks.append(asyncio.create_task(schema_migration_job.run_migration()))
+    startup.log_phases()
+    yield
+    for task in tasks:
+        task.cancel()
+    # Let the cancelled jobs run their cleanup before the process exits
+    await asyncio.gather(*tasks, return_exceptions=True)
+    # The loans accepted and the upgrades read must still be written
+    await loans_repository.flush_inserts()
+    await schema_versions.wait_write_backs()
+    tracing.shutdown()
+
+
 app = FastAPI(
     title="Books API",
     description="API to manage books and their authors",
     version="1.0.0",
+    lifespan=lifespan,
+    # Served from the pre-generated schema by docs_controller
+    openapi_url=None,
+    docs_url=None,
+    redoc_url=None,
 )
 
 # CORS
@@ -30,10 +104,48 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Idempotency keys, inside the compression so that the stored responses are not encoded
+
+if config.IDEMPOTENCY_ENABLED:
+    app.add_middleware(
+        IdempotencyMiddleware, lock_seconds=config.IDEMPOTENCY_LOCK_SECONDS
+    )
+
+# Compression
+
+if config.COMPRESSION_ENABLED:
+    app.add_middleware(
+        CompressionMiddleware,
+        minimum_size=config.COMPRESSION_MINIMUM_SIZE,
+        levels={
+            "gzip": config.COMPRESSION_GZIP_LEVEL,
+            "br": config.COMPRESSION_BROTLI_LEVEL,
+            "zstd": config.COMPRESSION_ZSTD_LEVEL,
+        },
+    )
+
+# CPU time per route, around the compression so that its CPU time is counted too
+
+if config.PROFILING_ENABLED:
+    app.add_middleware(profiling.RouteCpuMiddleware)
+
+# Tracing, outermost so that the request spans cover the other middlewares
+
+if tracing.setup() and not tracing.fastapi_traces_requests():
+    app.add_middleware(tracing.TracingMiddleware)
+
 app.include_router(books_controller.router, prefix="/books", tags=["Books"])
 app.include_router(authors_controller.router, prefix="/authors", tags=["Authors"])
 app.include_router(adherent_controller.router, prefix="/adherents", tags=["Adherents"])
 app.include_router(loans_controller.router, prefix="/loans", tags=["Loans"])
+app.include_router(stats_controller.router, prefix="/stats", tags=["Statistics"])
+app.include_router(events_controller.router, prefix="/events", tags=["Events"])
+app.include_router(
+    admin_controller.query_shapes_router, prefix="/admin", tags=["Admin"]
+)
+if config.PROFILING_ENABLED:
+    app.include_router(admin_controller.router, prefix="/admin", tags=["Admin"])
+app.include_router(docs_controller.router)
 
 # Run the app with uvicorn
 if __name__ == "__main__":
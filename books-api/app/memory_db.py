@@ -0,0 +1,1257 @@
+"""In-memory storage backend, selected with ``DB_BACKEND=memory``.
+
+It implements the subset of the Motor client, database, collection and
+cursor API used by the repositories (see ``app.database.Collection``):
+filters, projections, sorting, pagination, update operators, the
+aggregation stages of the jobs, change streams and equality indexes.
+Data only lives in the process, which makes it suited to tests and
+benchmarks that must start fast and leave the database round trips out.
+"""
+
+import asyncio
+import itertools
+import re
+import time
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta, timezone
+from enum import Enum
+
+from bson import ObjectId
+from bson.errors import InvalidDocument
+from pymongo import (
+    DeleteMany,
+    DeleteOne,
+    InsertOne,
+    ReturnDocument,
+    UpdateMany,
+    UpdateOne,
+)
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+
+
+class _Missing:
+    """Marker of a field absent from a document."""
+
+    def __repr__(self):
+        return "MISSING"
+
+
+MISSING = _Missing()
+
+
+@dataclass
+class InsertOneResult:
+    inserted_id: object
+    acknowledged: bool = True
+
+
+@dataclass
+class InsertManyResult:
+    inserted_ids: list
+    acknowledged: bool = True
+
+
+@dataclass
+class UpdateResult:
+    matched_count: int
+    modified_count: int
+    upserted_id: object = None
+    acknowledged: bool = True
+
+
+@dataclass
+class DeleteResult:
+    deleted_count: int
+    acknowledged: bool = True
+
+
+@dataclass
+class BulkWriteResult:
+    inserted_count: int = 0
+    matched_count: int = 0
+    modified_count: int = 0
+    deleted_count: int = 0
+    upserted_count: int = 0
+    upserted_ids: dict = field(default_factory=dict)
+    acknowledged: bool = True
+
+
+# Values: BSON round trip, comparison and hashing
+
+
+def encode(value):
+    """Copy ``value`` the way a BSON round trip would return it."""
+    if isinstance(value, dict):
+        return {str(key): encode(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [encode(item) for item in value]
+    if isinstance(value, Enum):
+        return encode(value.value)
+    if isinstance(value, str):
+        return str.__str__(value)
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        # BSON dates have a millisecond precision
+        return value.replace(microsecond=value.microsecond // 1000 * 1000)
+    if isinstance(value, date):
+        raise InvalidDocument(
+            f"cannot encode object: {value!r}, of type: {type(value)}"
+        )
+    return value
+
+
+def copy_value(value):
+    if isinstance(value, dict):
+        return {key: copy_value(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [copy_value(item) for item in value]
+    return value
+
+
+def type_rank(value) -> int:
+    # Canonical BSON comparison order
+    if value is None or value is MISSING:
+        return 1
+    if isinstance(value, bool):
+        return 8
+    if isinstance(value, (int, float)):
+        return 2
+    if isinstance(value, str):
+        return 3
+    if isinstance(value, dict):
+        return 4
+    if isinstance(value, list):
+        return 5
+    if isinstance(value, bytes):
+        return 6
+    if isinstance(value, ObjectId):
+        return 7
+    if isinstance(value, datetime):
+        return 9
+    return 10
+
+
+def sort_key(value):
+    rank = type_rank(value)
+    if rank == 1:
+        return (rank, 0)
+    if rank == 4:
+        return (rank, tuple((key, sort_key(item)) for key, item in value.items()))
+    if rank == 5:
+        return (rank, tuple(sort_key(item) for item in value))
+    if rank == 9:
+        return (rank, encode(value))
+    return (rank, value)
+
+
+def hashable(value):
+    if isinstance(value, dict):
+        return tuple((key, hashable(item)) for key, item in value.items())
+    if isinstance(value, list):
+        return tuple(hashable(item) for item in value)
+    if isinstance(value, datetime):
+        return encode(value)
+    if value is MISSING:
+        return None
+    return value
+
+
+# Field paths
+
+
+def get_path(document, path: str):
+    value = document
+    for part in path.split("."):
+        if isinstance(value, dict):
+            value = value.get(part, MISSING)
+        elif isinstance(value, list):
+            if part.isdigit():
+                index = int(part)
+                value = value[index] if index < len(value) else MISSING
+            else:
+                values = [
+                    item.get(part, MISSING) for item in value if isinstance(item, dict)
+                ]
+                value = [item for item in values if item is not MISSING] or MISSING
+        else:
+            return MISSING
+        if value is MISSING:
+            return MISSING
+    return value
+
+
+def set_path(document: dict, path: str, value):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        document = document.setdefault(part, {})
+    document[parts[-1]] = value
+
+
+def unset_path(document: dict, path: str):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        document = document.get(part)
+        if not isinstance(document, dict):
+            return
+    document.pop(parts[-1], None)
+
+
+# Query matching
+
+TYPE_ALIASES = {
+    "double": (float,),
+    "string": (str,),
+    "object": (dict,),
+    "array": (list,),
+    "objectId": (ObjectId,),
+    "bool": (bool,),
+    "date": (datetime,),
+    "null": (type(None),),
+    "int": (int,),
+    "long": (int,),
+    "number": (int, float),
+}
+
+
+def candidates(value) -> list:
+    # An array field matches when one of its elements (or the array itself) does
+    if isinstance(value, list):
+        return [value, *value]
+    return [value]
+
+
+def equals(value, target) -> bool:
+    if isinstance(target, re.Pattern):
+        return any(
+            isinstance(item, str) and target.search(item) for item in candidates(value)
+        )
+    if target is None:
+        return (
+            value is MISSING
+            or value is None
+            or (isinstance(value, list) and None in value)
+        )
+    target = encode(target)
+    return any(
+        type_rank(item) == type_rank(target) and sort_key(item) == sort_key(target)
+        for item in candidates(value)
+    )
+
+
+def compare(value, target, operator) -> bool:
+    target_key = sort_key(encode(target))
+    for item in candidates(value):
+        # Range operators only compare values of the same type bracket
+        if type_rank(item) != type_rank(target) or item is MISSING:
+            continue
+        item_key = sort_key(item)
+        if (
+            (operator == "$gt" and item_key > target_key)
+            or (operator == "$gte" and item_key >= target_key)
+            or (operator == "$lt" and item_key < target_key)
+            or (operator == "$lte" and item_key <= target_key)
+        ):
+            return True
+    return False
+
+
+def regex_flags(options: str) -> int:
+    flags = 0
+    for option, flag in (("i", re.I), ("m", re.M), ("s", re.S), ("x", re.X)):
+        if option in (options or ""):
+            flags |= flag
+    return flags
+
+
+def is_operator_dict(condition) -> bool:
+    return (
+        isinstance(condition, dict)
+        and bool(condition)
+        and all(key.startswith("$") for key in condition)
+    )
+
+
+def match_condition(value, condition) -> bool:
+    if not is_operator_dict(condition):
+        return equals(value, condition)
+    for operator, argument in condition.items():
+        if operator == "$options":
+            continue
+        if operator == "$eq":
+            matched = equals(value, argument)
+        elif operator == "$ne":
+            matched = not equals(value, argument)
+        elif operator == "$in":
+            matched = any(equals(value, target) for target in argument)
+        elif operator == "$nin":
+            matched = not any(equals(value, target) for target in argument)
+        elif operator in ("$gt", "$gte", "$lt", "$lte"):
+            matched = compare(value, argument, operator)
+        elif operator == "$exists":
+            matched = (value is not MISSING) == bool(argument)
+        elif operator == "$regex":
+            pattern = argument
+            if not isinstance(pattern, re.Pattern):
+                pattern = re.compile(pattern, regex_flags(condition.get("$options")))
+            matched = equals(value, pattern)
+        elif operator == "$type":
+            types = TYPE_ALIASES[argument]
+            matched = any(
+                isinstance(item, types)
+                and not (bool not in types and isinstance(item, bool))
+                for item in candidates(value)
+                if item is not MISSING
+            )
+        elif operator == "$not":
+            matched = not match_condition(value, argument)
+        elif operator == "$all":
+            matched = all(match_condition(value, target) for target in argument)
+        elif operator == "$size":
+            matched = isinstance(value, list) and len(value) == argument
+        elif operator == "$elemMatch":
+            matched = isinstance(value, list) and any(
+                (
+                    matches(item, argument)
+                    if isinstance(item, dict)
+                    else match_condition(item, argument)
+                )
+                for item in value
+            )
+        else:
+            raise OperationFailure(f"unknown operator: {operator}")
+        if not matched:
+            return False
+    return True
+
+
+def matches(document: dict, query: dict) -> bool:
+    for key, condition in (query or {}).items():
+        if key == "$and":
+            if not all(matches(document, clause) for clause in condition):
+                return False
+        elif key == "$or":
+            if not any(matches(document, clause) for clause in condition):
+                return False
+        elif key == "$nor":
+            if any(matches(document, clause) for clause in condition):
+                return False
+        elif key == "$expr":
+            if not evaluate(condition, document):
+                return False
+        elif not match_condition(get_path(document, key), condition):
+            return False
+    return True
+
+
+# Aggregation expressions
+
+
+def evaluate(expression, document):
+    if isinstance(expression, str) and expression.startswith("$"):
+        if expression == "$$ROOT":
+            return document
+        value = get_path(document, expression[1:])
+        return None if value is MISSING else value
+    if isinstance(expression, list):
+        return [evaluate(item, document) for item in expression]
+    if not isinstance(expression, dict):
+        return expression
+    if not is_operator_dict(expression):
+        return {key: evaluate(item, document) for key, item in expression.items()}
+    ((operator, argument),) = expression.items()
+    if operator == "$literal":
+        return argument
+    values = (
+        [evaluate(item, document) for item in argument]
+        if isinstance(argument, list)
+        else evaluate(argument, document)
+    )
+    if operator == "$concat":
+        return None if None in values else "".join(values)
+    if operator == "$toString":
+        return None if values is None else str(values)
+    if operator == "$toLower":
+        return (values or "").lower()
+    if operator == "$ifNull":
+        return next((value for value in values if value is not None), None)
+    if operator == "$eq":
+        return sort_key(values[0]) == sort_key(values[1])
+    if operator == "$ne":
+        return sort_key(values[0]) != sort_key(values[1])
+    if operator in ("$gt", "$gte", "$lt", "$lte"):
+        left, right = sort_key(values[0]), sort_key(values[1])
+        return {
+            "$gt": left > right,
+            "$gte": left >= right,
+            "$lt": left < right,
+            "$lte": left <= right,
+        }[operator]
+    if operator == "$and":
+        return all(values)
+    if operator == "$or":
+        return any(values)
+    if operator == "$not":
+        return not (values[0] if isinstance(values, list) else values)
+    if operator == "$cond":
+        if isinstance(argument, dict):
+            branches = [argument["if"], argument["then"], argument["else"]]
+        else:
+            branches = argument
+        return evaluate(
+            branches[1] if evaluate(branches[0], document) else branches[2], document
+        )
+    if operator == "$size":
+        return len(values)
+    if operator == "$dateToString":
+        value = evaluate(argument["date"], document)
+        return value.strftime(
+            argument.get("format", "%Y-%m-%dT%H:%M:%S.%LZ").replace("%L", "000")
+        )
+    if operator == "$dateTrunc":
+        value = evaluate(argument["date"], document)
+        if argument["unit"] != "day":
+            raise OperationFailure("only day truncation is supported in memory")
+        return datetime.combine(value.date(), datetime.min.time())
+    raise OperationFailure(f"unknown expression operator: {operator}")
+
+
+def accumulate(operator, argument, documents: list):
+    values = [evaluate(argument, document) for document in documents]
+    if operator == "$sum":
+        return sum(value for value in values if isinstance(value, (int, float)))
+    if operator == "$avg":
+        numbers = [value for value in values if isinstance(value, (int, float))]
+        return sum(numbers) / len(numbers) if numbers else None
+    if operator == "$first":
+        return values[0] if values else None
+    if operator == "$last":
+        return values[-1] if values else None
+    if operator == "$max":
+        return max(values, key=sort_key) if values else None
+    if operator == "$min":
+        return min(values, key=sort_key) if values else None
+    if operator == "$push":
+        return values
+    if operator == "$addToSet":
+        unique = {}
+        for value in values:
+            unique.setdefault(hashable(value), value)
+        return list(unique.values())
+    raise OperationFailure(f"unknown accumulator: {operator}")
+
+
+# Projection and sorting
+
+
+def project(document: dict, projection) -> dict:
+    if not projection:
+        return document
+    if isinstance(projection, (list, tuple)):
+        projection = {name: 1 for name in projection}
+    include_id = projection.get("_id", 1)
+    fields = {key: value for key, value in projection.items() if key != "_id"}
+    if fields and all(not value for value in fields.values()):
+        result = dict(document)
+        for key in fields:
+            unset_path(result, key)
+    else:
+        result = {}
+        for key, value in fields.items():
+            if value is True or value == 1:
+                found = get_path(document, key)
+                if found is not MISSING:
+                    set_path(result, key, found)
+            else:
+                set_path(result, key, evaluate(value, document))
+    if include_id and "_id" in document:
+        result["_id"] = document["_id"]
+    elif not include_id:
+        result.pop("_id", None)
+    return result
+
+
+def normalize_sort(key_or_list, direction=None) -> list:
+    if isinstance(key_or_list, str):
+        return [(key_or_list, direction or 1)]
+    if isinstance(key_or_list, dict):
+        return list(key_or_list.items())
+    return list(key_or_list)
+
+
+def sort_documents(documents: list, sort: list) -> list:
+    documents = list(documents)
+    # Stable sorts, from the last key to the first one
+    for key, direction in reversed(sort):
+        if key == "$natural":
+            if direction < 0:
+                documents.reverse()
+            continue
+        documents.sort(
+            key=lambda document: sort_key(get_path(document, key)),
+            reverse=direction < 0,
+        )
+    return documents
+
+
+# Updates
+
+
+def apply_update(document: dict, update: dict, inserting: bool = False) -> bool:
+    """Apply the update operators to ``document`` in place; tell if it changed."""
+    if isinstance(update, list):
+        raise OperationFailure("pipeline updates are not supported in memory")
+    if not is_operator_dict(update):
+        raise ValueError("update only works with $ operators")
+    before = hashable(document)
+    for operator, fields in update.items():
+        for path, argument in fields.items():
+            argument = encode(argument)
+            current = get_path(document, path)
+            if operator == "$set":
+                set_path(document, path, argument)
+            elif operator == "$setOnInsert":
+                if inserting:
+                    set_path(document, path, argument)
+            elif operator == "$unset":
+                unset_path(document, path)
+            elif operator == "$inc":
+                set_path(
+                    document, path, (0 if current is MISSING else current) + argument
+                )
+            elif operator == "$max":
+                if current is MISSING or sort_key(argument) > sort_key(current):
+                    set_path(document, path, argument)
+            elif operator == "$min":
+                if current is MISSING or sort_key(argument) < sort_key(current):
+                    set_path(document, path, argument)
+            elif operator == "$push":
+                items = [] if current is MISSING else list(current)
+                if isinstance(argument, dict) and "$each" in argument:
+                    items.extend(argument["$each"])
+                else:
+                    items.append(argument)
+                set_path(document, path, items)
+            elif operator == "$addToSet":
+                items = [] if current is MISSING else list(current)
+                if not any(equals(item, argument) for item in items):
+                    items.append(argument)
+                set_path(document, path, items)
+            elif operator == "$pull":
+                if current is not MISSING:
+                    set_path(
+                        document,
+                        path,
+                        [
+                            item
+                            for item in current
+                            if not match_condition(item, argument)
+                        ],
+                    )
+            else:
+                raise OperationFailure(f"unknown update operator: {operator}")
+    return hashable(document) != before
+
+
+def upsert_seed(query: dict) -> dict:
+    # Equality conditions of the filter become fields of the inserted document
+    document = {}
+    for key, condition in query.items():
+        if key.startswith("$"):
+            continue
+        if is_operator_dict(condition):
+            if "$eq" in condition:
+                set_path(document, key, encode(condition["$eq"]))
+            continue
+        set_path(document, key, encode(condition))
+    return document
+
+
+# Indexes
+
+
+class Index:
+    """Equality index on the leading field of a key pattern."""
+
+    def __init__(self, name: str, keys: list, unique: bool, partial: dict, ttl):
+        self.name = name
+        self.keys = keys
+        self.field = keys[0][0]
+        self.unique = unique
+        self.partial = partial
+        self.expire_after_seconds = ttl
+        self.entries = {}
+
+    def index_keys(self, document: dict) -> list:
+        if self.partial and not matches(document, self.partial):
+            return []
+        value = get_path(document, self.field)
+        if isinstance(value, list):
+            return list({hashable(item) for item in value})
+        return [hashable(value)]
+
+    def unique_key(self, document: dict):
+        if self.partial and not matches(document, self.partial):
+            return None
+        return tuple(hashable(get_path(document, key)) for key, _ in self.keys)
+
+    def add(self, document_id, document: dict):
+        for key in self.index_keys(document):
+            self.entries.setdefault(key, set()).add(document_id)
+
+    def remove(self, document_id, document: dict):
+        for key in self.index_keys(document):
+            ids = self.entries.get(key)
+            if ids:
+                ids.discard(document_id)
+                if not ids:
+                    del self.entries[key]
+
+    def lookup(self, condition):
+        """Ids of the documents that may match ``condition``, or None if unusable."""
+        if self.partial:
+            return None
+        if is_operator_dict(condition):
+            if set(condition) == {"$eq"}:
+                values = [condition["$eq"]]
+            elif set(condition) == {"$in"}:
+                values = condition["$in"]
+            else:
+                return None
+        else:
+            values = [condition]
+        if any(
+            value is None or isinstance(value, (dict, re.Pattern)) for value in values
+        ):
+            return None
+        found = set()
+        for value in values:
+            key = hashable(encode(value))
+            found |= self.entries.get(key, set())
+            if isinstance(value, list):
+                return None
+        return found
+
+
+# Cursors
+
+
+class MemoryCursor:
+    """Lazy cursor over the documents returned by ``find`` or ``aggregate``."""
+
+    def __init__(self, source, projection=None):
+        self._source = source
+        self._projection = projection
+        self._sort = []
+        self._skip = 0
+        self._limit = 0
+        self._results = None
+        self.alive = True
+
+    def sort(self, key_or_list, direction=None):
+        self._sort = normalize_sort(key_or_list, direction)
+        return self
+
+    def skip(self, skip: int):
+        self._skip = skip
+        return self
+
+    def limit(self, limit: int):
+        self._limit = limit
+        return self
+
+    def batch_size(self, batch_size: int):
+        return self
+
+    def _evaluate(self) -> list:
+        if self._results is None:
+            documents = self._source()
+            if self._sort:
+                documents = sort_documents(documents, self._sort)
+            skip, limit = self._skip, self._limit
+            documents = documents[skip:]
+            if limit:
+                documents = documents[:limit]
+            self._results = [
+                copy_value(project(document, self._projection))
+                for document in documents
+            ]
+        return self._results
+
+    async def to_list(self, length=None):
+        results = self._evaluate()
+        taken, self._results = (
+            (results, []) if length is None else (results[:length], results[length:])
+        )
+        if not self._results:
+            self.alive = False
+        return taken
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        results = self._evaluate()
+        if not results:
+            self.alive = False
+            raise StopAsyncIteration
+        return results.pop(0)
+
+
+class MemoryChangeStream:
+    """Change stream fed by the writes of the in-memory collections."""
+
+    def __init__(self, database, pipeline: list):
+        self._database = database
+        self._filters = [
+            stage["$match"] for stage in pipeline or [] if "$match" in stage
+        ]
+        self._queue = asyncio.Queue()
+        self.resume_token = None
+        database.streams.add(self)
+
+    def push(self, event: dict):
+        if all(matches(event, query) for query in self._filters):
+            self._queue.put_nowait(event)
+
+    def close(self):
+        self._database.streams.discard(self)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        event = await self._queue.get()
+        self.resume_token = event["_id"]
+        return event
+
+
+# Collections, databases and client
+
+
+class MemoryCollection:
+    """Collection kept in a dict, in insertion (natural) order."""
+
+    def __init__(self, database, name: str):
+        self.database = database
+        self.name = name
+        self.documents = {}
+        self.indexes = {}
+        self._ttl_checked_at = 0.0
+
+    def with_options(self, **options):
+        return self
+
+    # Reads
+
+    def _expire(self):
+        ttl_indexes = [
+            index for index in self.indexes.values() if index.expire_after_seconds
+        ]
+        if not ttl_indexes or time.monotonic() - self._ttl_checked_at < 1:
+            return
+        self._ttl_checked_at = time.monotonic()
+        now = encode(datetime.now(timezone.utc))
+        for index in ttl_indexes:
+            expired_before = now - timedelta(seconds=index.expire_after_seconds)
+            for document in list(self.documents.values()):
+                value = get_path(document, index.field)
+                if isinstance(value, datetime) and value < expired_before:
+                    self._remove(document)
+
+    def _candidates(self, query: dict) -> list:
+        self._expire()
+        query = query or {}
+        ids = None
+        if "_id" in query and not is_operator_dict(query["_id"]):
+            key = hashable(encode(query["_id"]))
+            ids = {key} if key in self.documents else set()
+        else:
+            for index in self.indexes.values():
+                if index.field in query:
+                    found = index.lookup(query[index.field])
+                    if found is not None and (ids is None or len(found) < len(ids)):
+                        ids = found
+        if ids is None:
+            documents = list(self.documents.values())
+        else:
+            # Keep the natural order
+            documents = [
+                self.documents[key]
+                for key in sorted(ids, key=lambda key: self.documents[key]["__order"])
+                if key in self.documents
+            ]
+        return [document for document in documents if matches(document, query)]
+
+    def find(self, filter=None, projection=None, **kwargs):
+        def source():
+            return [strip(document) for document in self._candidates(filter)]
+
+        cursor = MemoryCursor(source, projection)
+        if kwargs.get("sort"):
+            cursor.sort(kwargs["sort"])
+        if kwargs.get("skip"):
+            cursor.skip(kwargs["skip"])
+        if kwargs.get("limit"):
+            cursor.limit(kwargs["limit"])
+        return cursor
+
+    async def find_one(self, filter=None, projection=None, sort=None, **kwargs):
+        documents = await self.find(filter, projection, sort=sort).limit(1).to_list(1)
+        return documents[0] if documents else None
+
+    async def count_documents(self, filter=None, **kwargs) -> int:
+        return len(self._candidates(filter))
+
+    async def estimated_document_count(self, **kwargs) -> int:
+        return len(self.documents)
+
+    async def distinct(self, key: str, filter=None, **kwargs) -> list:
+        values = {}
+        for document in self._candidates(filter):
+            for value in candidates(get_path(document, key))[1:] or [
+                get_path(document, key)
+            ]:
+                if value is not MISSING:
+                    values.setdefault(hashable(value), value)
+        return list(values.values())
+
+    def aggregate(self, pipeline: list, **kwargs):
+        return MemoryCursor(lambda: self.database.run_pipeline(self, pipeline))
+
+    # Writes
+
+    def _check_unique(self, document: dict, ignore_id=None):
+        for index in self.indexes.values():
+            if not index.unique:
+                continue
+            key = index.unique_key(document)
+            if key is None:
+                continue
+            for other in self.documents.values():
+                if other["_id"] != ignore_id and index.unique_key(other) == key:
+                    raise DuplicateKeyError(
+                        f"E11000 duplicate key error collection: {self.name} "
+                        f"index: {index.name}",
+                        11000,
+                    )
+
+    def _add(self, document: dict):
+        key = hashable(document["_id"])
+        if key in self.documents:
+            raise DuplicateKeyError(
+                f"E11000 duplicate key error collection: {self.name} index: _id_", 11000
+            )
+        self._check_unique(document)
+        document["__order"] = next(self.database.counter)
+        self.documents[key] = document
+        for index in self.indexes.values():
+            index.add(key, document)
+
+    def _remove(self, document: dict):
+        key = hashable(document["_id"])
+        del self.documents[key]
+        for index in self.indexes.values():
+            index.remove(key, document)
+
+    def _replace(self, document: dict, updated: dict):
+        key = hashable(document["_id"])
+        self._check_unique(updated, ignore_id=document["_id"])
+        for index in self.indexes.values():
+            index.remove(key, document)
+            index.add(key, updated)
+        self.documents[key] = updated
+
+    def _notify(self, operation: str, document_id):
+        self.database.notify(self.name, operation, document_id)
+
+    async def insert_one(self, document: dict, **kwargs):
+        document.setdefault("_id", ObjectId())
+        self._add(encode(document))
+        self._notify("insert", document["_id"])
+        return InsertOneResult(document["_id"])
+
+    async def insert_many(self, documents: list, ordered: bool = True, **kwargs):
+        inserted_ids, errors = [], []
+        for position, document in enumerate(documents):
+            document.setdefault("_id", ObjectId())
+            try:
+                self._add(encode(document))
+            except DuplicateKeyError as error:
+                errors.append({"index": position, "code": 11000, "errmsg": str(error)})
+                if ordered:
+                    break
+                continue
+            inserted_ids.append(document["_id"])
+            self._notify("insert", document["_id"])
+        if errors:
+            raise BulkWriteError(
+                {
+                    "writeErrors": errors,
+                    "nInserted": len(inserted_ids),
+                    "writeConcernErrors": [],
+                }
+            )
+        return InsertManyResult(inserted_ids)
+
+    def _update(self, filter, update, upsert: bool, many: bool):
+        matched = self._candidates(filter)
+        if not many:
+            matched = matched[:1]
+        modified_count = 0
+        for document in matched:
+            updated = copy_value(document)
+            if apply_update(updated, update):
+                self._replace(document, updated)
+                modified_count += 1
+                self._notify("update", document["_id"])
+        if matched or not upsert:
+            return UpdateResult(len(matched), modified_count), matched
+        document = upsert_seed(filter or {})
+        apply_update(document, update, inserting=True)
+        document.setdefault("_id", ObjectId())
+        self._add(document)
+        self._notify("insert", document["_id"])
+        return UpdateResult(0, 0, document["_id"]), [document]
+
+    async def update_one(self, filter, update, upsert: bool = False, **kwargs):
+        return self._update(filter, update, upsert, many=False)[0]
+
+    async def update_many(self, filter, update, upsert: bool = False, **kwargs):
+        return self._update(filter, update, upsert, many=True)[0]
+
+    async def replace_one(
+        self, filter, replacement: dict, upsert: bool = False, **kwargs
+    ):
+        matched = self._candidates(filter)[:1]
+        if not matched:
+            if not upsert:
+                return UpdateResult(0, 0)
+            document = encode(replacement)
+            document.setdefault("_id", ObjectId())
+            self._add(document)
+            self._notify("insert", document["_id"])
+            return UpdateResult(0, 0, document["_id"])
+        document = matched[0]
+        updated = encode(replacement)
+        updated["_id"] = document["_id"]
+        updated["__order"] = document["__order"]
+        self._replace(document, updated)
+        self._notify("replace", document["_id"])
+        return UpdateResult(1, 1)
+
+    async def find_one_and_update(
+        self,
+        filter,
+        update,
+        projection=None,
+        sort=None,
+        upsert: bool = False,
+        return_document=ReturnDocument.BEFORE,
+        **kwargs,
+    ):
+        if sort:
+            documents = sort_documents(self._candidates(filter), normalize_sort(sort))
+            if documents:
+                filter = {"_id": documents[0]["_id"]}
+        before = self._candidates(filter)[:1]
+        before = copy_value(before[0]) if before else None
+        result, documents = self._update(filter, update, upsert, many=False)
+        if return_document == ReturnDocument.AFTER:
+            document = (
+                self.documents.get(hashable(documents[0]["_id"])) if documents else None
+            )
+        else:
+            document = before
+        return copy_value(project(strip(document), projection)) if document else None
+
+    async def find_one_and_delete(self, filter, projection=None, sort=None, **kwargs):
+        documents = self._candidates(filter)
+        if sort:
+            documents = sort_documents(documents, normalize_sort(sort))
+        if not documents:
+            return None
+        document = documents[0]
+        self._remove(document)
+        self._notify("delete", document["_id"])
+        return copy_value(project(strip(document), projection))
+
+    async def delete_one(self, filter, **kwargs):
+        documents = self._candidates(filter)[:1]
+        for document in documents:
+            self._remove(document)
+            self._notify("delete", document["_id"])
+        return DeleteResult(len(documents))
+
+    async def delete_many(self, filter, **kwargs):
+        documents = self._candidates(filter)
+        for document in documents:
+            self._remove(document)
+            self._notify("delete", document["_id"])
+        return DeleteResult(len(documents))
+
+    async def bulk_write(self, requests: list, ordered: bool = True, **kwargs):
+        result = BulkWriteResult()
+        for position, request in enumerate(requests):
+            if isinstance(request, InsertOne):
+                await self.insert_one(request._doc)
+                result.inserted_count += 1
+            elif isinstance(request, (UpdateOne, UpdateMany)):
+                update_result, _ = self._update(
+                    request._filter,
+                    request._doc,
+                    bool(request._upsert),
+                    many=isinstance(request, UpdateMany),
+                )
+                result.matched_count += update_result.matched_count
+                result.modified_count += update_result.modified_count
+                if update_result.upserted_id is not None:
+                    result.upserted_count += 1
+                    result.upserted_ids[position] = update_result.upserted_id
+            elif isinstance(request, DeleteOne):
+                result.deleted_count += (
+                    await self.delete_one(request._filter)
+                ).deleted_count
+            elif isinstance(request, DeleteMany):
+                result.deleted_count += (
+                    await self.delete_many(request._filter)
+                ).deleted_count
+            else:
+                raise OperationFailure(f"unsupported bulk operation: {request!r}")
+        return result
+
+    # Indexes and administration
+
+    async def create_index(
+        self, keys, unique: bool = False, name: str = None, **kwargs
+    ):
+        keys = normalize_sort(keys, 1)
+        name = name or "_".join(f"{key}_{direction}" for key, direction in keys)
+        if name not in self.indexes:
+            index = Index(
+                name,
+                keys,
+                unique,
+                kwargs.get("partialFilterExpression"),
+                kwargs.get("expireAfterSeconds"),
+            )
+            for key, document in self.documents.items():
+                index.add(key, document)
+            self.indexes[name] = index
+        return name
+
+    async def drop_index(self, name: str, **kwargs):
+        self.indexes.pop(name, None)
+
+    async def index_information(self) -> dict:
+        information = {"_id_": {"key": [("_id", 1)]}}
+        for name, index in self.indexes.items():
+            information[name] = {"key": index.keys, "unique": index.unique}
+        return information
+
+    async def drop(self):
+        self.documents.clear()
+        for index in self.indexes.values():
+            index.entries.clear()
+
+
+def strip(document: dict) -> dict:
+    # Drop the internal insertion order from a stored document
+    return {key: value for key, value in document.items() if key != "__order"}
+
+
+class MemoryDatabase:
+    def __init__(self, client, name: str):
+        self.client = client
+        self.name = name
+        self.collections = {}
+        self.streams = set()
+        self.counter = itertools.count()
+        self._events = itertools.count()
+
+    def get_collection(self, name: str, **options) -> MemoryCollection:
+        if name not in self.collections:
+            self.collections[name] = MemoryCollection(self, name)
+        return self.collections[name]
+
+    def __getitem__(self, name: str) -> MemoryCollection:
+        return self.get_collection(name)
+
+    def __getattr__(self, name: str) -> MemoryCollection:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self.get_collection(name)
+
+    def with_options(self, **options):
+        return self
+
+    async def list_collection_names(self, **kwargs) -> list:
+        return list(self.collections)
+
+    async def create_collection(self, name: str, **options) -> MemoryCollection:
+        if name in self.collections:
+            raise OperationFailure(f"Collection {self.name}.{name} already exists")
+        return self.get_collection(name)
+
+    async def drop_collection(self, name: str):
+        self.collections.pop(name, None)
+
+    async def command(self, command, **kwargs) -> dict:
+        return await self.client.admin.command(command, **kwargs)
+
+    def watch(self, pipeline=None, **kwargs) -> MemoryChangeStream:
+        return MemoryChangeStream(self, pipeline)
+
+    def notify(self, collection_name: str, operation: str, document_id):
+        if not self.streams:
+            return
+        event = {
+            "_id": {"_data": str(next(self._events))},
+            "operationType": operation,
+            "ns": {"db": self.name, "coll": collection_name},
+            "documentKey": {"_id": document_id},
+        }
+        for stream in list(self.streams):
+            stream.push(event)
+
+    def run_pipeline(self, collection: MemoryCollection, pipeline: list) -> list:
+        documents = [strip(document) for document in collection._candidates({})]
+        for stage in pipeline:
+            ((operator, argument),) = stage.items()
+            if operator == "$match":
+                documents = [
+                    document for document in documents if matches(document, argument)
+                ]
+            elif operator == "$sort":
+                documents = sort_documents(documents, normalize_sort(argument))
+            elif operator == "$skip":
+                documents = documents[argument:]
+            elif operator == "$limit":
+                documents = documents[:argument]
+            elif operator == "$count":
+                documents = [{argument: len(documents)}] if documents else []
+            elif operator == "$project":
+                documents = [project(document, argument) for document in documents]
+            elif operator in ("$addFields", "$set"):
+                for document in documents:
+                    for key, expression in argument.items():
+                        set_path(document, key, evaluate(expression, document))
+            elif operator == "$unset":
+                names = [argument] if isinstance(argument, str) else argument
+                for document in documents:
+                    for name in names:
+                        unset_path(document, name)
+            elif operator == "$unwind":
+                path = argument if isinstance(argument, str) else argument["path"]
+                unwound = []
+                for document in documents:
+                    values = get_path(document, path[1:])
+                    for value in values if isinstance(values, list) else []:
+                        item = copy_value(document)
+                        set_path(item, path[1:], value)
+                        unwound.append(item)
+                documents = unwound
+            elif operator == "$group":
+                groups = {}
+                for document in documents:
+                    key = evaluate(argument["_id"], document)
+                    groups.setdefault(hashable(key), (key, []))[1].append(document)
+                documents = []
+                for key, members in groups.values():
+                    grouped = {"_id": key}
+                    for name, accumulator in argument.items():
+                        if name != "_id":
+                            ((accumulator_operator, expression),) = accumulator.items()
+                            grouped[name] = accumulate(
+                                accumulator_operator, expression, members
+                            )
+                    documents.append(grouped)
+            elif operator == "$lookup":
+                foreign = self.get_collection(argument["from"])
+                for document in documents:
+                    value = get_path(document, argument["localField"])
+                    document[argument["as"]] = (
+                        [
+                            strip(other)
+                            for other in foreign._candidates(
+                                {argument["foreignField"]: value}
+                            )
+                        ]
+                        if value is not MISSING
+                        else []
+                    )
+            elif operator == "$unionWith":
+                if isinstance(argument, str):
+                    argument = {"coll": argument}
+                other = self.get_collection(argument["coll"])
+                documents = documents + self.run_pipeline(
+                    other, argument.get("pipeline", [])
+                )
+            elif operator == "$merge":
+                self._merge(documents, argument)
+                documents = []
+            else:
+                raise OperationFailure(f"unsupported aggregation stage: {operator}")
+        return documents
+
+    def _merge(self, documents: list, options):
+        if isinstance(options, str):
+            options = {"into": options}
+        target = self.get_collection(options["into"])
+        if options.get("on", "_id") != "_id":
+            raise OperationFailure("only $merge on _id is supported in memory")
+        for document in documents:
+            document.setdefault("_id", ObjectId())
+            existing = target.documents.get(hashable(document["_id"]))
+            if existing is None:
+                if options.get("whenNotMatched", "insert") == "insert":
+                    target._add(encode(document))
+            elif options.get("whenMatched", "merge") == "replace":
+                updated = encode(document)
+                updated["__order"] = existing["__order"]
+                target._replace(existing, updated)
+            else:
+                updated = dict(existing)
+                updated.update(encode(document))
+                target._replace(existing, updated)
+
+
+class MemoryAdmin:
+    async def command(self, command, **kwargs) -> dict:
+        name = command if isinstance(command, str) else next(iter(command))
+        if name in ("hello", "isMaster", "ismaster"):
+            # Reported as a replica set so that change streams are used
+            return {"ok": 1.0, "isWritablePrimary": True, "setName": "memory"}
+        if name == "ping":
+            return {"ok": 1.0}
+        raise OperationFailure(f"command {name} is not supported in memory")
+
+
+class MemoryClient:
+    """Drop-in replacement of ``AsyncIOMotorClient`` for the in-memory backend."""
+
+    def __init__(self, *args, **kwargs):
+        self.databases = {}
+        self.admin = MemoryAdmin()
+
+    def get_database(self, name: str, **options) -> MemoryDatabase:
+        if name not in self.databases:
+            self.databases[name] = MemoryDatabase(self, name)
+        return self.databases[name]
+
+    def __getitem__(self, name: str) -> MemoryDatabase:
+        return self.get_database(name)
+
+    def __getattr__(self, name: str) -> MemoryDatabase:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self.get_database(name)
+
+    def close(self):
+        pass
@@ -0,0 +1 @@
+"""One-shot data migrations, run with ``python -m app.migrations.<name>``."""
@@ -0,0 +1,47 @@
+"""Convert the ISO string dates of books and loans into native BSON dates.
+
+Run it from the ``books-api`` directory:
+
+    python -m app.migrations.dates_to_bson
+"""
+
+import asyncio
+
+from app.database import books_collection, loans_collection
+
+# Date fields stored as "YYYY-MM-DD" strings by the previous versions of the API
+DATE_FIELDS = [
+    (books_collection, "publishDate"),
+    (loans_collection, "loanDate"),
+    (loans_collection, "returnDate"),
+]
+
+
+async def migrate_field(collection, field: str) -> int:
+    """Convert ``field`` server side, leaving unparsable values untouched."""
+    result = await collection.update_many(
+        {field: {"$type": "string"}},
+        [
+            {
+                "$set": {
+                    field: {
+                        "$dateFromString": {
+                            "dateString": f"${field}",
+                            "onError": f"${field}",
+                        }
+                    }
+                }
+            }
+        ],
+    )
+    return result.modified_count
+
+
+async def migrate():
+    for collection, field in DATE_FIELDS:
+        modified_count = await migrate_field(collection, field)
+        print(f"{collection.name}.{field}: {modified_count} documents converted")
+
+
+if __name__ == "__main__":
+    asyncio.run(migrate())
@@ -0,0 +1,39 @@
+"""Add the ``returned`` and ``overdue`` flags to the loans created before they existed.
+
+Run it from the ``books-api`` directory:
+
+    python -m app.migrations.loan_status
+"""
+
+import asyncio
+
+from app.database import loans_collection
+from app.dates import today
+
+
+async def migrate():
+    result = await loans_collection.update_many(
+        {"returned": {"$exists": False}}, {"$set": {"returned": False}}
+    )
+    print(f"loans.returned: {result.modified_count} documents updated")
+    result = await loans_collection.update_many(
+        {"overdue": {"$exists": False}},
+        [
+            {
+                "$set": {
+                    "overdue": {
+                        "$and": [
+                            {"$not": ["$returned"]},
+                            "$returnDate",
+                            {"$lt": ["$returnDate", today()]},
+                        ]
+                    }
+                }
+            }
+        ],
+    )
+    print(f"loans.overdue: {result.modified_count} documents updated")
+
+
+if __name__ == "__main__":
+    asyncio.run(migrate())
@@ -0,0 +1,40 @@
+"""Move the loans kept by the purges of the previous versions to ``loans_archive``.
+
+They were copied to the ``loans_cold`` collection, which is dropped once
+emptied. Run it from the ``books-api`` directory:
+
+    python -m app.migrations.loans_cold
+"""
+
+import asyncio
+from datetime import datetime, timezone
+
+from app.database import database, loans_archive_collection
+from app.export import BATCH_SIZE
+from app.repositories.loans_repository import PURGED_FIELD, insert_missing
+
+loans_cold_collection = database.get_collection("loans_cold")
+
+
+async def migrate():
+    moved = 0
+    now = datetime.now(timezone.utc)
+    while (
+        loans := await loans_cold_collection.find()
+        .limit(BATCH_SIZE)
+        .to_list(length=BATCH_SIZE)
+    ):
+        # Copied first, so that an interruption never loses a loan
+        await insert_missing(
+            loans_archive_collection, [{**loan, PURGED_FIELD: now} for loan in loans]
+        )
+        result = await loans_cold_collection.delete_many(
+            {"_id": {"$in": [loan["_id"] for loan in loans]}}
+        )
+        moved += result.deleted_count
+    await loans_cold_collection.drop()
+    print(f"loans_cold: {moved} loans moved to loans_archive")
+
+
+if __name__ == "__main__":
+    asyncio.run(migrate())
@@ -0,0 +1,64 @@
+"""Prepare the loans for sharding on a hash of ``adherent_id``.
+
+The references stored as strings by the previous versions of the API are
+converted to ObjectIds (a string and an ObjectId hash differently), and the
+hashed index backing the shard key is created on ``loans`` and
+``loans_archive``. Connected to a mongos, the two collections are then
+sharded. Run it from the ``books-api`` directory:
+
+    python -m app.migrations.loans_shard_key
+"""
+
+import asyncio
+
+from app.database import client, database, loans_archive_collection, loans_collection
+from app.sharding import LOANS_SHARD_KEY, SHARD_KEY_FIELD
+
+REFERENCE_FIELDS = ("book_id", "adherent_id")
+
+
+async def convert_references(collection) -> int:
+    """Convert the string references server side, leaving invalid ones untouched."""
+    modified_count = 0
+    for field in REFERENCE_FIELDS:
+        result = await collection.update_many(
+            {field: {"$type": "string"}},
+            [
+                {
+                    "$set": {
+                        field: {
+                            "$convert": {
+                                "input": f"${field}",
+                                "to": "objectId",
+                                "onError": f"${field}",
+                            }
+                        }
+                    }
+                }
+            ],
+        )
+        modified_count += result.modified_count
+    return modified_count
+
+
+async def migrate():
+    collections = [loans_collection, loans_archive_collection]
+    for collection in collections:
+        modified_count = await convert_references(collection)
+        print(f"{collection.name}: {modified_count} references converted")
+        await collection.create_index([(SHARD_KEY_FIELD, "hashed")])
+    hello = await client.admin.command("hello")
+    if hello.get("msg") != "isdbgrid":
+        print("Not connected to a mongos: the collections are ready to be sharded")
+        return
+    for collection in collections:
+        await client.admin.command(
+            "shardCollection",
+            f"{database.name}.{collection.name}",
+            key=LOANS_SHARD_KEY,
+        )
+        print(f"{collection.name}: sharded on {LOANS_SHARD_KEY}")
+
+
+if __name__ == "__main__":
+    asyncio.run(migrate())
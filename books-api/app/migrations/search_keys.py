@@ -0,0 +1,51 @@
+"""Compute the normalized search keys of the documents created before they existed.
+
+Run it from the ``books-api`` directory:
+
+    python -m app.migrations.search_keys
+"""
+
+import asyncio
+
+from app.database import adherents_collection, authors_collection
+from app.use_cases.adherent_use_case import adherent_search_keys
+from app.use_cases.authors_use_case import author_name_keys
+from pymongo import UpdateOne
+
+BATCH_SIZE = 1000
+
+
+async def backfill(collection, keys_field: str, compute_keys) -> int:
+    """Set the fields returned by ``compute_keys`` on the documents missing ``keys_field``."""
+    updated_count = 0
+    query = {keys_field: {"$exists": False}}
+    while True:
+        documents = await collection.find(query).limit(BATCH_SIZE).to_list(BATCH_SIZE)
+        if not documents:
+            return updated_count
+        result = await collection.bulk_write(
+            [
+                UpdateOne(
+                    {"_id": document["_id"]},
+                    {"$set": compute_keys(document)},
+                )
+                for document in documents
+            ],
+            ordered=False,
+        )
+        updated_count += result.modified_count
+
+
+async def migrate():
+    updated_count = await backfill(
+        adherents_collection,
+        "search_keys",
+        lambda adherent: {"search_keys": adherent_search_keys(adherent)},
+    )
+    print(f"adherents.search_keys: {updated_count} documents updated")
+    updated_count = await backfill(authors_collection, "name_tokens", author_name_keys)
+    print(f"authors.name_tokens: {updated_count} documents updated")
+
+
+if __name__ == "__main__":
+    asyncio.run(migrate())
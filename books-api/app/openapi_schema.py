@@ -0,0 +1,74 @@
+"""Pre-generated OpenAPI schema, served as a static, cacheable artifact.
+
+The schema is exported at build time, so that the workers do not generate
+it from the routers and their docstrings. It documents the routes mounted by
+default; a worker mounting others (e.g. the /admin/profile routes) generates its own.
+Usage (from books-api):
+
+    python -m app.openapi_schema export   # write app/openapi.json
+    python -m app.openapi_schema check    # fail if it does not match the routers
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import sys
+from pathlib import Path
+
+SCHEMA_PATH = Path(__file__).with_name("openapi.json")
+
+# Serialized schema, its gzip encoding and ETag, loaded once per process
+cached = {}
+
+
+def render(app) -> bytes:
+    return json.dumps(app.openapi(), indent=2, ensure_ascii=False).encode() + b"\n"
+
+
+def documented_paths(app) -> set:
+    return {
+        route.path for route in app.routes if getattr(route, "include_in_schema", False)
+    }
+
+
+def load(app) -> dict:
+    """Load the exported schema, or generate it when it does not match the routes."""
+    if not cached:
+        body = SCHEMA_PATH.read_bytes() if SCHEMA_PATH.exists() else None
+        if body is None or set(json.loads(body)["paths"]) != documented_paths(app):
+            body = render(app)
+        cached["body"] = body
+        # mtime=0 keeps the compressed bytes identical across workers
+        cached["gzip"] = gzip.compress(body, mtime=0)
+        cached["etag"] = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+    return cached
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export or check the OpenAPI schema")
+    parser.add_argument("command", choices=["export", "check"])
+    args = parser.parse_args()
+    # Importing the app must not need a database
+    os.environ.setdefault("DB_BACKEND", "memory")
+    # Routes mounted by default only
+    os.environ["PROFILING_ENABLED"] = "false"
+    from app.main import app
+
+    body = render(app)
+    if args.command == "export":
+        SCHEMA_PATH.write_bytes(body)
+        print(f"OpenAPI schema written to {SCHEMA_PATH}")
+    elif not SCHEMA_PATH.exists() or SCHEMA_PATH.read_bytes() != body:
+        print(
+            f"{SCHEMA_PATH} is out of date, run: python -m app.openapi_schema export",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+    else:
+        print("OpenAPI schema is up to date")
+
+
+if __name__ == "__main__":
+    main()
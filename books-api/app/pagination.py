@@ -0,0 +1,55 @@
+"""Keyset pagination helpers shared by the repositories."""
+
+import base64
+from datetime import datetime
+
+from bson import ObjectId, json_util
+from bson.int64 import Int64
+
+# Hard cap on the page size of paginated listings
+MAX_PAGE_SIZE = 100
+
+# Types of the sort key values; anything else (e.g. an operator document) is rejected
+CURSOR_VALUE_TYPES = (str, int, Int64, float, bool, type(None), datetime, ObjectId)
+
+
+def encode_cursor(values: list) -> str:
+    """Encode the sort key values of the last returned document as an opaque cursor."""
+    raw = json_util.dumps(values).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> list:
+    """Decode a cursor produced by ``encode_cursor``."""
+    padded = cursor + "=" * (-len(cursor) % 4)
+    try:
+        values = json_util.loads(base64.urlsafe_b64decode(padded))
+    except Exception:
+        raise ValueError("Invalid cursor")
+    # Values are spliced into the keyset filter: only plain scalars are accepted
+    if not isinstance(values, list) or any(
+        type(value) not in CURSOR_VALUE_TYPES for value in values
+    ):
+        raise ValueError("Invalid cursor")
+    return values
+
+
+def keyset_filter(sort: list, values: list) -> dict:
+    """Build the filter matching documents strictly after ``values`` in ``sort`` order."""
+    if len(values) != len(sort):
+        raise ValueError("Invalid cursor")
+    clauses = []
+    for i, (field, direction) in enumerate(sort):
+        clause = {prev_field: values[j] for j, (prev_field, _) in enumerate(sort[:i])}
+        clause[field] = {"$gt" if direction > 0 else "$lt": values[i]}
+        clauses.append(clause)
+    return {"$or": clauses}
+
+
+def next_cursor(docs: list, sort: list, limit: int):
+    """Trim the extra look-ahead document and return the cursor of the next page."""
+    if len(docs) <= limit:
+        return None
+    del docs[limit:]
+    last = docs[-1]
+    return encode_cursor([last[field] for field, _ in sort])
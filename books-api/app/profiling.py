@@ -0,0 +1,218 @@
+"""On-demand CPU and allocation profiling of a running API process.
+
+- ``sample_stacks`` samples the Python stacks of every thread at a fixed
+  interval and returns them in the folded format (``a;b;c count``) read by
+  flamegraph.pl, speedscope or inferno.
+- ``take_allocations`` diffs two tracemalloc snapshots to show the code
+  allocating the most memory since the previous call.
+- ``RouteCpuMiddleware`` counts the CPU time of each route. Requests in
+  flight at the same time share the CPU time used meanwhile equally, since
+  they run interleaved on the same event loop.
+"""
+
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+# Leaf functions of threads waiting for work, left out of the profiles
+IDLE_LEAVES = {
+    ("threading.py", "wait"),
+    ("selectors.py", "select"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),
+}
+
+# Frames kept by tracemalloc for each allocation
+TRACEMALLOC_FRAMES = 10
+
+# Previous tracemalloc snapshot, the base of the next diff
+allocation_state = {"snapshot": None}
+
+# Only one CPU profile at a time: concurrent samplers would skew each other
+cpu_profile_lock = threading.Lock()
+
+
+def frame_label(frame) -> str:
+    code = frame.f_code
+    path = code.co_filename
+    # Paths relative to the installed packages or to the application
+    for marker in ("site-packages" + os.sep, "books-api" + os.sep):
+        if marker in path:
+            path = path.split(marker, 1)[1]
+            break
+    return f"{code.co_name} ({path}:{code.co_firstlineno})"
+
+
+def folded_stack(thread_name: str, frame) -> str:
+    labels = []
+    while frame is not None:
+        labels.append(frame_label(frame))
+        frame = frame.f_back
+    labels.append(thread_name)
+    # Folded stacks go from the root to the leaf; ";" separates the frames
+    return ";".join(label.replace(";", ":") for label in reversed(labels))
+
+
+def is_idle(frame) -> bool:
+    return (
+        os.path.basename(frame.f_code.co_filename),
+        frame.f_code.co_name,
+    ) in IDLE_LEAVES
+
+
+def sample_stacks(
+    seconds: float, interval: float, include_idle: bool = False
+) -> Counter:
+    """Sample the stacks of all the other threads; meant to run in its own thread."""
+    if not cpu_profile_lock.acquire(blocking=False):
+        raise RuntimeError("A CPU profile is already running")
+    try:
+        stacks = Counter()
+        sampler_id = threading.get_ident()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == sampler_id or (not include_idle and is_idle(frame)):
+                    continue
+                stacks[folded_stack(names.get(thread_id, str(thread_id)), frame)] += 1
+            time.sleep(interval)
+        return stacks
+    finally:
+        cpu_profile_lock.release()
+
+
+def format_folded(stacks: Counter) -> str:
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+def start_allocations():
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+    allocation_state["snapshot"] = take_snapshot()
+
+
+def stop_allocations():
+    tracemalloc.stop()
+    allocation_state["snapshot"] = None
+
+
+def take_snapshot():
+    return tracemalloc.take_snapshot().filter_traces(
+        [
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+        ]
+    )
+
+
+def take_allocations(top: int, key_type: str = "lineno") -> list:
+    """Top allocators since the previous call, which becomes the new base."""
+    if not tracemalloc.is_tracing():
+        raise RuntimeError("Allocation tracing is not started")
+    snapshot = take_snapshot()
+    differences = snapshot.compare_to(allocation_state["snapshot"], key_type)
+    allocation_state["snapshot"] = snapshot
+    return [
+        {
+            "location": [
+                f"{frame.filename}:{frame.lineno}" for frame in difference.traceback
+            ],
+            "size": difference.size,
+            "size_diff": difference.size_diff,
+            "count": difference.count,
+            "count_diff": difference.count_diff,
+        }
+        for difference in differences[:top]
+    ]
+
+
+class RouteCpuCounters:
+    def __init__(self):
+        self.routes = {}
+        # CPU time accumulated by each request in flight
+        self.in_flight = {}
+        self.last_cpu_time = time.process_time()
+
+    def share_cpu_time(self):
+        cpu_time = time.process_time()
+        if self.in_flight:
+            share = (cpu_time - self.last_cpu_time) / len(self.in_flight)
+            for request_id in self.in_flight:
+                self.in_flight[request_id] += share
+        self.last_cpu_time = cpu_time
+
+    def start(self, request_id: int):
+        self.share_cpu_time()
+        self.in_flight[request_id] = 0.0
+
+    def finish(self, request_id: int, route: str, wall_time: float):
+        self.share_cpu_time()
+        cpu_time = self.in_flight.pop(request_id)
+        counters = self.routes.setdefault(
+            route, {"requests": 0, "cpu_seconds": 0.0, "wall_seconds": 0.0}
+        )
+        counters["requests"] += 1
+        counters["cpu_seconds"] += cpu_time
+        counters["wall_seconds"] += wall_time
+
+    def report(self) -> list:
+        report = [
+            {
+                "route": route,
+                **counters,
+                "cpu_ms_per_request": 1000
+                * counters["cpu_seconds"]
+                / counters["requests"],
+            }
+            for route, counters in self.routes.items()
+        ]
+        report.sort(key=lambda counters: -counters["cpu_seconds"])
+        return report
+
+    def reset(self):
+        self.routes = {}
+
+
+route_cpu = RouteCpuCounters()
+
+
+# Long-lived requests (event streams, profiles) would take a share of all the CPU time
+EXCLUDED_PATHS = ("/events", "/admin/")
+
+
+def route_template(scope) -> str:
+    """Path of the request with its path parameters as placeholders: /books/{book_id}."""
+    if scope.get("route") is None:
+        return "unmatched"
+    # Rebuilt from the path: the matched route may be relative to its router prefix
+    names = {str(value): name for name, value in scope.get("path_params", {}).items()}
+    return "/".join(
+        "{" + names[segment] + "}" if segment in names else segment
+        for segment in scope["path"].split("/")
+    )
+
+
+class RouteCpuMiddleware:
+    def __init__(self, app, counters: RouteCpuCounters = route_cpu):
+        self.app = app
+        self.counters = counters
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith(EXCLUDED_PATHS):
+            await self.app(scope, receive, send)
+            return
+        request_id = id(scope)
+        started = time.perf_counter()
+        self.counters.start(request_id)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.counters.finish(
+                request_id,
+                f"{scope['method']} {route_template(scope)}",
+                time.perf_counter() - started,
+            )
@@ -0,0 +1,91 @@
+"""Existence checks of the books and adherents referenced by a write.
+
+The ids of the live books and adherents are cached by each process and kept
+current by the change feed, so that checking the references of a loan costs
+no database round trip in the common case. The ids missing from the cache
+(e.g. created by another worker a moment ago) are looked up with one ``$in``
+query per collection. Without change feed, every check queries the database.
+"""
+
+from app.database import primary_reads
+from app.repositories import adherent_repository, books_repository
+from bson import ObjectId
+
+
+class InvalidReferenceError(ValueError):
+    """A written document references a document that does not exist."""
+
+    def __init__(self, field: str, value: str):
+        super().__init__(f"Unknown {field}: {value}")
+        self.field = field
+        self.value = value
+
+
+class ReferenceInUseError(ValueError):
+    """A deleted document is still referenced by other documents."""
+
+
+# Referencing field -> referenced collection
+REFERENCED_COLLECTIONS = {"book_id": "books", "adherent_id": "adherents"}
+
+loaders = {
+    "books": lambda: books_repository.iter_all({}, {"_id": 1}),
+    "adherents": adherent_repository.iter_ids,
+}
+
+finders = {
+    "books": books_repository.find_existing_ids,
+    "adherents": adherent_repository.find_existing_ids,
+}
+
+# Live ids per collection, as strings like the change feed ids; None when not cached
+live_ids = {"books": None, "adherents": None}
+
+
+async def load(collection_name: str):
+    ids = set()
+    # A lagging secondary would miss the latest writes, never replayed by the feed
+    with primary_reads():
+        async for document in loaders[collection_name]():
+            ids.add(str(document["_id"]))
+    live_ids[collection_name] = ids
+
+
+async def load_all():
+    """Cache the live ids; to call before following the change feed."""
+    for collection_name in live_ids:
+        await load(collection_name)
+
+
+async def refresh(change: dict):
+    """Change feed listener applying the inserts and deletes to the cached ids."""
+    ids = live_ids.get(change["collection"])
+    # An update never adds or removes an id
+    if ids is None or change["operation"] in ("update", "replace"):
+        return
+    if change["id"] is None:
+        # Several documents inserted or deleted at once (or the collection dropped)
+        await load(change["collection"])
+    elif change["operation"] == "insert":
+        ids.add(change["id"])
+    elif change["operation"] == "delete":
+        ids.discard(change["id"])
+
+
+async def check(**references):
+    """Raise InvalidReferenceError unless each ``field=id`` references a live document."""
+    missing = {}
+    for field, value in references.items():
+        if not ObjectId.is_valid(value):
+            raise InvalidReferenceError(field, value)
+        collection_name = REFERENCED_COLLECTIONS[field]
+        ids = live_ids[collection_name]
+        if ids is None or str(value) not in ids:
+            missing.setdefault(collection_name, []).append((field, ObjectId(value)))
+    for collection_name, fields in missing.items():
+        found = await finders[collection_name]([oid for _, oid in fields])
+        for field, oid in fields:
+            if oid not in found:
+                raise InvalidReferenceError(field, str(oid))
+        if live_ids[collection_name] is not None:
+            live_ids[collection_name].update(str(oid) for oid in found)
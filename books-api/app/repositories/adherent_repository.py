@@ -1,6 +1,19 @@
-from app.database import adherents_collection, loans_collection
+import re
+
+from app import change_feed, schema_versions
+from app.database import adherents_collection, loans_collection, read_collection
+from app.export import BATCH_SIZE
+from app.repositories import loans_repository
+from app.pagination import keyset_filter, next_cursor
+from app.sharding import loans_query
 from bson import ObjectId
 
+# Prefix matches fetched before ranking; a search returns a subset of them
+SEARCH_CANDIDATES = 200
+
+# Sort of the adherent's loan history, served by the (adherent_id, loanDate, _id) index
+LOANS_BY_ADHERENT_SORT = [("loanDate", 1), ("_id", 1)]
+
 
 async def find_by_id(adherent_id: str) -> dict:
     try:
@@ -11,12 +24,42 @@ async def find_by_id(adherent_id: str) -> dict:
 
 
 async def find_all(query: dict, skip: int, limit: int) -> list:
-    adherents_cursor = adherents_collection.find(query).skip(skip).limit(limit)
+    collection = read_collection(adherents_collection, "adherent_repository.find_all")
+    adherents_cursor = collection.find(query).skip(skip).limit(limit)
     return await adherents_cursor.to_list(length=limit)
 
 
+def iter_ids():
+    """Cursor over the ids of all the adherents, fetched by batches."""
+    return adherents_collection.find({}, {"_id": 1}).batch_size(BATCH_SIZE)
+
+
+async def find_existing_ids(adherent_ids: list) -> list:
+    cursor = adherents_collection.find({"_id": {"$in": adherent_ids}}, {"_id": 1})
+    adherents = await cursor.to_list(length=None)
+    return [adherent["_id"] for adherent in adherents]
+
+
+async def search(query_tokens: list, exact_key: str) -> list:
+    """Adherents whose search keys start with every token, exact key matches first."""
+    projection = {"password": 0}
+    collection = read_collection(adherents_collection, "adherent_repository.search")
+    # Whole identifier or word equal to the query, missed by a truncated prefix scan
+    exact = await collection.find({"search_keys": exact_key}, projection).to_list(
+        length=SEARCH_CANDIDATES
+    )
+    # Anchored, case-sensitive prefixes are range scans on the search_keys index
+    patterns = [re.compile("^" + re.escape(token)) for token in query_tokens]
+    prefix = await collection.find(
+        {"search_keys": {"$all": patterns}}, projection
+    ).to_list(length=SEARCH_CANDIDATES)
+    found = {adherent["_id"]: adherent for adherent in exact + prefix}
+    return list(found.values())
+
+
 async def insert_adherent(adherent_doc: dict) -> str:
     result = await adherents_collection.insert_one(adherent_doc)
+    await change_feed.record_change("adherents", "insert", result.inserted_id)
     return str(result.inserted_id)
 
 
@@ -26,6 +69,8 @@ async def update_adherent(adherent_id: str, adherent_doc: dict) -> int:
     except Exception:
         return 0
     result = await adherents_collection.update_one({"_id": oid}, {"$set": adherent_doc})
+    if result.modified_count:
+        await change_feed.record_change("adherents", "update", oid)
     return result.modified_count
 
 
@@ -35,6 +80,8 @@ async def delete_adherent(adherent_id: str) -> int:
     except Exception:
         return 0
     result = await adherents_collection.delete_one({"_id": oid})
+    if result.deleted_count:
+        await change_feed.record_change("adherents", "delete", oid)
     return result.deleted_count
 
 
@@ -42,12 +89,31 @@ async def find_by_login(login: str) -> dict:
     return await adherents_collection.find_one({"login": login})
 
 
-async def find_loans_by_adherent(adherent_id: str) -> list:
+async def find_loans_by_adherent(
+    adherent_id: str,
+    limit: int,
+    after: list = None,
+    direction: int = -1,
+    include_archive: bool = False,
+) -> tuple:
     try:
         oid = ObjectId(adherent_id)
     except Exception:
-        return []
+        return [], None
 
-    cursor = loans_collection.find({"adherent_id": oid})
-    loans = await cursor.to_list(length=None)
-    return loans
+    sort = [(field, order * direction) for field, order in LOANS_BY_ADHERENT_SORT]
+    query = {"adherent_id": oid}
+    if after:
+        query.update(keyset_filter(sort, after))
+    loans_query("adherent_repository.find_loans_by_adherent", query)
+    # Fetch one extra document to know whether another page exists
+    if include_archive:
+        loans = await loans_repository.find_across_tiers(query, sort, limit + 1)
+        # Not written back: the tier of each loan is unknown
+        loans = schema_versions.upgraded("loans", loans)
+    else:
+        cursor = loans_collection.find(query).sort(sort).limit(limit + 1)
+        loans = await cursor.to_list(length=limit + 1)
+        loans = schema_versions.upgraded("loans", loans, loans_collection)
+    # The cursor is built from the upgraded values, e.g. dates rather than strings
+    return loans, next_cursor(loans, sort, limit)
@@ -1,6 +1,18 @@
-from app.database import authors_collection, books_collection
+import re
+from datetime import datetime
+
+from app import change_feed
+from app.database import authors_collection, books_collection, read_collection
+from app.export import BATCH_SIZE
+from app.pagination import keyset_filter, next_cursor
 from bson import ObjectId
 
+# Prefix matches fetched before ranking; a search returns a subset of them
+SEARCH_CANDIDATES = 200
+
+# Sort of the author's books listing, served by the (author_id, _id) index
+BOOKS_BY_AUTHOR_SORT = [("_id", 1)]
+
 
 async def find_by_id(author_id: str) -> dict:
     try:
@@ -11,12 +23,28 @@ async def find_by_id(author_id: str) -> dict:
 
 
 async def find_all(query: dict, skip: int, limit: int) -> list:
-    cursor = authors_collection.find(query).skip(skip).limit(limit)
+    collection = read_collection(authors_collection, "authors_repository.find_all")
+    cursor = collection.find(query).skip(skip).limit(limit)
     return await cursor.to_list(length=limit)
 
 
+def iter_all(projection: dict = None):
+    """Cursor over all the authors, fetched by batches in _id order."""
+    return authors_collection.find({}, projection).sort("_id", 1).batch_size(BATCH_SIZE)
+
+
+async def search(query_tokens: list) -> list:
+    """Authors having a name token starting with each of ``query_tokens``."""
+    # Anchored, case-sensitive prefixes are range scans on the name_tokens index
+    patterns = [re.compile("^" + re.escape(token)) for token in query_tokens]
+    collection = read_collection(authors_collection, "authors_repository.search")
+    cursor = collection.find({"name_tokens": {"$all": patterns}})
+    return await cursor.to_list(length=SEARCH_CANDIDATES)
+
+
 async def insert_author(author_doc: dict) -> str:
     result = await authors_collection.insert_one(author_doc)
+    await change_feed.record_change("authors", "insert", result.inserted_id)
     return str(result.inserted_id)
 
 
@@ -26,6 +54,8 @@ async def update_author(author_id: str, author_doc: dict) -> int:
     except Exception:
         return 0
     result = await authors_collection.update_one({"_id": oid}, {"$set": author_doc})
+    if result.modified_count:
+        await change_feed.record_change("authors", "update", oid)
     return result.modified_count
 
 
@@ -35,22 +65,41 @@ async def delete_author(author_id: str) -> int:
     except Exception:
         return 0
     result = await authors_collection.delete_one({"_id": oid})
+    if result.deleted_count:
+        await change_feed.record_change("authors", "delete", oid)
     return result.deleted_count
 
 
-async def find_books_by_author(author_id: str) -> list:
+async def find_books_by_author(
+    author_id: str,
+    limit: int,
+    after: list = None,
+    direction: int = 1,
+    projection: dict = None,
+) -> tuple:
     try:
         oid = ObjectId(author_id)
     except Exception:
-        return []
+        return [], None
 
-    books_cursor = books_collection.find({"author_id": oid})
-    books = await books_cursor.to_list(length=None)
+    sort = [(field, order * direction) for field, order in BOOKS_BY_AUTHOR_SORT]
+    query = {"author_id": oid}
+    if after:
+        query.update(keyset_filter(sort, after))
+    # Fetch one extra document to know whether another page exists
+    collection = read_collection(
+        books_collection, "authors_repository.find_books_by_author"
+    )
+    books_cursor = collection.find(query, projection).sort(sort).limit(limit + 1)
+    books = await books_cursor.to_list(length=limit + 1)
+    cursor = next_cursor(books, sort, limit)
 
     for book in books:
         book["id"] = str(book["_id"])
         del book["_id"]
         if "author_id" in book:
             book["author_id"] = str(book["author_id"])
+        if isinstance(book.get("publishDate"), datetime):
+            book["publishDate"] = book["publishDate"].date()
 
-    return books
+    return books, cursor
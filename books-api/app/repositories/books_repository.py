@@ -1,4 +1,6 @@
-from app.database import authors_collection, books_collection
+from app import change_feed, schema_versions
+from app.database import authors_collection, books_collection, read_collection
+from app.export import BATCH_SIZE
 from bson import ObjectId
 
 
@@ -7,16 +9,115 @@ async def find_by_id(book_id: str) -> dict:
         oid = ObjectId(book_id)
     except Exception:
         return None
-    return await books_collection.find_one({"_id": oid})
+    book = await books_collection.find_one({"_id": oid})
+    if book is None:
+        return None
+    return schema_versions.upgraded("books", [book], books_collection)[0]
 
 
 async def find_all(query: dict, skip: int, limit: int) -> list:
-    cursor = books_collection.find(query).skip(skip).limit(limit)
-    return await cursor.to_list(length=limit)
+    collection = read_collection(books_collection, "books_repository.find_all")
+    cursor = collection.find(query).skip(skip).limit(limit)
+    books = await cursor.to_list(length=limit)
+    # Written back to the primary, whatever the collection read from
+    return schema_versions.upgraded("books", books, books_collection)
+
+
+def iter_all(query: dict, projection: dict = None):
+    """Cursor over all the matching books, fetched by batches in _id order."""
+    collection = read_collection(books_collection, "books_repository.iter_all")
+    cursor = collection.find(query, projection)
+    return cursor.sort("_id", 1).batch_size(BATCH_SIZE)
+
+
+async def find_values(field: str, pattern: str, limit: int) -> list:
+    """Distinct values of ``field`` matching the regular expression, case-insensitively."""
+    collection = read_collection(books_collection, "books_repository.find_values")
+    cursor = collection.aggregate(
+        [
+            {"$match": {field: {"$regex": pattern, "$options": "i"}}},
+            {"$group": {"_id": f"${field}"}},
+            {"$sort": {"_id": 1}},
+            {"$limit": limit},
+        ]
+    )
+    return [value["_id"] for value in await cursor.to_list(length=limit)]
+
+
+async def find_ids_with_stale_author(
+    author_id: ObjectId, summary: dict, limit: int, after: ObjectId = None
+) -> list:
+    # Served by the (author_id, _id) index, from the last book of the previous
+    # batch; the books already up to date are skipped
+    query = {"author_id": author_id, "author": {"$ne": summary}}
+    if after is not None:
+        query["_id"] = {"$gt": after}
+    cursor = books_collection.find(query, {"_id": 1}).sort("_id", 1).limit(limit)
+    books = await cursor.to_list(length=limit)
+    return [book["_id"] for book in books]
+
+
+async def count_stale_author(author_id: ObjectId, summary: dict) -> int:
+    return await books_collection.count_documents(
+        {"author_id": author_id, "author": {"$ne": summary}}
+    )
+
+
+async def count_orphans() -> int:
+    """Books whose author no longer exists."""
+    # One author lookup per distinct author_id rather than per book
+    pipeline = [
+        {"$group": {"_id": "$author_id", "books": {"$sum": 1}}},
+        {
+            "$lookup": {
+                "from": authors_collection.name,
+                "localField": "_id",
+                "foreignField": "_id",
+                "as": "author",
+            }
+        },
+        {"$match": {"author": {"$size": 0}}},
+        {"$group": {"_id": None, "orphans": {"$sum": "$books"}}},
+    ]
+    result = await books_collection.aggregate(pipeline).to_list(length=1)
+    return result[0]["orphans"] if result else 0
+
+
+async def set_author_summary(book_ids: list, summary: dict) -> int:
+    result = await books_collection.update_many(
+        {"_id": {"$in": book_ids}}, {"$set": {"author": summary}}
+    )
+    if result.modified_count:
+        # One change per book, like the change stream, so that the listeners
+        # refresh these books instead of reloading all of them
+        await change_feed.record_changes("books", "update", book_ids)
+    return result.modified_count
+
+
+async def find_existing_ids(book_ids: list) -> list:
+    cursor = books_collection.find({"_id": {"$in": book_ids}}, {"_id": 1})
+    books = await cursor.to_list(length=None)
+    return [book["_id"] for book in books]
+
+
+async def has_books_by_author(author_id: str) -> bool:
+    try:
+        oid = ObjectId(author_id)
+    except Exception:
+        return False
+    # Served by the (author_id, _id) index, stops at the first book
+    return await books_collection.count_documents({"author_id": oid}, limit=1) > 0
+
+
+async def find_by_ids(book_ids: list, projection: dict = None) -> list:
+    cursor = books_collection.find({"_id": {"$in": book_ids}}, projection)
+    return await cursor.to_list(length=None)
 
 
 async def insert_book(book_doc: dict) -> str:
+    book_doc[schema_versions.VERSION_FIELD] = schema_versions.current_version("books")
     result = await books_collection.insert_one(book_doc)
+    await change_feed.record_change("books", "insert", result.inserted_id)
     return str(result.inserted_id)
 
 
@@ -26,6 +127,8 @@ async def update_book(book_id: str, book_doc: dict) -> int:
     except Exception:
         return 0
     result = await books_collection.update_one({"_id": oid}, {"$set": book_doc})
+    if result.modified_count:
+        await change_feed.record_change("books", "update", oid)
     return result.modified_count
 
 
@@ -35,6 +138,8 @@ async def delete_book(book_id: str) -> int:
     except Exception:
         return 0
     result = await books_collection.delete_one({"_id": oid})
+    if result.deleted_count:
+        await change_feed.record_change("books", "delete", oid)
     return result.deleted_count
 
 
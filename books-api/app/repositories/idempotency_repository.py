@@ -0,0 +1,46 @@
+from datetime import datetime
+
+from app.database import idempotency_collection
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+
+async def insert_pending(record_id: str, fingerprint: str, now: datetime) -> bool:
+    # The unique _id makes the first request for a key the only one to go through
+    try:
+        await idempotency_collection.insert_one(
+            {
+                "_id": record_id,
+                "status": "pending",
+                "fingerprint": fingerprint,
+                "created_at": now,
+            }
+        )
+    except DuplicateKeyError:
+        return False
+    return True
+
+
+async def find_by_id(record_id: str) -> dict:
+    return await idempotency_collection.find_one({"_id": record_id})
+
+
+async def claim_stale_pending(
+    record_id: str, stale_before: datetime, now: datetime
+) -> dict:
+    # Atomically take over a key whose first request never completed
+    return await idempotency_collection.find_one_and_update(
+        {"_id": record_id, "status": "pending", "created_at": {"$lt": stale_before}},
+        {"$set": {"created_at": now}},
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+async def complete(record_id: str, response: dict):
+    await idempotency_collection.update_one(
+        {"_id": record_id}, {"$set": {"status": "completed", "response": response}}
+    )
+
+
+async def delete(record_id: str):
+    await idempotency_collection.delete_one({"_id": record_id})
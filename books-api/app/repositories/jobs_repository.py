@@ -0,0 +1,55 @@
+from datetime import datetime
+
+from app.database import jobs_collection
+from bson import ObjectId
+from pymongo import ReturnDocument
+
+# State of the loan history tiering, stored next to the jobs
+ARCHIVE_STATE_ID = "loan_archive"
+
+
+async def find_by_id(job_id: str) -> dict:
+    try:
+        oid = ObjectId(job_id)
+    except Exception:
+        return None
+    return await jobs_collection.find_one({"_id": oid})
+
+
+async def insert_job(job_doc: dict) -> str:
+    result = await jobs_collection.insert_one(job_doc)
+    return str(result.inserted_id)
+
+
+async def update_job(job_id: ObjectId, fields: dict):
+    await jobs_collection.update_one({"_id": job_id}, {"$set": fields})
+
+
+async def claim_stale_job(job_type: str, stale_before: datetime, now: datetime) -> dict:
+    # Atomically take over a job whose worker stopped sending heartbeats
+    return await jobs_collection.find_one_and_update(
+        {
+            "type": job_type,
+            "status": {"$in": ["pending", "running"]},
+            "heartbeat_at": {"$lt": stale_before},
+        },
+        {"$set": {"heartbeat_at": now}},
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+async def find_archive_watermark() -> datetime:
+    # Every archived loan was returned before this date
+    state = await jobs_collection.find_one({"_id": ARCHIVE_STATE_ID})
+    return state["archived_before"] if state else None
+
+
+async def raise_archive_watermark(archived_before: datetime, now: datetime):
+    await jobs_collection.update_one(
+        {"_id": ARCHIVE_STATE_ID},
+        {
+            "$max": {"archived_before": archived_before},
+            "$set": {"type": ARCHIVE_STATE_ID, "finished_at": now},
+        },
+        upsert=True,
+    )
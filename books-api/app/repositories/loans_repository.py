@@ -1,45 +1,352 @@
-from app.database import loans_collection
+from datetime import datetime, timezone
+
+from app import change_feed, schema_versions
+from app.config import (
+    LOAN_INSERT_BATCH_SIZE,
+    LOAN_INSERT_BATCH_WINDOW_MS,
+    LOAN_INSERT_BATCHING_ENABLED,
+    LOAN_INSERT_JOURNAL,
+    LOAN_INSERT_WRITE_CONCERN,
+)
+from app.database import loans_archive_collection, loans_collection, read_collection
+from app.export import BATCH_SIZE
+from app.insert_batching import InsertBatcher, write_concern
+from app.pagination import keyset_filter, next_cursor
+from app.sharding import SHARD_KEY_FIELD, loans_query
 from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError
+
+# Sort of the overdue loans report, served by the partial index on open loans
+OVERDUE_SORT = [("returnDate", 1), ("_id", 1)]
+
+# Set on the loans kept in the archive by a purge, which no read returns
+PURGED_FIELD = "purged_at"
+
+# Concurrent loan inserts coalesced into insert_many batches, when enabled
+loan_inserts = (
+    InsertBatcher(
+        loans_collection,
+        LOAN_INSERT_BATCH_SIZE,
+        LOAN_INSERT_BATCH_WINDOW_MS / 1000,
+        write_concern(LOAN_INSERT_WRITE_CONCERN, LOAN_INSERT_JOURNAL),
+    )
+    if LOAN_INSERT_BATCHING_ENABLED
+    else None
+)
+
+
+def archived(query: dict) -> dict:
+    """``query`` on the archive, without the loans kept there by the purges."""
+    return {**query, PURGED_FIELD: {"$exists": False}}
+
 
+def tier(in_archive: bool):
+    return loans_archive_collection if in_archive else loans_collection
 
-async def find_by_id(loan_id: str) -> dict:
+
+def tier_query(query: dict, in_archive: bool) -> dict:
+    return archived(query) if in_archive else query
+
+
+async def find_by_id(loan_id: str, adherent_id: ObjectId = None) -> dict:
+    # The adherent, when known, routes the reads to a single shard
     try:
         oid = ObjectId(loan_id)
     except Exception:
         return None
-    return await loans_collection.find_one({"_id": oid})
+    query = {"_id": oid}
+    if adherent_id is not None:
+        query[SHARD_KEY_FIELD] = adherent_id
+    # Returned loans end up in the archive
+    for in_archive in (False, True):
+        collection = tier(in_archive)
+        loan = await collection.find_one(
+            loans_query("loans_repository.find_by_id", tier_query(query, in_archive))
+        )
+        if loan is not None:
+            return schema_versions.upgraded("loans", [loan], collection)[0]
+    return None
 
 
-async def find_all(query: dict, skip: int, limit: int) -> list:
-    cursor = loans_collection.find(query).skip(skip).limit(limit)
-    return await cursor.to_list(length=limit)
+async def shard_key_filter(
+    oid: ObjectId, operation: str, in_archive: bool = False
+) -> dict:
+    """Filter of the loan ``oid`` with its shard key, needed by findAndModify on shards."""
+    query = tier_query({"_id": oid}, in_archive)
+    loan = await tier(in_archive).find_one(
+        loans_query(operation, query), {SHARD_KEY_FIELD: 1}
+    )
+    if loan is None:
+        return None
+    return {**query, SHARD_KEY_FIELD: loan.get(SHARD_KEY_FIELD)}
+
+
+async def find_all(
+    query: dict, skip: int, limit: int, include_archive: bool = False
+) -> list:
+    loans_query("loans_repository.find_all", query)
+    collection = read_collection(loans_collection, "loans_repository.find_all")
+    if include_archive:
+        loans = await find_across_tiers(query, [("_id", 1)], limit, skip, collection)
+        # Not written back: the tier of each loan is unknown
+        return schema_versions.upgraded("loans", loans)
+    # Same order as across the tiers
+    cursor = collection.find(query).sort("_id", 1).skip(skip).limit(limit)
+    loans = await cursor.to_list(length=limit)
+    return schema_versions.upgraded("loans", loans, loans_collection)
+
+
+async def iter_all(query: dict, include_archive: bool = False, projection: dict = None):
+    """Iterate over all the matching loans, by batches in _id order per tier."""
+    loans_query("loans_repository.iter_all", query)
+    collections = [loans_collection]
+    if include_archive:
+        collections.append(loans_archive_collection)
+    for collection in collections:
+        collection_query = tier_query(query, collection is loans_archive_collection)
+        collection = read_collection(collection, "loans_repository.iter_all")
+        cursor = collection.find(collection_query, projection).sort("_id", 1)
+        async for loan in cursor.batch_size(BATCH_SIZE):
+            yield loan
+
+
+async def find_across_tiers(
+    query: dict, sort: list, limit: int, skip: int = 0, collection=loans_collection
+) -> list:
+    # Runs on ``collection``, the loans collection with the read preference of the caller.
+    # Each tier returns its first skip + limit loans only, read in index order
+    # rather than sorted in memory
+    first = [{"$sort": dict(sort)}, {"$limit": skip + limit}]
+    pipeline = [
+        {"$match": query},
+        *first,
+        {
+            "$unionWith": {
+                "coll": loans_archive_collection.name,
+                "pipeline": [{"$match": archived(query)}, *first],
+            }
+        },
+        {"$sort": dict(sort)},
+        {"$skip": skip},
+        {"$limit": limit},
+    ]
+    return await collection.aggregate(pipeline).to_list(length=limit)
 
 
 async def insert_loan(loan_doc: dict) -> str:
-    result = await loans_collection.insert_one(loan_doc)
-    return str(result.inserted_id)
+    loan_doc[schema_versions.VERSION_FIELD] = schema_versions.current_version("loans")
+    if loan_inserts is not None:
+        inserted_id = await loan_inserts.insert(loan_doc)
+    else:
+        inserted_id = (await loans_collection.insert_one(loan_doc)).inserted_id
+    await change_feed.record_change("loans", "insert", inserted_id)
+    return str(inserted_id)
+
+
+async def flush_inserts():
+    """Write the loans waiting for their insert batch."""
+    if loan_inserts is not None:
+        await loan_inserts.close()
+
+
+def archivable(loan_doc: dict, archived_before: datetime) -> bool:
+    """Whether ``loan_doc`` fits the archive: returned, borrowed and due before the watermark."""
+    return (
+        archived_before is not None
+        and loan_doc.get("returned") is True
+        and all(
+            isinstance(loan_doc.get(field), datetime)
+            and loan_doc[field] < archived_before
+            for field in ("loanDate", "returnDate")
+        )
+    )
+
+
+async def update_archived(
+    oid: ObjectId, loan_doc: dict, archived_before: datetime
+) -> dict:
+    # Returns the archived loan as it was before the update, if any
+    operation = "loans_repository.update_loan"
+    loan = await loans_archive_collection.find_one(
+        loans_query(operation, archived({"_id": oid}))
+    )
+    if loan is None:
+        return None
+    query = archived({"_id": oid, SHARD_KEY_FIELD: loan.get(SHARD_KEY_FIELD)})
+    if archivable({**loan, **loan_doc}, archived_before):
+        return await loans_archive_collection.find_one_and_update(
+            loans_query(operation, query),
+            {"$set": loan_doc},
+            return_document=ReturnDocument.BEFORE,
+        )
+    # Moved back to the hot tier, where the update is applied, so that the
+    # queries excluding the archive still find it. Copied first, so that an
+    # interruption never loses the loan
+    await insert_missing(loans_collection, [loan])
+    await loans_archive_collection.delete_one(loans_query(operation, query))
+    return None
 
 
-async def update_loan(loan_id: str, loan_doc: dict) -> int:
+async def update_loan(
+    loan_id: str, loan_doc: dict, archived_before: datetime = None
+) -> dict:
+    # Returns the loan as it was before the update, for the rollup counters.
+    # The archive is updated first, then the hot tier, which still holds the
+    # loans being archived
     try:
         oid = ObjectId(loan_id)
     except Exception:
-        return 0
-    result = await loans_collection.update_one({"_id": oid}, {"$set": loan_doc})
-    return result.modified_count
+        return None
+    archived_loan = await update_archived(oid, loan_doc, archived_before)
+    # Routed with the new adherent, which is the current one unless the update
+    # moves the loan to another adherent
+    query = {"_id": oid, SHARD_KEY_FIELD: loan_doc[SHARD_KEY_FIELD]}
+    previous_loan = await loans_collection.find_one_and_update(
+        loans_query("loans_repository.update_loan", query),
+        {"$set": loan_doc},
+        return_document=ReturnDocument.BEFORE,
+    )
+    if previous_loan is None:
+        query = await shard_key_filter(oid, "loans_repository.update_loan")
+        if query is not None:
+            previous_loan = await loans_collection.find_one_and_update(
+                loans_query("loans_repository.update_loan", query),
+                {"$set": loan_doc},
+                return_document=ReturnDocument.BEFORE,
+            )
+    previous_loan = previous_loan or archived_loan
+    if previous_loan:
+        await change_feed.record_change("loans", "update", oid)
+    return previous_loan
 
 
-async def delete_loan(loan_id: str) -> int:
+async def delete_loan(loan_id: str) -> dict:
+    # Returns the deleted loan, for the rollup counters. Deleted from the
+    # archive first, then from the hot tier, which still holds the loans
+    # being archived
     try:
         oid = ObjectId(loan_id)
     except Exception:
-        return 0
-    result = await loans_collection.delete_one({"_id": oid})
+        return None
+    deleted_loan = None
+    for in_archive in (True, False):
+        query = await shard_key_filter(oid, "loans_repository.delete_loan", in_archive)
+        if query is not None:
+            deleted_loan = (
+                await tier(in_archive).find_one_and_delete(
+                    loans_query("loans_repository.delete_loan", query)
+                )
+                or deleted_loan
+            )
+    if deleted_loan:
+        await change_feed.record_change("loans", "delete", oid)
+    return deleted_loan
+
+
+async def count_loans(query: dict) -> int:
+    count = 0
+    for in_archive in (True, False):
+        count += await tier(in_archive).count_documents(
+            loans_query("loans_repository.count_loans", tier_query(query, in_archive))
+        )
+    return count
+
+
+async def find_batch(query: dict, limit: int, in_archive: bool = False) -> list:
+    query = loans_query("loans_repository.find_batch", tier_query(query, in_archive))
+    cursor = tier(in_archive).find(query).sort("_id", 1).limit(limit)
+    return await cursor.to_list(length=limit)
+
+
+async def insert_missing(collection, loan_docs: list) -> int:
+    # Loans already copied by an interrupted run of the same job are skipped
+    try:
+        result = await collection.insert_many(loan_docs, ordered=False)
+        return len(result.inserted_ids)
+    except BulkWriteError as error:
+        duplicates = [e for e in error.details["writeErrors"] if e["code"] == 11000]
+        if len(duplicates) != len(error.details["writeErrors"]):
+            raise
+        return error.details["nInserted"]
+
+
+async def purge_batch(loan_docs: list, in_archive: bool, keep: bool) -> tuple:
+    """Purge a batch of loans of one tier, kept in the archive if ``keep``.
+
+    Returns the number of loans purged and the number kept.
+    """
+    if not keep:
+        return await delete_batch(loan_docs, in_archive), 0
+    if in_archive:
+        # Already there: only hidden from the reads
+        result = await loans_archive_collection.update_many(
+            loans_query("loans_repository.purge_batch", batch_filter(loan_docs, True)),
+            {"$set": {PURGED_FIELD: datetime.now(timezone.utc)}},
+        )
+        if result.modified_count:
+            await change_feed.record_change("loans", "delete")
+        return result.modified_count, result.modified_count
+    # Copied first, so that an interruption never loses a loan
+    now = datetime.now(timezone.utc)
+    kept = await insert_missing(
+        loans_archive_collection, [{**loan, PURGED_FIELD: now} for loan in loan_docs]
+    )
+    return await delete_batch(loan_docs), kept
+
+
+async def move_to_archive(loan_docs: list) -> int:
+    # Copied first, so that an interruption never loses a loan
+    await insert_missing(loans_archive_collection, loan_docs)
+    result = await loans_collection.delete_many(
+        loans_query("loans_repository.move_to_archive", batch_filter(loan_docs))
+    )
     return result.deleted_count
 
 
-async def delete_all_loan(
-    query: dict,
-) -> int:
-    result = await loans_collection.delete_many(query)
+def adherent_ids(loan_docs: list) -> list:
+    """Shard key values of a batch of loans, to route its writes."""
+    return list({loan.get(SHARD_KEY_FIELD) for loan in loan_docs})
+
+
+def batch_filter(loan_docs: list, in_archive: bool = False) -> dict:
+    query = {
+        "_id": {"$in": [loan["_id"] for loan in loan_docs]},
+        SHARD_KEY_FIELD: {"$in": adherent_ids(loan_docs)},
+    }
+    return tier_query(query, in_archive)
+
+
+async def delete_batch(loan_docs: list, in_archive: bool = False) -> int:
+    result = await tier(in_archive).delete_many(
+        loans_query(
+            "loans_repository.delete_batch", batch_filter(loan_docs, in_archive)
+        )
+    )
+    if result.deleted_count:
+        await change_feed.record_change("loans", "delete")
     return result.deleted_count
+
+
+async def find_overdue(limit: int, after: list = None) -> tuple:
+    query = {"returned": False, "overdue": True}
+    if after:
+        query.update(keyset_filter(OVERDUE_SORT, after))
+    # Fetch one extra document to know whether another page exists
+    loans_query("loans_repository.find_overdue", query)
+    collection = read_collection(loans_collection, "loans_repository.find_overdue")
+    cursor = collection.find(query).sort(OVERDUE_SORT).limit(limit + 1)
+    loans = await cursor.to_list(length=limit + 1)
+    return loans, next_cursor(loans, OVERDUE_SORT, limit)
+
+
+async def mark_overdue(now: datetime) -> int:
+    # Only open loans not yet flagged are matched, so each run touches new ones only
+    query = {"returned": False, "overdue": False, "returnDate": {"$lt": now}}
+    result = await loans_collection.update_many(
+        loans_query("loans_repository.mark_overdue", query),
+        {"$set": {"overdue": True}},
+    )
+    if result.modified_count:
+        await change_feed.record_change("loans", "update")
+    return result.modified_count
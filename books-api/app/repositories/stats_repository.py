@@ -0,0 +1,154 @@
+from datetime import datetime, timezone
+
+from app.database import (
+    books_collection,
+    loan_stats_collection,
+    loans_archive_collection,
+    loans_collection,
+    read_collection,
+)
+from app.repositories.loans_repository import archived
+from app.sharding import loans_query
+from pymongo import UpdateOne
+
+# Rollup kinds stored in the loan_stats collection
+DAY = "day"
+TYPE = "type"
+BOOK = "book"
+ADHERENT = "adherent"
+
+
+def rollup_keys(loan_doc: dict, book_type: str) -> list:
+    keys = [
+        (DAY, loan_doc["loanDate"]),
+        (BOOK, loan_doc["book_id"]),
+        (ADHERENT, loan_doc["adherent_id"]),
+    ]
+    if book_type:
+        keys.append((TYPE, book_type))
+    return keys
+
+
+def rollup_id(kind: str, key) -> str:
+    if kind == DAY:
+        return f"{DAY}:{key.strftime('%Y-%m-%d')}"
+    return f"{kind}:{key}"
+
+
+async def increment_counters(deltas: dict):
+    # One round trip for all the counters touched by a loan write
+    updated_at = datetime.now(timezone.utc)
+    operations = [
+        UpdateOne(
+            {"_id": rollup_id(kind, key)},
+            {
+                "$inc": {"count": delta},
+                # Kept by a rebuild in progress, which may not have counted the write
+                "$set": {"updated_at": updated_at},
+                "$setOnInsert": {"kind": kind, "key": key},
+            },
+            upsert=True,
+        )
+        for (kind, key), delta in deltas.items()
+    ]
+    if operations:
+        await loan_stats_collection.bulk_write(operations, ordered=False)
+
+
+async def find_top(kind: str, limit: int) -> list:
+    collection = read_collection(loan_stats_collection, "stats_repository.find_top")
+    cursor = (
+        collection.find({"kind": kind, "count": {"$gt": 0}})
+        .sort("count", -1)
+        .limit(limit)
+    )
+    return await cursor.to_list(length=limit)
+
+
+async def find_range(kind: str, key_range: dict) -> list:
+    query = {"kind": kind, "count": {"$gt": 0}}
+    if key_range:
+        query["key"] = key_range
+    collection = read_collection(loan_stats_collection, "stats_repository.find_range")
+    cursor = collection.find(query).sort("key", 1)
+    return await cursor.to_list(length=None)
+
+
+async def find_by_kind(kind: str) -> list:
+    collection = read_collection(loan_stats_collection, "stats_repository.find_by_kind")
+    cursor = collection.find({"kind": kind, "count": {"$gt": 0}})
+    return await cursor.to_list(length=None)
+
+
+def rebuild_pipeline(
+    kind: str, group_key, rebuilt_at: datetime, key_string=None
+) -> list:
+    # Counters are replaced wholesale; key_string renders the group key into the _id
+    key_string = key_string or {"$toString": "$_id"}
+    return [
+        {"$group": {"_id": group_key, "count": {"$sum": 1}}},
+        {
+            "$project": {
+                "_id": {"$concat": [f"{kind}:", key_string]},
+                "kind": {"$literal": kind},
+                "key": "$_id",
+                "count": 1,
+                "rebuilt_at": {"$literal": rebuilt_at},
+            }
+        },
+        {
+            "$merge": {
+                "into": loan_stats_collection.name,
+                "on": "_id",
+                "whenMatched": "replace",
+                "whenNotMatched": "insert",
+            }
+        },
+    ]
+
+
+async def rebuild(rebuilt_at: datetime):
+    pipelines = {
+        DAY: [
+            {"$match": {"loanDate": {"$type": "date"}}},
+            *rebuild_pipeline(
+                DAY,
+                {"$dateTrunc": {"date": "$loanDate", "unit": "day"}},
+                rebuilt_at,
+                {"$dateToString": {"format": "%Y-%m-%d", "date": "$_id"}},
+            ),
+        ],
+        BOOK: rebuild_pipeline(BOOK, "$book_id", rebuilt_at),
+        ADHERENT: rebuild_pipeline(ADHERENT, "$adherent_id", rebuilt_at),
+        TYPE: [
+            {
+                "$lookup": {
+                    "from": books_collection.name,
+                    "localField": "book_id",
+                    "foreignField": "_id",
+                    "as": "book",
+                }
+            },
+            {"$unwind": "$book"},
+            *rebuild_pipeline(TYPE, "$book.type", rebuilt_at),
+        ],
+    }
+    # Archived loans still count, unlike the ones kept by the purges
+    union = {
+        "$unionWith": {
+            "coll": loans_archive_collection.name,
+            "pipeline": [{"$match": archived({})}],
+        }
+    }
+    for kind, pipeline in pipelines.items():
+        # Full scans of every shard, in the background
+        loans_query("stats_repository.rebuild", {})
+        await loans_collection.aggregate([union, *pipeline]).to_list(length=None)
+        # Counters of keys that no longer have any loan, unless written meanwhile
+        await loan_stats_collection.delete_many(
+            {
+                "kind": kind,
+                "rebuilt_at": {"$ne": rebuilt_at},
+                "updated_at": {"$not": {"$gte": rebuilt_at}},
+            }
+        )
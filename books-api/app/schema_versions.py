@@ -0,0 +1,171 @@
+"""Versions of the stored book and loan shapes, and the upgrades between them.
+
+Each document carries the ``schema_version`` of its shape; documents written
+before the versions existed are version 0. The upgrades of a collection are
+registered in order with ``@upgrade``: the n-th one turns a version n - 1
+document into a version n one, and the last version is the current one. New
+documents are written with the current version.
+
+Documents are upgraded when read (``upgraded``), then written back in the
+background. A write back only applies if the fields it changes still hold the
+values that were read, so that it never overwrites a concurrent update. The
+schema migration job upgrades the documents that are not read. A shape change
+is then a new upgrade function, with neither downtime nor a one-shot rewrite.
+Upgrades must leave the documents already in the new shape untouched.
+"""
+
+import asyncio
+import copy
+import logging
+from datetime import datetime
+
+from app.dates import today
+from bson import ObjectId
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+VERSION_FIELD = "schema_version"
+
+# Upgrade functions of each collection, in version order
+upgrades = {"books": [], "loans": []}
+
+# Keep a reference to the running write backs so that they are not garbage collected
+running_tasks = set()
+
+
+def upgrade(collection_name: str):
+    """Register the upgrade to the next version of the ``collection_name`` documents."""
+
+    def register(function):
+        upgrades[collection_name].append(function)
+        return function
+
+    return register
+
+
+def current_version(collection_name: str) -> int:
+    return len(upgrades[collection_name])
+
+
+def outdated_query(collection_name: str) -> dict:
+    """Documents older than the current version, including the unversioned ones."""
+    return {VERSION_FIELD: {"$not": {"$gte": current_version(collection_name)}}}
+
+
+def upgrade_document(collection_name: str, document: dict) -> dict:
+    """Copy of ``document`` in the current shape, or ``document`` itself if already current."""
+    version = document.get(VERSION_FIELD, 0)
+    if version >= current_version(collection_name):
+        return document
+    upgraded = copy.deepcopy(document)
+    for function in upgrades[collection_name][version:]:
+        function(upgraded)
+    upgraded[VERSION_FIELD] = current_version(collection_name)
+    return upgraded
+
+
+def write_back_operation(original: dict, upgraded: dict) -> UpdateOne:
+    """Update applying the upgrade, unless the changed fields were updated meanwhile."""
+    changed = {
+        field: value
+        for field, value in upgraded.items()
+        if field not in original or original[field] != value
+    }
+    removed = [field for field in original if field not in upgraded]
+    query = {"_id": original["_id"]}
+    for field in [*changed, *removed]:
+        query[field] = original[field] if field in original else {"$exists": False}
+    update = {"$set": changed}
+    if removed:
+        update["$unset"] = {field: "" for field in removed}
+    return UpdateOne(query, update)
+
+
+async def write_back(collection, operations: list) -> int:
+    result = await collection.bulk_write(operations, ordered=False)
+    return result.modified_count
+
+
+async def run_write_back(collection, operations: list):
+    try:
+        await write_back(collection, operations)
+    except Exception:
+        # Upgraded again on the next read, or by the schema migration job
+        logger.exception("Write back of %d upgraded documents failed", len(operations))
+
+
+def upgraded(collection_name: str, documents: list, collection=None) -> list:
+    """Upgrade ``documents``, written back to ``collection`` in the background if given."""
+    results, operations = [], []
+    for document in documents:
+        result = upgrade_document(collection_name, document)
+        if result is not document:
+            operations.append(write_back_operation(document, result))
+        results.append(result)
+    if operations and collection is not None:
+        task = asyncio.create_task(run_write_back(collection, operations))
+        running_tasks.add(task)
+        task.add_done_callback(running_tasks.discard)
+    return results
+
+
+async def wait_write_backs():
+    """Wait for the write backs in progress, e.g. before the process exits."""
+    await asyncio.gather(*running_tasks, return_exceptions=True)
+
+
+def parse_date(value):
+    # Dates stored as "YYYY-MM-DD" strings by the first versions of the API
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value)
+        except ValueError:
+            return value
+    return value
+
+
+def to_object_id(value):
+    return (
+        ObjectId(value)
+        if isinstance(value, str) and ObjectId.is_valid(value)
+        else value
+    )
+
+
+@upgrade("books")
+def publish_date_to_bson(book: dict):
+    if "publishDate" in book:
+        book["publishDate"] = parse_date(book["publishDate"])
+
+
+@upgrade("books")
+def author_id_to_object_id(book: dict):
+    if "author_id" in book:
+        book["author_id"] = to_object_id(book["author_id"])
+
+
+@upgrade("loans")
+def loan_dates_to_bson(loan: dict):
+    for field in ("loanDate", "returnDate"):
+        if field in loan:
+            loan[field] = parse_date(loan[field])
+
+
+@upgrade("loans")
+def loan_status(loan: dict):
+    loan.setdefault("returned", False)
+    if "overdue" not in loan:
+        return_date = loan.get("returnDate")
+        loan["overdue"] = (
+            not loan["returned"]
+            and isinstance(return_date, datetime)
+            and return_date < today()
+        )
+
+
+@upgrade("loans")
+def loan_references_to_object_id(loan: dict):
+    for field in ("book_id", "adherent_id"):
+        if field in loan:
+            loan[field] = to_object_id(loan[field])
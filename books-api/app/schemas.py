@@ -1,30 +1,45 @@
 """Define API model."""
 
-from datetime import date
+from datetime import date, datetime
 from enum import Enum
-from typing import Optional
+from typing import Annotated, List, Optional
 
 from bson import ObjectId
-from pydantic import BaseModel, Field
+from pydantic import (
+    BaseModel,
+    ConfigDict,
+    Field,
+    PlainSerializer,
+    PlainValidator,
+    WithJsonSchema,
+)
 
 
-class PyObjectId(ObjectId):
-    """Validation Class to ensure model fiabilty"""
+def validate_object_id(value) -> ObjectId:
+    """Validate an ObjectId, or its hexadecimal string"""
+    if not ObjectId.is_valid(value):
+        raise ValueError("Invalid ObjectId")
+    return ObjectId(value)
 
-    @classmethod
-    def __get_validators__(cls):
-        yield cls.validate
 
-    @classmethod
-    def validate(cls, v, info):
-        """Validate an instance"""
-        if not ObjectId.is_valid(v):
-            raise ValueError("Invalid ObjectId")
-        return ObjectId(v)
+# ObjectId validated and serialized by compiled validators, as a string in JSON
+PyObjectId = Annotated[
+    ObjectId,
+    PlainValidator(validate_object_id),
+    PlainSerializer(str, return_type=str),
+    WithJsonSchema({"type": "string"}),
+]
 
-    @classmethod
-    def __get_pydantic_json_schema__(cls, core_schema, handler):
-        return {"type": "string"}
+
+class DocumentModel(BaseModel):
+    """Model of a stored document, whose id is read from ``_id``"""
+
+    model_config = ConfigDict(populate_by_name=True)
+
+
+def public_projection(model: type) -> dict:
+    """Projection on the stored fields of ``model``, leaving out the internal ones."""
+    return {field.alias or name: 1 for name, field in model.model_fields.items()}
 
 
 # Schemas for authors
@@ -43,16 +58,11 @@ class AuthorCreate(AuthorBase):
     pass
 
 
-class Author(AuthorBase):
+class Author(AuthorBase, DocumentModel):
     """Author base class config"""
 
     id: Optional[PyObjectId] = Field(alias="_id")
 
-    class Config:
-        allow_population_by_field_name = True
-        arbitrary_types_allowed = True
-        json_encoders = {ObjectId: str}
-
 
 # Enum for the literary genre of the book
 class TypeEnum(str, Enum):
@@ -94,16 +104,27 @@ class BookCreate(BookBase):
     pass
 
 
-class Book(BookBase):
+class AuthorSummary(BaseModel):
+    """Author fields copied into their books, so that book reads need no author lookup"""
+
+    first_name: Optional[str] = None
+    last_name: Optional[str] = None
+    nationality: Optional[str] = None
+
+
+class Book(BookBase, DocumentModel):
     """Book base class config"""
 
     id: Optional[PyObjectId] = Field(alias="_id")
     author_id: str
+    author: Optional[AuthorSummary] = None
 
-    class Config:
-        allow_population_by_field_name = True
-        arbitrary_types_allowed = True
-        json_encoders = {ObjectId: str}
+
+class Suggestion(BaseModel):
+    """Autocomplete suggestion: a book title, publisher or label"""
+
+    value: str
+    field: str
 
 
 # Schemas for loan
@@ -112,6 +133,7 @@ class LoanBase(BaseModel):
 
     loanDate: date
     returnDate: date
+    returned: bool = False
 
 
 class LoanCreate(LoanBase):
@@ -122,17 +144,39 @@ class LoanCreate(LoanBase):
     pass
 
 
-class Loan(LoanBase):
+class Loan(LoanBase, DocumentModel):
     """Loan base class config"""
 
     id: Optional[PyObjectId] = Field(alias="_id")
     book_id: str
     adherent_id: str
+    overdue: bool = False
+
+
+# Enum for the background job status
+class JobStatusEnum(str, Enum):
+    """Background job status enumeration"""
+
+    pending = "pending"
+    running = "running"
+    done = "done"
+    failed = "failed"
+
+
+# Schemas for loan purges
+class PurgeJob(BaseModel):
+    """Loan purge job progress"""
 
-    class Config:
-        allow_population_by_field_name = True
-        arbitrary_types_allowed = True
-        json_encoders = {ObjectId: str}
+    id: Optional[str] = None
+    status: JobStatusEnum
+    dry_run: bool
+    archive: bool
+    matched: int
+    deleted: int
+    archived: int
+    error: Optional[str] = None
+    created_at: datetime
+    finished_at: Optional[datetime] = None
 
 
 # Enum for the adherent role
@@ -162,15 +206,48 @@ class AdherentCreate(AdherentBase):
     pass
 
 
-class Adherent(AdherentBase):
+class Adherent(AdherentBase, DocumentModel):
     """Adherent base class config"""
 
     id: Optional[PyObjectId] = Field(alias="_id")
 
-    class Config:
-        allow_population_by_field_name = True
-        arbitrary_types_allowed = True
-        json_encoders = {ObjectId: str}
+
+# Schemas for statistics
+class StatCount(BaseModel):
+    """Loan counter of a rollup key (day, book type, book or adherent)"""
+
+    key: str
+    count: int
+
+
+# Schemas for profiling
+class RouteCpuTime(BaseModel):
+    """CPU and wall time spent serving a route"""
+
+    route: str
+    requests: int
+    cpu_seconds: float
+    wall_seconds: float
+    cpu_ms_per_request: float
+
+
+class AllocationDiff(BaseModel):
+    """Memory allocated by a line (or traceback) since the previous snapshot"""
+
+    location: List[str]
+    size: int
+    size_diff: int
+    count: int
+    count_diff: int
+
+
+class QueryShape(BaseModel):
+    """Shape of the loans queries sent by a repository function"""
+
+    operation: str
+    shape: str
+    targeted: bool
+    count: int
 
 
 # Schemas for authentication
@@ -184,3 +261,11 @@ class LoginRequest(BaseModel):
 class Token(BaseModel):
     access_token: str
     token_type: str
+
+
+# Enum for the sort order of paginated listings
+class SortOrder(str, Enum):
+    """Sort order enumeration"""
+
+    asc = "asc"
+    desc = "desc"
@@ -0,0 +1,70 @@
+"""Shard key of the loans and the shapes of the queries sent to them.
+
+The loans (and their archive) are sharded on a hash of ``adherent_id``: the
+writes spread evenly over the shards, and all the loans of an adherent live
+on the same shard. mongos routes the queries carrying the adherent ids (by
+equality or ``$in``) to the shards owning them, and broadcasts the others to
+every shard (scatter-gather). Each loans query is counted under its
+repository function and shape, and ``GET /admin/query-shapes`` lists the
+scatter-gather ones first.
+"""
+
+SHARD_KEY_FIELD = "adherent_id"
+LOANS_SHARD_KEY = {SHARD_KEY_FIELD: "hashed"}
+
+
+def query_shape(query: dict) -> str:
+    """Fields and operators of ``query`` without its values: {adherent_id, loanDate($gte $lt)}."""
+    parts = []
+    for field in sorted(query):
+        condition = query[field]
+        if isinstance(condition, dict) and all(
+            key.startswith("$") for key in condition
+        ):
+            parts.append(f"{field}({' '.join(sorted(condition))})")
+        else:
+            parts.append(field)
+    return "{" + ", ".join(parts) + "}"
+
+
+def targets_shards(query: dict) -> bool:
+    """Whether mongos can route ``query`` to the shards owning its shard key values."""
+    condition = query.get(SHARD_KEY_FIELD)
+    if isinstance(condition, dict):
+        # Hashed keys support equality only: a range on them is broadcast
+        return set(condition) == {"$in"}
+    return SHARD_KEY_FIELD in query
+
+
+class QueryShapes:
+    def __init__(self):
+        self.shapes = {}
+
+    def record(self, operation: str, query: dict):
+        shape = query_shape(query)
+        counters = self.shapes.get((operation, shape))
+        if counters is None:
+            counters = {"targeted": targets_shards(query), "count": 0}
+            self.shapes[(operation, shape)] = counters
+        counters["count"] += 1
+
+    def report(self) -> list:
+        report = [
+            {"operation": operation, "shape": shape, **counters}
+            for (operation, shape), counters in self.shapes.items()
+        ]
+        # Scatter-gather shapes first, the most frequent first
+        report.sort(key=lambda shape: (shape["targeted"], -shape["count"]))
+        return report
+
+    def reset(self):
+        self.shapes = {}
+
+
+query_shapes = QueryShapes()
+
+
+def loans_query(operation: str, query: dict) -> dict:
+    """Record the shape of a loans query sent by the repository function ``operation``."""
+    query_shapes.record(operation, query)
+    return query
@@ -0,0 +1,92 @@
+"""Startup timing and warm-up of the API process.
+
+The lifespan phases are timed and logged once the API is ready. The
+import-time breakdown of ``app.main``, grouped by package, is printed with:
+
+    python -m app.startup [--top 20]
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from app import openapi_schema
+from app.config import WARMUP_CONNECTIONS
+from app.database import client
+
+logger = logging.getLogger(__name__)
+
+# Duration in seconds of each lifespan phase, in execution order
+phases = {}
+
+
+@contextmanager
+def phase(name: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        phases[name] = time.perf_counter() - started
+
+
+def log_phases():
+    details = ", ".join(
+        f"{name} {seconds * 1000:.0f} ms" for name, seconds in phases.items()
+    )
+    logger.info("API ready in %.0f ms (%s)", sum(phases.values()) * 1000, details)
+
+
+async def warm_up(app):
+    """Open the pool connections and load the OpenAPI schema before serving."""
+    if WARMUP_CONNECTIONS:
+        # Concurrent pings each check out their own pool connection
+        await asyncio.gather(
+            *(client.admin.command("ping") for _ in range(WARMUP_CONNECTIONS))
+        )
+    openapi_schema.load(app)
+
+
+def package_of(module: str) -> str:
+    parts = module.split(".")
+    # The application modules are reported per layer (app.controllers...)
+    return ".".join(parts[:2]) if parts[0] == "app" else parts[0]
+
+
+def import_breakdown(module: str = "app.main") -> dict:
+    """Self import time in seconds of each package loaded by ``module``."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        env=os.environ,
+        check=True,
+    )
+    breakdown = defaultdict(float)
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_us, _, name = line.split(":", 1)[1].split("|")
+        if not self_us.strip().isdigit():
+            # Header line
+            continue
+        breakdown[package_of(name.strip())] += int(self_us) / 1_000_000
+    return breakdown
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import-time breakdown of the API")
+    parser.add_argument("--top", type=int, default=20)
+    args = parser.parse_args()
+    breakdown = import_breakdown()
+    total = sum(breakdown.values())
+    print(f"{'package':<40} {'ms':>8} {'share':>6}")
+    ranking = sorted(breakdown.items(), key=lambda item: -item[1])
+    for package, seconds in ranking[: args.top]:
+        print(f"{package:<40} {seconds * 1000:8.1f} {seconds / total:6.1%}")
+    print(f"{'total':<40} {total * 1000:8.1f}")
@@ -0,0 +1,91 @@
+"""In-memory prefix index over the book titles, publishers and labels.
+
+Entries are kept in sorted arrays, so that a prefix lookup is a binary
+search followed by a short scan. Whole values are matched first, then the
+values having a later word starting with the prefix ("potter" suggests
+"Harry Potter").
+"""
+
+from bisect import bisect_left, insort
+
+from app.text import normalize
+
+SUGGESTED_FIELDS = ("title", "publisher", "label")
+
+
+class SortedEntries:
+    """Sorted ``(key, field, value)`` entries, counted by the books sharing them."""
+
+    def __init__(self):
+        self.entries = []
+        self.counts = {}
+
+    def add(self, entry: tuple):
+        if entry not in self.counts:
+            insort(self.entries, entry)
+            self.counts[entry] = 0
+        self.counts[entry] += 1
+
+    def remove(self, entry: tuple):
+        self.counts[entry] -= 1
+        if not self.counts[entry]:
+            del self.counts[entry]
+            del self.entries[bisect_left(self.entries, entry)]
+
+    def scan(self, prefix: str):
+        index = bisect_left(self.entries, (prefix,))
+        while index < len(self.entries) and self.entries[index][0].startswith(prefix):
+            yield self.entries[index]
+            index += 1
+
+
+class SuggestionIndex:
+    def __init__(self):
+        self.whole_values = SortedEntries()
+        self.later_words = SortedEntries()
+        # Entries of each book, to remove them when it changes
+        self.books = {}
+
+    def __len__(self) -> int:
+        return len(self.whole_values.entries) + len(self.later_words.entries)
+
+    def add_book(self, book_id: str, book: dict):
+        self.remove_book(book_id)
+        whole_values, later_words = [], []
+        for field in SUGGESTED_FIELDS:
+            value = book.get(field)
+            if not value:
+                continue
+            words = normalize(value).split(" ")
+            whole_values.append((" ".join(words), field, value))
+            later_words.extend(
+                (" ".join(words[start:]), field, value)
+                for start in range(1, len(words))
+            )
+        for entry in whole_values:
+            self.whole_values.add(entry)
+        for entry in later_words:
+            self.later_words.add(entry)
+        self.books[book_id] = (whole_values, later_words)
+
+    def remove_book(self, book_id: str):
+        whole_values, later_words = self.books.pop(book_id, ((), ()))
+        for entry in whole_values:
+            self.whole_values.remove(entry)
+        for entry in later_words:
+            self.later_words.remove(entry)
+
+    def suggest(self, prefix: str, limit: int) -> list:
+        prefix = normalize(prefix)
+        suggestions, seen = [], set()
+        if not prefix:
+            return suggestions
+        for entries in (self.whole_values, self.later_words):
+            for _, field, value in entries.scan(prefix):
+                if (field, value) in seen:
+                    continue
+                seen.add((field, value))
+                suggestions.append({"value": value, "field": field})
+                if len(suggestions) == limit:
+                    return suggestions
+        return suggestions
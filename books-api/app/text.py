@@ -0,0 +1,30 @@
+"""Text normalization for the search keys stored alongside the documents."""
+
+import re
+import unicodedata
+
+TOKEN_SEPARATOR = re.compile(r"[^0-9a-z]+")
+
+# Hard cap on the results of the search endpoints
+SEARCH_MAX_RESULTS = 50
+
+
+def normalize(value: str) -> str:
+    """Fold case and accents, and collapse whitespace: "  Émile  Zola" -> "emile zola"."""
+    decomposed = unicodedata.normalize("NFKD", value or "")
+    folded = "".join(char for char in decomposed if not unicodedata.combining(char))
+    return " ".join(folded.casefold().split())
+
+
+def tokens(value: str) -> list:
+    """Split a value into its normalized alphanumeric words."""
+    return [token for token in TOKEN_SEPARATOR.split(normalize(value)) if token]
+
+
+def search_keys(words: list, identifiers: list = ()) -> list:
+    """Keys to index: the tokens of ``words`` and ``identifiers``, and the whole identifiers."""
+    keys = set()
+    for value in [*words, *identifiers]:
+        keys.update(tokens(value))
+    keys.update(normalize(value) for value in identifiers if value)
+    return sorted(keys)
@@ -0,0 +1,253 @@
+"""OpenTelemetry tracing of the requests, use cases, repositories and MongoDB commands.
+
+Enabled with ``TRACING_ENABLED=true`` when the ``opentelemetry-sdk`` package is
+installed. Each request gets a server span (continuing the caller's trace when
+a ``traceparent`` header is sent) with the use case and repository calls it
+makes as child spans, and each MongoDB command as a client span below them.
+Spans go to an OTLP/HTTP collector (``OTEL_EXPORTER_OTLP_ENDPOINT``), to the
+console, or to a JSON lines file. The log records carry the current trace and
+span ids.
+"""
+
+import inspect
+import logging
+import sys
+from functools import wraps
+from importlib import import_module
+from importlib.util import find_spec
+
+from app.config import (
+    TRACING_ENABLED,
+    TRACING_EXPORTER,
+    TRACING_FILE,
+    TRACING_SAMPLE_RATIO,
+)
+from pymongo import monitoring
+from starlette.datastructures import Headers
+
+trace = None
+# Not imported at all when disabled, to keep it out of the startup time
+if TRACING_ENABLED:
+    try:
+        from opentelemetry import propagate, trace
+        from opentelemetry.trace import SpanKind, Status, StatusCode
+    except ImportError:
+        pass
+
+logger = logging.getLogger(__name__)
+
+SERVICE_NAME = "books-api"
+
+# Layers whose coroutine functions get a span, by package
+TRACED_PACKAGES = {
+    "app.use_cases": [
+        "adherent_use_case",
+        "authors_use_case",
+        "books_use_case",
+        "loans_use_case",
+        "stats_use_case",
+    ],
+    "app.repositories": [
+        "adherent_repository",
+        "authors_repository",
+        "books_repository",
+        "idempotency_repository",
+        "jobs_repository",
+        "loans_repository",
+        "stats_repository",
+    ],
+}
+
+LOG_FORMAT = (
+    "%(asctime)s %(levelname)s [trace_id=%(trace_id)s span_id=%(span_id)s] "
+    "%(name)s: %(message)s"
+)
+
+# Provider of the process, flushed on shutdown
+provider = None
+
+
+def available() -> bool:
+    return TRACING_ENABLED and trace is not None
+
+
+def tracer():
+    return trace.get_tracer(__name__)
+
+
+def traced(function, name: str):
+    @wraps(function)
+    async def wrapper(*args, **kwargs):
+        with tracer().start_as_current_span(name):
+            return await function(*args, **kwargs)
+
+    return wrapper
+
+
+def instrument_module(module):
+    """Replace the coroutine functions of ``module`` with traced ones."""
+    layer = module.__name__.rsplit(".", 1)[-1]
+    for name, function in list(vars(module).items()):
+        if (
+            inspect.iscoroutinefunction(function)
+            and function.__module__ == module.__name__
+            and not name.startswith("_")
+        ):
+            setattr(module, name, traced(function, f"{layer}.{name}"))
+
+
+class CommandTracer(monitoring.CommandListener):
+    """Client span of each MongoDB command, child of the current span."""
+
+    def __init__(self):
+        # Spans in flight, by (request id, connection); commands run on the
+        # Motor executor threads, with the context of the calling task
+        self.spans = {}
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        attributes = {
+            "db.system": "mongodb",
+            "db.name": event.database_name,
+            "db.operation": event.command_name,
+        }
+        if isinstance(collection, str):
+            attributes["db.mongodb.collection"] = collection
+        span = tracer().start_span(
+            f"mongodb.{event.command_name}",
+            kind=SpanKind.CLIENT,
+            attributes=attributes,
+        )
+        self.spans[(event.request_id, event.connection_id)] = span
+
+    def succeeded(self, event):
+        span = self.spans.pop((event.request_id, event.connection_id), None)
+        if span is not None:
+            span.end()
+
+    def failed(self, event):
+        span = self.spans.pop((event.request_id, event.connection_id), None)
+        if span is not None:
+            span.set_status(Status(StatusCode.ERROR, str(event.failure)))
+            span.end()
+
+
+def command_listeners() -> list:
+    """Event listeners to pass to the MongoDB client."""
+    if not available():
+        return []
+    return [CommandTracer()]
+
+
+def exporter():
+    if TRACING_EXPORTER == "console":
+        from opentelemetry.sdk.trace.export import ConsoleSpanExporter
+
+        return ConsoleSpanExporter(out=sys.stdout)
+    if TRACING_EXPORTER == "file":
+        from opentelemetry.sdk.trace.export import ConsoleSpanExporter
+
+        return ConsoleSpanExporter(
+            out=open(TRACING_FILE, "a"),
+            formatter=lambda span: span.to_json(indent=None) + "\n",
+        )
+    from opentelemetry.exporter.otlp.proto.http.trace_exporter import (
+        OTLPSpanExporter,
+    )
+
+    return OTLPSpanExporter()
+
+
+def trace_log_records():
+    """Add the current ``trace_id`` and ``span_id`` to every log record."""
+    default_factory = logging.getLogRecordFactory()
+
+    def factory(*args, **kwargs):
+        record = default_factory(*args, **kwargs)
+        context = trace.get_current_span().get_span_context()
+        record.trace_id = format(context.trace_id, "032x") if context.is_valid else "-"
+        record.span_id = format(context.span_id, "016x") if context.is_valid else "-"
+        return record
+
+    logging.setLogRecordFactory(factory)
+    logging.basicConfig(level=logging.INFO, format=LOG_FORMAT)
+
+
+def setup() -> bool:
+    """Install the tracer provider and instrument the layers; False when disabled."""
+    global provider
+    if not TRACING_ENABLED:
+        return False
+    if trace is None:
+        logger.warning("TRACING_ENABLED is set but opentelemetry-sdk is not installed")
+        return False
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor
+    from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+
+    provider = TracerProvider(
+        resource=Resource.create({"service.name": SERVICE_NAME}),
+        # Sampled traces stay whole: the children follow the root's decision
+        sampler=ParentBased(TraceIdRatioBased(TRACING_SAMPLE_RATIO)),
+    )
+    provider.add_span_processor(BatchSpanProcessor(exporter()))
+    trace.set_tracer_provider(provider)
+    for package, modules in TRACED_PACKAGES.items():
+        for module in modules:
+            instrument_module(import_module(f"{package}.{module}"))
+    trace_log_records()
+    return True
+
+
+def fastapi_traces_requests() -> bool:
+    # Recent FastAPI versions open the server spans themselves once a provider is set
+    return find_spec("fastapi.telemetry") is not None
+
+
+def shutdown():
+    if provider is not None:
+        provider.shutdown()
+
+
+class TracingMiddleware:
+    """Server span of each HTTP request, named after its route (older FastAPI versions)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        method = scope["method"]
+        parent = propagate.extract(Headers(scope=scope))
+        with tracer().start_as_current_span(
+            f"{method} {scope['path']}",
+            context=parent,
+            kind=SpanKind.SERVER,
+            attributes={"http.request.method": method, "url.path": scope["path"]},
+        ) as span:
+            trace_id = format(span.get_span_context().trace_id, "032x")
+
+            async def send_with_trace_id(message):
+                if message["type"] == "http.response.start":
+                    span.set_attribute("http.response.status_code", message["status"])
+                    if message["status"] >= 500:
+                        span.set_status(Status(StatusCode.ERROR))
+                    # Lets a client report the trace of a slow or failed request
+                    message["headers"] = list(message.get("headers", [])) + [
+                        (b"x-trace-id", trace_id.encode())
+                    ]
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_with_trace_id)
+            finally:
+                route = scope.get("route")
+                if route is not None:
+                    span.update_name(f"{method} {route.path}")
+                    span.set_attribute("http.route", route.path)
+                endpoint = scope.get("endpoint")
+                if endpoint is not None:
+                    span.set_attribute("code.function", endpoint.__name__)
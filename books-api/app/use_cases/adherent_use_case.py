@@ -1,22 +1,38 @@
 from datetime import timedelta
+from functools import lru_cache
 
 from app.auth import ACCESS_TOKEN_EXPIRE_MINUTES, create_access_token
+from app.jobs import archive_job
+from app.pagination import decode_cursor
 from app.repositories import adherent_repository
-from app.schemas import AdherentCreate
-from passlib.context import CryptContext
+from app.schemas import AdherentCreate, SortOrder
+from app.text import normalize, search_keys, tokens
+
+
+def adherent_search_keys(adherent_doc: dict) -> list:
+    return search_keys(
+        [adherent_doc.get("last_name"), adherent_doc.get("first_name")],
+        [adherent_doc.get("membership_number"), adherent_doc.get("login")],
+    )
 
 
 async def create_adherent_use_case(adherent_data: AdherentCreate) -> dict:
-    adherent_doc = adherent_data.dict()
+    adherent_doc = adherent_data.model_dump()
+    adherent_doc["search_keys"] = adherent_search_keys(adherent_doc)
     # Hachage du mot de passe
-    adherent_doc["password"] = pwd_context.hash(adherent_doc["password"])
+    adherent_doc["password"] = password_context().hash(adherent_doc["password"])
     inserted_id = await adherent_repository.insert_adherent(adherent_doc)
     adherent_doc["id"] = inserted_id
     adherent_doc.pop("password", None)
     return adherent_doc
 
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+@lru_cache(maxsize=None)
+def password_context():
+    # passlib and its bcrypt backend are loaded on the first password hash or check
+    from passlib.context import CryptContext
+
+    return CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 
 async def get_adherent_use_case(adherent_id: str) -> dict:
@@ -40,13 +56,45 @@ async def list_adherents_use_case(
     return adherents
 
 
+def search_rank(adherent: dict, query: str) -> tuple:
+    last_name = normalize(adherent.get("last_name"))
+    first_name = normalize(adherent.get("first_name"))
+    identifiers = (
+        normalize(adherent.get("membership_number")),
+        normalize(adherent.get("login")),
+    )
+    if query in identifiers:
+        score = 0
+    elif last_name.startswith(query):
+        score = 1
+    elif first_name.startswith(query) or f"{first_name} {last_name}".startswith(query):
+        score = 2
+    else:
+        score = 3
+    return (score, last_name, first_name)
+
+
+async def search_adherents_use_case(q: str, limit: int = 10) -> list:
+    query_tokens = tokens(q)
+    if not query_tokens:
+        return []
+    query = normalize(q)
+    adherents = await adherent_repository.search(query_tokens, query)
+    adherents.sort(key=lambda adherent: search_rank(adherent, query))
+    del adherents[limit:]
+    for adh in adherents:
+        adh["id"] = str(adh["_id"])
+    return adherents
+
+
 async def update_adherent_use_case(
     adherent_id: str, adherent_data: AdherentCreate
 ) -> dict:
-    adherent_doc = adherent_data.dict()
+    adherent_doc = adherent_data.model_dump()
+    adherent_doc["search_keys"] = adherent_search_keys(adherent_doc)
     # Si le mot de passe est envoyé, on le hache
     if "password" in adherent_doc and adherent_doc["password"]:
-        adherent_doc["password"] = pwd_context.hash(adherent_doc["password"])
+        adherent_doc["password"] = password_context().hash(adherent_doc["password"])
     modified_count = await adherent_repository.update_adherent(
         adherent_id, adherent_doc
     )
@@ -73,7 +121,7 @@ async def login_use_case(login: str, password: str) -> dict:
     adherent = await adherent_repository.find_by_login(login)
     if not adherent:
         return None
-    if not pwd_context.verify(password, adherent["password"]):
+    if not password_context().verify(password, adherent["password"]):
         return None
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
@@ -83,12 +131,31 @@ async def login_use_case(login: str, password: str) -> dict:
     return {"access_token": access_token, "token_type": "bearer"}
 
 
-async def get_loans_by_adherent_use_case(adherent_id: str) -> list:
-    loans = await adherent_repository.find_loans_by_adherent(adherent_id)
+async def get_loans_by_adherent_use_case(
+    adherent_id: str,
+    limit: int = 10,
+    after: str = None,
+    order: SortOrder = SortOrder.desc,
+) -> tuple:
+    # Most recent loans first unless the ascending order is requested
+    direction = 1 if order == SortOrder.asc else -1
+    after_values = decode_cursor(after) if after else None
+    loans, cursor = await adherent_repository.find_loans_by_adherent(
+        adherent_id, limit, after_values, direction
+    )
+    # The archive holds loans borrowed before the watermark only: a full page of
+    # the most recent hot loans after it needs no look at the archive
+    archived_before = await archive_job.archived_before()
+    if archived_before and not (
+        direction < 0 and cursor and loans[-1]["loanDate"] >= archived_before
+    ):
+        loans, cursor = await adherent_repository.find_loans_by_adherent(
+            adherent_id, limit, after_values, direction, include_archive=True
+        )
 
     for loan in loans:
         loan["_id"] = str(loan["_id"])
         loan["book_id"] = str(loan["book_id"])
         loan["adherent_id"] = str(loan["adherent_id"])
 
-    return loans
+    return loans, cursor
@@ -1,5 +1,12 @@
-from app.repositories import authors_repository
-from app.schemas import AuthorCreate
+from app.jobs import author_summary_job
+from app.pagination import decode_cursor
+from app.references import ReferenceInUseError
+from app.repositories import authors_repository, books_repository
+from app.schemas import AuthorCreate, Book, SortOrder, public_projection
+from app.text import normalize, tokens
+
+# Public fields of the listed books, without the internal ones (e.g. schema_version)
+BOOK_PROJECTION = public_projection(Book)
 
 
 async def get_author_use_case(author_id: str) -> dict:
@@ -23,19 +30,58 @@ async def list_authors_use_case(
     return authors
 
 
+def author_name_keys(author_doc: dict) -> dict:
+    """Normalized full name, for prefix ranking, and name words, for the indexed search."""
+    first_name = author_doc.get("first_name") or ""
+    last_name = author_doc.get("last_name") or ""
+    return {
+        "name_key": normalize(f"{first_name} {last_name}"),
+        "name_tokens": sorted(set(tokens(first_name) + tokens(last_name))),
+    }
+
+
+def search_rank(author: dict, query: str) -> tuple:
+    full_name = author.get("name_key") or ""
+    reversed_name = normalize(f"{author.get('last_name')} {author.get('first_name')}")
+    if full_name.startswith(query) or reversed_name.startswith(query):
+        score = 0
+    elif normalize(author.get("last_name")).startswith(query):
+        score = 1
+    else:
+        score = 2
+    return (score, full_name)
+
+
+async def search_authors_use_case(q: str, limit: int = 10) -> list:
+    query_tokens = tokens(q)
+    if not query_tokens:
+        return []
+    query = normalize(q)
+    authors = await authors_repository.search(query_tokens)
+    authors.sort(key=lambda author: search_rank(author, query))
+    del authors[limit:]
+    for author in authors:
+        author["id"] = str(author["_id"])
+    return authors
+
+
 async def create_author_use_case(author_data: AuthorCreate) -> dict:
-    author_doc = author_data.dict()
+    author_doc = author_data.model_dump()
+    author_doc.update(author_name_keys(author_doc))
     inserted_id = await authors_repository.insert_author(author_doc)
     author_doc["id"] = inserted_id
     return author_doc
 
 
 async def update_author_use_case(author_id: str, author_data: AuthorCreate) -> dict:
-    author_doc = author_data.dict()
+    author_doc = author_data.model_dump()
+    author_doc.update(author_name_keys(author_doc))
     modified_count = await authors_repository.update_author(author_id, author_doc)
     if modified_count == 1:
         updated_author = await authors_repository.find_by_id(author_id)
         if updated_author:
+            # The summaries embedded in their books are updated in the background
+            author_summary_job.start_propagation(updated_author["_id"])
             updated_author["id"] = str(updated_author["_id"])
             return updated_author
     existing_author = await authors_repository.find_by_id(author_id)
@@ -46,10 +92,22 @@ async def update_author_use_case(author_id: str, author_data: AuthorCreate) -> d
 
 
 async def delete_author_use_case(author_id: str) -> bool:
+    # Deleting an author with books would leave them pointing to nothing
+    if await books_repository.has_books_by_author(author_id):
+        raise ReferenceInUseError("The author still has books")
     deleted_count = await authors_repository.delete_author(author_id)
     return deleted_count == 1
 
 
-async def get_books_by_author_use_case(author_id: str) -> list:
-    books = await authors_repository.find_books_by_author(author_id)
-    return books
+async def get_books_by_author_use_case(
+    author_id: str,
+    limit: int = 10,
+    after: str = None,
+    order: SortOrder = SortOrder.asc,
+) -> tuple:
+    direction = -1 if order == SortOrder.desc else 1
+    after_values = decode_cursor(after) if after else None
+    books, cursor = await authors_repository.find_books_by_author(
+        author_id, limit, after_values, direction, BOOK_PROJECTION
+    )
+    return books, cursor
@@ -1,5 +1,28 @@
-from app.repositories import books_repository
-from app.schemas import BookCreate, TypeEnum
+import logging
+import re
+from datetime import date, datetime
+
+from app import config, schema_versions
+from app.catalogue import CatalogueSnapshot
+from app.database import primary_reads
+from app.dates import date_range, to_datetime
+from app.jobs.author_summary_job import author_summary
+from app.references import InvalidReferenceError
+from app.repositories import authors_repository, books_repository
+from app.schemas import Book, BookCreate, ObjectId, TypeEnum, public_projection
+from app.suggestions import SUGGESTED_FIELDS, SuggestionIndex
+
+logger = logging.getLogger(__name__)
+
+# Titles, publishers and labels of all the books, kept current by the change
+# feed; None without it, the suggestions being read from MongoDB
+suggestions = None
+
+# Public fields of the exported books, without the internal ones (e.g. schema_version)
+EXPORT_PROJECTION = public_projection(Book)
+
+# Columnar copy of all the books serving the book lists, kept current by the change feed
+catalogue = CatalogueSnapshot(config.CATALOGUE_SNAPSHOT_MAX_BOOKS)
 
 
 async def get_book_use_case(book_id: str) -> dict:
@@ -12,20 +35,20 @@ async def get_book_use_case(book_id: str) -> dict:
     return book
 
 
-async def list_books_use_case(
+def build_books_query(
     title: str = None,
     description: str = None,
     location: str = None,
     label: str = None,
     type: TypeEnum = None,
-    publishDate: str = None,
+    publishDate: date = None,
     publisher: str = None,
     language: str = None,
     link: str = None,
     author_id: str = None,
-    skip: int = 0,
-    limit: int = 10,
-) -> list:
+    publishDate_from: date = None,
+    publishDate_to: date = None,
+) -> dict:
     query = {}
     if title:
         query["title"] = {"$regex": rf"{title}", "$options": "i"}
@@ -37,8 +60,10 @@ async def list_books_use_case(
         query["label"] = {"$regex": rf"{label}", "$options": "i"}
     if type:
         query["type"] = type
-    if publishDate:
-        query["publishDate"] = publishDate
+    if publishDate or publishDate_from or publishDate_to:
+        query["publishDate"] = date_range(
+            publishDate or publishDate_from, publishDate or publishDate_to
+        )
     if publisher:
         query["publisher"] = {"$regex": rf"{publisher}", "$options": "i"}
     if language:
@@ -46,9 +71,57 @@ async def list_books_use_case(
     if link:
         query["link"] = {"$regex": rf"{link}", "$options": "i"}
     if author_id:
-        query["author_id"] = author_id
+        if not ObjectId.is_valid(author_id):
+            raise ValueError("Invalid author_id")
+        query["author_id"] = ObjectId(author_id)
+
+    return query
+
 
-    books = await books_repository.find_all(query, skip, limit)
+async def list_books_use_case(
+    title: str = None,
+    description: str = None,
+    location: str = None,
+    label: str = None,
+    type: TypeEnum = None,
+    publishDate: date = None,
+    publisher: str = None,
+    language: str = None,
+    link: str = None,
+    author_id: str = None,
+    skip: int = 0,
+    limit: int = 10,
+    publishDate_from: date = None,
+    publishDate_to: date = None,
+) -> list:
+    query = build_books_query(
+        title,
+        description,
+        location,
+        label,
+        type,
+        publishDate,
+        publisher,
+        language,
+        link,
+        author_id,
+        publishDate_from,
+        publishDate_to,
+    )
+    books = None
+    if not any((title, description, location, label, publisher, link)):
+        # Only the filters indexed by the catalogue snapshot, served from memory once loaded
+        books = catalogue.find(
+            type,
+            language,
+            query.get("author_id"),
+            publishDate or publishDate_from,
+            publishDate or publishDate_to,
+            skip,
+            limit,
+        )
+    if books is None:
+        books = await books_repository.find_all(query, skip, limit)
     for book in books:
         book["id"] = str(book["_id"])
         if "author_id" in book:
@@ -56,19 +129,59 @@ async def list_books_use_case(
     return books
 
 
+async def export_books_use_case(
+    type: TypeEnum = None,
+    author_id: str = None,
+    publishDate_from: date = None,
+    publishDate_to: date = None,
+):
+    # The query is built now, so that invalid filters fail before streaming
+    query = build_books_query(
+        type=type,
+        author_id=author_id,
+        publishDate_from=publishDate_from,
+        publishDate_to=publishDate_to,
+    )
+
+    async def books():
+        async for book in books_repository.iter_all(query, EXPORT_PROJECTION):
+            book["_id"] = str(book["_id"])
+            if "author_id" in book:
+                book["author_id"] = str(book["author_id"])
+            if isinstance(book.get("publishDate"), datetime):
+                book["publishDate"] = book["publishDate"].date()
+            yield book
+
+    return books()
+
+
+async def embedded_author(author_id: str) -> dict:
+    author = await authors_repository.find_by_id(author_id)
+    if not author:
+        raise InvalidReferenceError("author_id", author_id)
+    return author_summary(author)
+
+
 async def create_book_use_case(book_data: BookCreate) -> dict:
-    book_doc = book_data.dict()
-    # Convert the publication date into ISO string
-    book_doc["publishDate"] = book_doc["publishDate"].isoformat()
+    book_doc = book_data.model_dump()
+    # The author lookup for the embedded summary doubles as the reference check
+    book_doc["author"] = await embedded_author(book_data.author_id)
+    # Store the publication date as a native BSON date
+    book_doc["publishDate"] = to_datetime(book_doc["publishDate"])
+    # Store the author reference as an ObjectId, like the seeded data
+    book_doc["author_id"] = ObjectId(book_data.author_id)
     inserted_id = await books_repository.insert_book(book_doc)
     book_doc["id"] = inserted_id
+    book_doc["author_id"] = str(book_doc["author_id"])
     return book_doc
 
 
 async def update_book_use_case(book_id: str, book_data: BookCreate) -> dict:
-    book_doc = book_data.dict()
-    # Convert the publication date into ISO string
-    book_doc["publishDate"] = book_doc["publishDate"].isoformat()
+    book_doc = book_data.model_dump()
+    book_doc["author"] = await embedded_author(book_data.author_id)
+    # Store the publication date as a native BSON date
+    book_doc["publishDate"] = to_datetime(book_doc["publishDate"])
+    book_doc["author_id"] = ObjectId(book_data.author_id)
     modified_count = await books_repository.update_book(book_id, book_doc)
     if modified_count == 1:
         updated_book = await books_repository.find_by_id(book_id)
@@ -94,3 +207,91 @@ async def delete_book_use_case(book_id: str) -> bool:
 async def get_author_by_book_use_case(book_id: str) -> list:
     books = await books_repository.find_author_by_book(book_id)
     return books
+
+
+async def load_suggestions_use_case():
+    global suggestions
+    index = SuggestionIndex()
+    projection = {field: 1 for field in SUGGESTED_FIELDS}
+    # Followed by the change feed from now on: loaded from the primary
+    with primary_reads():
+        async for book in books_repository.iter_all({}, projection):
+            index.add_book(str(book["_id"]), book)
+    # Swapped once loaded: the previous index serves the suggestions meanwhile
+    suggestions = index
+
+
+async def refresh_suggestions(change: dict):
+    """Change feed listener applying the book writes to the suggestions."""
+    if change["collection"] != "books" or suggestions is None:
+        return
+    if change["id"] is None:
+        # Several books changed at once
+        await load_suggestions_use_case()
+        return
+    book = await books_repository.find_by_id(change["id"])
+    if book is None:
+        suggestions.remove_book(change["id"])
+    else:
+        suggestions.add_book(change["id"], book)
+
+
+async def suggest_books_use_case(prefix: str, limit: int = 10) -> list:
+    if suggestions is not None:
+        return suggestions.suggest(prefix, limit)
+    # Same order as the index: whole values, then the values having a later
+    # word starting with the prefix. Case is folded, accents are not
+    prefix = " ".join(prefix.split())
+    if not prefix:
+        return []
+    found, seen = [], set()
+    for pattern in ("^", r"\s"):
+        for field in SUGGESTED_FIELDS:
+            values = await books_repository.find_values(
+                field, pattern + re.escape(prefix), limit
+            )
+            for value in values:
+                if (field, value) not in seen and len(found) < limit:
+                    seen.add((field, value))
+                    found.append({"value": value, "field": field})
+    return found
+
+
+def drop_catalogue(max_books: int):
+    global catalogue
+    logger.warning(
+        "More than %d books: the book lists are read from MongoDB", max_books
+    )
+    # Releases the memory of the snapshot, which is not used any more
+    catalogue = CatalogueSnapshot(max_books)
+
+
+async def load_catalogue_use_case():
+    global catalogue
+    snapshot = CatalogueSnapshot(config.CATALOGUE_SNAPSHOT_MAX_BOOKS)
+    # Followed by the change feed from now on: loaded from the primary
+    with primary_reads():
+        async for book in books_repository.iter_all({}):
+            book = schema_versions.upgrade_document("books", book)
+            if not snapshot.add_book(str(book["_id"]), book):
+                drop_catalogue(snapshot.max_books)
+                return
+    snapshot.loaded()
+    # Swapped once loaded: the previous snapshot serves the lists meanwhile
+    catalogue = snapshot
+
+
+async def refresh_catalogue(change: dict):
+    """Change feed listener applying the book writes to the catalogue snapshot."""
+    if change["collection"] != "books" or not catalogue.ready:
+        # Not loaded, or dropped until the next restart
+        return
+    if change["id"] is None:
+        # Several books changed at once, e.g. their author summary
+        await load_catalogue_use_case()
+        return
+    book = await books_repository.find_by_id(change["id"])
+    if book is None:
+        catalogue.remove_book(change["id"])
+    elif not catalogue.add_book(change["id"], book):
+        drop_catalogue(catalogue.max_books)
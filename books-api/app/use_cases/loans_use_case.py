@@ -1,5 +1,15 @@
-from app.repositories import loans_repository
-from app.schemas import LoanCreate, ObjectId
+from datetime import date, datetime, timezone
+
+from app import references
+from app.dates import date_range, to_datetime, today
+from app.jobs import archive_job, purge_job
+from app.pagination import decode_cursor
+from app.repositories import jobs_repository, loans_repository
+from app.schemas import Loan, LoanCreate, ObjectId, public_projection
+from app.use_cases import stats_use_case
+
+# Public fields of the exported loans, without the internal ones (e.g. schema_version)
+EXPORT_PROJECTION = public_projection(Loan)
 
 
 async def get_loan_use_case(loan_id: str) -> dict:
@@ -11,25 +21,71 @@ async def get_loan_use_case(loan_id: str) -> dict:
     return loan
 
 
-async def list_loans_use_case(
-    loanDate: str = None,
-    returnDate: str = None,
+def is_overdue(loan_doc: dict) -> bool:
+    return not loan_doc["returned"] and loan_doc["returnDate"] < today()
+
+
+def build_loans_query(
+    loanDate: date = None,
+    returnDate: date = None,
     book_id: str = None,
     adherent_id: str = None,
-    skip: int = 0,
-    limit: int = 10,
-) -> list:
+    loanDate_from: date = None,
+    loanDate_to: date = None,
+    overdue: bool = False,
+) -> dict:
     query = {}
-    if loanDate:
-        query["loanDate"] = loanDate
+    # An exact date is the one-day range, so that it stays an index range scan
+    if loanDate or loanDate_from or loanDate_to:
+        query["loanDate"] = date_range(
+            loanDate or loanDate_from, loanDate or loanDate_to
+        )
     if returnDate:
-        query["returnDate"] = returnDate
+        query["returnDate"] = date_range(returnDate, returnDate)
+    if overdue:
+        # Flag maintained on write and by the overdue job
+        query["returned"] = False
+        query["overdue"] = True
     if book_id:
+        if not ObjectId.is_valid(book_id):
+            raise ValueError("Invalid book_id")
         query["book_id"] = ObjectId(book_id)
     if adherent_id:
+        if not ObjectId.is_valid(adherent_id):
+            raise ValueError("Invalid adherent_id")
         query["adherent_id"] = ObjectId(adherent_id)
+    return query
+
 
-    loans = await loans_repository.find_all(query, skip, limit)
+def reaches_archive(query: dict, archived_before: datetime) -> bool:
+    # Unfiltered lists stay on the hot tier. Archived loans were returned, and
+    # borrowed and due before the watermark: only a filter on open loans or on
+    # later dates excludes them
+    if not query or archived_before is None or query.get("returned") is False:
+        return False
+    for field in ("loanDate", "returnDate"):
+        date_filter = query.get(field)
+        if date_filter and date_filter.get("$gte", datetime.min) >= archived_before:
+            return False
+    return True
+
+
+async def list_loans_use_case(
+    loanDate: date = None,
+    returnDate: date = None,
+    book_id: str = None,
+    adherent_id: str = None,
+    skip: int = 0,
+    limit: int = 10,
+    loanDate_from: date = None,
+    loanDate_to: date = None,
+    overdue: bool = False,
+) -> list:
+    query = build_loans_query(
+        loanDate, returnDate, book_id, adherent_id, loanDate_from, loanDate_to, overdue
+    )
+    include_archive = reaches_archive(query, await archive_job.archived_before())
+    loans = await loans_repository.find_all(query, skip, limit, include_archive)
     for loan in loans:
         loan["id"] = str(loan["_id"])
         loan["book_id"] = str(loan["book_id"])
@@ -37,17 +93,50 @@ async def list_loans_use_case(
     return loans
 
 
-async def create_loan_use_case(loan_data: LoanCreate) -> dict:
-    loan_doc = loan_data.dict()
-    loan_doc["loanDate"] = loan_doc["loanDate"].isoformat()
-    loan_doc["returnDate"] = (
-        loan_doc["returnDate"].isoformat() if loan_doc["returnDate"] else None
+async def export_loans_use_case(
+    book_id: str = None,
+    adherent_id: str = None,
+    loanDate_from: date = None,
+    loanDate_to: date = None,
+    overdue: bool = False,
+):
+    # The query is built now, so that invalid filters fail before streaming
+    query = build_loans_query(
+        book_id=book_id,
+        adherent_id=adherent_id,
+        loanDate_from=loanDate_from,
+        loanDate_to=loanDate_to,
+        overdue=overdue,
     )
+    include_archive = reaches_archive(query, await archive_job.archived_before())
+
+    async def loans():
+        async for loan in loans_repository.iter_all(
+            query, include_archive, EXPORT_PROJECTION
+        ):
+            loan["_id"] = str(loan["_id"])
+            loan["book_id"] = str(loan["book_id"])
+            loan["adherent_id"] = str(loan["adherent_id"])
+            for field in ("loanDate", "returnDate"):
+                if isinstance(loan.get(field), datetime):
+                    loan[field] = loan[field].date()
+            yield loan
+
+    return loans()
+
+
+async def create_loan_use_case(loan_data: LoanCreate) -> dict:
+    await references.check(book_id=loan_data.book_id, adherent_id=loan_data.adherent_id)
+    loan_doc = loan_data.model_dump()
+    loan_doc["loanDate"] = to_datetime(loan_doc["loanDate"])
+    loan_doc["returnDate"] = to_datetime(loan_doc["returnDate"])
 
     loan_doc["book_id"] = ObjectId(loan_data.book_id)
     loan_doc["adherent_id"] = ObjectId(loan_data.adherent_id)
+    loan_doc["overdue"] = is_overdue(loan_doc)
 
     inserted_id = await loans_repository.insert_loan(loan_doc)
+    await stats_use_case.update_loan_counters(new_loan=loan_doc)
     loan_doc["_id"] = str(inserted_id)
     loan_doc["book_id"] = str(loan_doc["book_id"])
     loan_doc["adherent_id"] = str(loan_doc["adherent_id"])
@@ -56,48 +145,100 @@ async def create_loan_use_case(loan_data: LoanCreate) -> dict:
 
 
 async def update_loan_use_case(loan_id: str, loan_data: LoanCreate) -> dict:
-    loan_doc = loan_data.dict()
-    loan_doc["loanDate"] = loan_doc["loanDate"].isoformat()
-    loan_doc["returnDate"] = loan_doc["returnDate"].isoformat()
-
-    modified_count = await loans_repository.update_loan(loan_id, loan_doc)
-
-    if modified_count == 1:
-        updated_loan = await loans_repository.find_by_id(loan_id)
-        if updated_loan:
-            updated_loan["id"] = str(updated_loan["_id"])
-            updated_loan["book_id"] = str(updated_loan["book_id"])
-            updated_loan["adherent_id"] = str(updated_loan["adherent_id"])
-            return updated_loan
-    existing_loan = await loans_repository.find_by_id(loan_id)
-    if existing_loan:
-        existing_loan["id"] = str(existing_loan["_id"])
-        existing_loan["book_id"] = str(existing_loan["book_id"])
-        existing_loan["adherent_id"] = str(existing_loan["adherent_id"])
-        return existing_loan
-    return None
+    await references.check(book_id=loan_data.book_id, adherent_id=loan_data.adherent_id)
+    loan_doc = loan_data.model_dump()
+    loan_doc["loanDate"] = to_datetime(loan_doc["loanDate"])
+    loan_doc["returnDate"] = to_datetime(loan_doc["returnDate"])
+    loan_doc["overdue"] = is_overdue(loan_doc)
+
+    # Keep the references as ObjectIds, like on creation
+    loan_doc["book_id"] = ObjectId(loan_data.book_id)
+    loan_doc["adherent_id"] = ObjectId(loan_data.adherent_id)
+
+    previous_loan = await loans_repository.update_loan(
+        loan_id, loan_doc, await archive_job.archived_before()
+    )
+    if previous_loan is None:
+        return None
+    await stats_use_case.update_loan_counters(previous_loan, loan_doc)
+
+    updated_loan = await loans_repository.find_by_id(loan_id, loan_doc["adherent_id"])
+    if updated_loan:
+        updated_loan["id"] = str(updated_loan["_id"])
+        updated_loan["book_id"] = str(updated_loan["book_id"])
+        updated_loan["adherent_id"] = str(updated_loan["adherent_id"])
+    return updated_loan
+
+
+async def list_overdue_loans_use_case(limit: int = 10, after: str = None) -> tuple:
+    after_values = decode_cursor(after) if after else None
+    loans, cursor = await loans_repository.find_overdue(limit, after_values)
+    for loan in loans:
+        loan["id"] = str(loan["_id"])
+        loan["book_id"] = str(loan["book_id"])
+        loan["adherent_id"] = str(loan["adherent_id"])
+    return loans, cursor
 
 
 async def delete_loan_use_case(loan_id: str) -> bool:
-    deleted_count = await loans_repository.delete_loan(loan_id)
-    return deleted_count == 1
+    deleted_loan = await loans_repository.delete_loan(loan_id)
+    if deleted_loan is None:
+        return False
+    await stats_use_case.update_loan_counters(old_loan=deleted_loan)
+    return True
 
 
 async def delete_all_loan_use_case(
-    loanDate: str = None,
-    returnDate: str = None,
+    loanDate: date = None,
+    returnDate: date = None,
     book_id: str = None,
     adherent_id: str = None,
-) -> bool:
-    query = {}
-    if loanDate:
-        query["loanDate"] = loanDate
-    if returnDate:
-        query["returnDate"] = returnDate
-    if book_id:
-        query["book_id"] = ObjectId(book_id)
-    if adherent_id:
-        query["adherent_id"] = ObjectId(adherent_id)
+    dry_run: bool = False,
+    archive: bool = False,
+) -> dict:
+    query = build_loans_query(loanDate, returnDate, book_id, adherent_id)
+    matched_count = await loans_repository.count_loans(query)
+    now = datetime.now(timezone.utc)
+    job_doc = {
+        "type": purge_job.JOB_TYPE,
+        "status": "pending",
+        # The filter parameters are stored rather than the query, to resume the job
+        "params": {
+            "loanDate": to_datetime(loanDate) if loanDate else None,
+            "returnDate": to_datetime(returnDate) if returnDate else None,
+            "book_id": book_id,
+            "adherent_id": adherent_id,
+        },
+        "dry_run": dry_run,
+        "archive": archive,
+        "matched": matched_count,
+        "deleted": 0,
+        "archived": 0,
+        "created_at": now,
+        "heartbeat_at": now,
+    }
+    if dry_run or not matched_count:
+        job_doc["status"] = "done"
+        job_doc["finished_at"] = now
+        return job_doc
+    job_doc["id"] = await jobs_repository.insert_job(job_doc)
+    purge_job.start_purge(job_doc, query)
+    return job_doc
+
+
+async def get_purge_job_use_case(job_id: str) -> dict:
+    job = await jobs_repository.find_by_id(job_id)
+    if job and job["type"] == purge_job.JOB_TYPE:
+        job["id"] = str(job["_id"])
+        return job
+    return None
+
 
-    deleted_count = await loans_repository.delete_all_loan(query)
-    return deleted_count >= 1
+async def resume_purges_use_case():
+    # Purges interrupted by a stopped worker are restarted where they stopped
+    while job := await purge_job.claim_stale_purge():
+        params = {
+            name: value.date() if isinstance(value, datetime) else value
+            for name, value in job["params"].items()
+        }
+        purge_job.start_purge(job, build_loans_query(**params))
@@ -0,0 +1,66 @@
+from collections import Counter
+from datetime import date
+
+from app.dates import date_range
+from app.repositories import books_repository, stats_repository
+
+
+async def loan_rollup_keys(loan_doc: dict) -> list:
+    book = await books_repository.find_by_id(str(loan_doc["book_id"]))
+    book_type = book.get("type") if book else None
+    return stats_repository.rollup_keys(loan_doc, book_type)
+
+
+async def update_loan_counters(old_loan: dict = None, new_loan: dict = None):
+    deltas = Counter()
+    if old_loan:
+        deltas.subtract(await loan_rollup_keys(old_loan))
+    if new_loan:
+        deltas.update(await loan_rollup_keys(new_loan))
+    # Keys unchanged by an update cancel out
+    await stats_repository.increment_counters(
+        {key: delta for key, delta in deltas.items() if delta}
+    )
+
+
+async def remove_loans_from_counters(loans: list):
+    # Book types of the whole batch are fetched in one query
+    book_ids = list({loan["book_id"] for loan in loans})
+    books = await books_repository.find_by_ids(book_ids, {"type": 1})
+    book_types = {book["_id"]: book.get("type") for book in books}
+    deltas = Counter()
+    for loan in loans:
+        deltas.subtract(
+            stats_repository.rollup_keys(loan, book_types.get(loan["book_id"]))
+        )
+    await stats_repository.increment_counters(dict(deltas))
+
+
+def to_stat(counter: dict) -> dict:
+    key = counter["key"]
+    return {
+        "key": key.strftime("%Y-%m-%d") if isinstance(key, date) else str(key),
+        "count": counter["count"],
+    }
+
+
+async def daily_loans_use_case(date_from: date = None, date_to: date = None) -> list:
+    counters = await stats_repository.find_range(
+        stats_repository.DAY, date_range(date_from, date_to)
+    )
+    return [to_stat(counter) for counter in counters]
+
+
+async def loans_by_type_use_case() -> list:
+    counters = await stats_repository.find_by_kind(stats_repository.TYPE)
+    return [to_stat(counter) for counter in counters]
+
+
+async def top_books_use_case(limit: int = 10) -> list:
+    counters = await stats_repository.find_top(stats_repository.BOOK, limit)
+    return [to_stat(counter) for counter in counters]
+
+
+async def top_adherents_use_case(limit: int = 10) -> list:
+    counters = await stats_repository.find_top(stats_repository.ADHERENT, limit)
+    return [to_stat(counter) for counter in counters]
@@ -0,0 +1,184 @@
+"""In-process latency benchmark of the main API read and write paths.
+
+The API runs on the in-memory backend unless ``DB_BACKEND`` is set, so
+the figures measure the request path (routing, validation, use cases,
+serialization) without the database round trips.
+
+Usage (from the books-api directory):
+    python -m benchmarks.api_bench [--loans 2000] [--requests 300]
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import time
+
+os.environ.setdefault("DB_BACKEND", "memory")
+# Background jobs would compete with the measured requests
+for setting in ("OVERDUE_SCHEDULER_ENABLED", "LOANS_ARCHIVE_ENABLED"):
+    os.environ.setdefault(setting, "false")
+
+import httpx  # noqa: E402
+
+from app.database import adherents_collection  # noqa: E402
+from app.main import app  # noqa: E402
+
+BOOK_TYPES = ["web", "optic", "literary", "network"]
+
+
+async def seed(client: httpx.AsyncClient, authors: int, books: int, loans: int) -> dict:
+    author_ids, book_ids = [], []
+    for i in range(authors):
+        response = await client.post(
+            "/authors/",
+            json={
+                "first_name": f"First{i}",
+                "last_name": f"Last{i}",
+                "email": f"author{i}@example.com",
+                "nationality": "French",
+            },
+        )
+        author_ids.append(response.json()["_id"])
+    for i in range(books):
+        response = await client.post(
+            "/books/",
+            json={
+                "title": f"Book {i}",
+                "location": "Shelf",
+                "label": f"B{i}",
+                "type": BOOK_TYPES[i % len(BOOK_TYPES)],
+                "publishDate": f"{1990 + i % 30}-01-01",
+                "publisher": "Publisher",
+                "language": "fr",
+                "link": "https://example.com",
+                "author_id": random.choice(author_ids),
+            },
+        )
+        book_ids.append(response.json()["_id"])
+    # Inserted directly: POST /adherents/ would spend the seeding time in bcrypt
+    adherent_ids = []
+    for i in range(50):
+        result = await adherents_collection.insert_one(
+            {
+                "first_name": f"First{i}",
+                "last_name": f"Last{i}",
+                "membership_number": f"M{i:05d}",
+                "login": f"adherent{i}",
+                "role": "student",
+            }
+        )
+        adherent_ids.append(str(result.inserted_id))
+    loan_ids = []
+    for i in range(loans):
+        response = await client.post(
+            "/loans/",
+            json={
+                "loanDate": f"2024-{1 + i % 12:02d}-{1 + i % 28:02d}",
+                "returnDate": "2099-01-01",
+                "book_id": random.choice(book_ids),
+                "adherent_id": random.choice(adherent_ids),
+            },
+        )
+        loan_ids.append(response.json()["_id"])
+    return {
+        "authors": author_ids,
+        "books": book_ids,
+        "adherents": adherent_ids,
+        "loans": loan_ids,
+    }
+
+
+def workloads(ids: dict) -> dict:
+    """Request factories, each returning the (method, url, body) of one request."""
+    return {
+        "GET /books/{id}": lambda: (
+            "GET",
+            f"/books/{random.choice(ids['books'])}",
+            None,
+        ),
+        "GET /books/?type": lambda: (
+            "GET",
+            f"/books/?type={random.choice(BOOK_TYPES)}",
+            None,
+        ),
+        "GET /authors/{id}/books": lambda: (
+            "GET",
+            f"/authors/{random.choice(ids['authors'])}/books?limit=20",
+            None,
+        ),
+        "GET /adherents/{id}/loans": lambda: (
+            "GET",
+            f"/adherents/{random.choice(ids['adherents'])}/loans?limit=20",
+            None,
+        ),
+        "GET /loans/?loanDate_from": lambda: (
+            "GET",
+            "/loans/?loanDate_from=2024-03-01&loanDate_to=2024-03-31&limit=20",
+            None,
+        ),
+        "GET /stats/books/top": lambda: ("GET", "/stats/books/top?limit=10", None),
+        "POST /loans/": lambda: (
+            "POST",
+            "/loans/",
+            {
+                "loanDate": "2024-06-01",
+                "returnDate": "2099-01-01",
+                "book_id": random.choice(ids["books"]),
+                "adherent_id": random.choice(ids["adherents"]),
+            },
+        ),
+    }
+
+
+async def measure(client: httpx.AsyncClient, factory, requests: int) -> list:
+    timings = []
+    for _ in range(requests):
+        method, url, body = factory()
+        started = time.perf_counter()
+        response = await client.request(method, url, json=body)
+        timings.append((time.perf_counter() - started) * 1000)
+        if response.status_code >= 400 and response.status_code != 404:
+            raise RuntimeError(
+                f"{method} {url}: {response.status_code} {response.text}"
+            )
+    return timings
+
+
+def report(name: str, timings: list):
+    timings = sorted(timings)
+    p95 = timings[int(len(timings) * 0.95) - 1]
+    print(
+        f"{name:<30} mean {statistics.mean(timings):7.3f} ms   "
+        f"p50 {statistics.median(timings):7.3f} ms   p95 {p95:7.3f} ms"
+    )
+
+
+async def main(args):
+    started = time.perf_counter()
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://bench"
+        ) as client:
+            print(f"Startup: {(time.perf_counter() - started) * 1000:.1f} ms")
+            started = time.perf_counter()
+            ids = await seed(client, args.authors, args.books, args.loans)
+            print(f"Seeding: {time.perf_counter() - started:.2f} s")
+            for name, factory in workloads(ids).items():
+                # Warm-up round, not measured
+                await measure(client, factory, 10)
+                report(name, await measure(client, factory, args.requests))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--authors", type=int, default=50)
+    parser.add_argument("--books", type=int, default=500)
+    parser.add_argument("--loans", type=int, default=2000)
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    random.seed(args.seed)
+    asyncio.run(main(args))
@@ -0,0 +1,138 @@
+"""Memory footprint and query latency of the catalogue snapshot.
+
+Synthetic books, shaped like the stored ones, are loaded in a snapshot and,
+for comparison, kept as the decoded documents. The memory of each is
+measured with tracemalloc and reported per million books, then the list
+queries served by the snapshot are timed.
+
+Usage (from the books-api directory):
+    python -m benchmarks.catalogue_bench [--books 100000] [--rounds 20]
+"""
+
+import argparse
+import random
+import statistics
+import time
+import tracemalloc
+from datetime import date, datetime
+
+import bson
+from app.catalogue import CatalogueSnapshot
+from app.schemas import TypeEnum
+from bson import ObjectId
+
+LANGUAGES = ["English", "French", "German", "Spanish", "Italian"]
+
+
+def books(count: int, authors: int) -> list:
+    author_ids = [ObjectId() for _ in range(authors)]
+    publishers = [f"Publisher {i}" for i in range(count // 100 + 1)]
+    types = [type.value for type in TypeEnum]
+    documents = []
+    for i in range(count):
+        author = random.randrange(authors)
+        documents.append(
+            {
+                "_id": ObjectId(),
+                "title": f"Introduction to subject {i}",
+                "description": f"A book about subject {i}" if i % 2 else None,
+                "location": f"Shelf {chr(65 + i % 26)}{i % 10}",
+                "label": f"LBL-{i:08d}",
+                "type": random.choice(types),
+                "publishDate": datetime(1950 + i % 75, 1 + i % 12, 1 + i % 28),
+                "publisher": random.choice(publishers),
+                "language": random.choice(LANGUAGES),
+                "link": f"https://library.example.com/books/{i}",
+                "author_id": author_ids[author],
+                "author": {
+                    "first_name": f"First{author}",
+                    "last_name": f"Last{author}",
+                    "nationality": "French",
+                },
+                "schema_version": 2,
+            }
+        )
+    return documents, author_ids
+
+
+def decoded(encoded: list):
+    # Fresh objects for each value, like the documents read from MongoDB
+    return (bson.decode(document) for document in encoded)
+
+
+def measure_memory(build) -> int:
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del result
+    return size
+
+
+def load(documents, max_books: int) -> CatalogueSnapshot:
+    snapshot = CatalogueSnapshot(max_books)
+    for document in documents:
+        snapshot.add_book(str(document["_id"]), document)
+    snapshot.loaded()
+    return snapshot
+
+
+def report(name: str, timings: list):
+    print(
+        f"{name:<36} mean {statistics.mean(timings) * 1000:8.3f} ms   "
+        f"best {min(timings) * 1000:8.3f} ms"
+    )
+
+
+def main(args):
+    documents, author_ids = books(args.books, args.authors)
+    per_million = 1_000_000 / args.books
+    encoded = [bson.encode(document) for document in documents]
+    # Only what the snapshot and the documents keep is counted
+    sizes = {
+        "snapshot": measure_memory(lambda: load(decoded(encoded), args.books)),
+        "documents": measure_memory(lambda: list(decoded(encoded))),
+    }
+    for name, size in sizes.items():
+        print(f"{name:<10} {size * per_million / 2**20:8,.0f} MiB per million books")
+    started = time.perf_counter()
+    snapshot = load(decoded(encoded), args.books)
+    load_seconds = time.perf_counter() - started
+    print(f"{'load':<10} {load_seconds * per_million:8,.1f} s per million books")
+
+    queries = {
+        "no filter": {},
+        "type": {"type": "web"},
+        "language": {"language": "fr"},
+        "author_id": {"author_id": author_ids[0]},
+        "publishDate range": {
+            "date_from": date(2000, 1, 1),
+            "date_to": date(2000, 12, 31),
+        },
+        "type + language + range": {
+            "type": "web",
+            "language": "english",
+            "date_from": date(1990, 1, 1),
+            "date_to": date(2009, 12, 31),
+        },
+        "type, skip 1000": {"type": "web", "skip": 1000},
+    }
+    for name, query in queries.items():
+        timings = []
+        for _ in range(args.rounds):
+            started = time.perf_counter()
+            snapshot.find(**query)
+            timings.append(time.perf_counter() - started)
+        report(name, timings)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--books", type=int, default=100000)
+    parser.add_argument("--authors", type=int, default=5000)
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    random.seed(args.seed)
+    main(args)
@@ -0,0 +1,131 @@
+"""Validation and serialization throughput of the Book, Loan and Adherent lists.
+
+Each list of stored documents is validated and serialized to JSON like a
+list response, once with the reused ``TypeAdapter`` of the list and once
+model by model, to measure the cost of the per-document path.
+
+Usage (from the books-api directory):
+    python -m benchmarks.schemas_bench [--documents 1000] [--rounds 20]
+"""
+
+import argparse
+import random
+import statistics
+import time
+from datetime import date
+
+from typing import List
+
+from app.schemas import Adherent, Book, Loan
+from bson import ObjectId
+from pydantic import TypeAdapter
+
+BOOK_TYPES = ["web", "optic", "literary", "network"]
+
+# Validators and serializers of the document lists, built once and reused
+BookList = TypeAdapter(List[Book])
+LoanList = TypeAdapter(List[Loan])
+AdherentList = TypeAdapter(List[Adherent])
+
+
+def book(i: int) -> dict:
+    return {
+        "_id": ObjectId(),
+        "title": f"Book {i}",
+        "description": "A book",
+        "location": "Shelf",
+        "label": f"B{i}",
+        "type": BOOK_TYPES[i % len(BOOK_TYPES)],
+        "publishDate": date(1990 + i % 30, 1, 1),
+        "publisher": "Publisher",
+        "language": "fr",
+        "link": "https://example.com",
+        "author_id": str(ObjectId()),
+        "author": {"first_name": "First", "last_name": "Last", "nationality": "FR"},
+    }
+
+
+def loan(i: int) -> dict:
+    return {
+        "_id": ObjectId(),
+        "loanDate": date(2024, 1 + i % 12, 1 + i % 28),
+        "returnDate": date(2099, 1, 1),
+        "returned": bool(i % 2),
+        "overdue": False,
+        "book_id": str(ObjectId()),
+        "adherent_id": str(ObjectId()),
+    }
+
+
+def adherent(i: int) -> dict:
+    return {
+        "_id": ObjectId(),
+        "first_name": f"First{i}",
+        "last_name": f"Last{i}",
+        "membership_number": f"M{i:05d}",
+        "login": f"adherent{i}",
+        "role": random.choice(["student", "professor", "librarian"]),
+    }
+
+
+def with_adapter(adapter, documents: list) -> bytes:
+    return adapter.dump_json(adapter.validate_python(documents), by_alias=True)
+
+
+def per_model(model, documents: list) -> bytes:
+    lines = [
+        model.model_validate(document).model_dump_json(by_alias=True)
+        for document in documents
+    ]
+    return ("[" + ",".join(lines) + "]").encode()
+
+
+def measure(function, documents: list, rounds: int) -> list:
+    timings = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        function(documents)
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+def report(name: str, documents: int, timings: list):
+    best = min(timings)
+    print(
+        f"{name:<28} {documents / best:12,.0f} docs/s   "
+        f"mean {statistics.mean(timings) * 1000:8.3f} ms   "
+        f"best {best * 1000:8.3f} ms"
+    )
+
+
+def main(args):
+    cases = {
+        "Book": (book, Book, BookList),
+        "Loan": (loan, Loan, LoanList),
+        "Adherent": (adherent, Adherent, AdherentList),
+    }
+    for name, (factory, model, adapter) in cases.items():
+        documents = [factory(i) for i in range(args.documents)]
+        # The two paths must produce the same response
+        assert with_adapter(adapter, documents) == per_model(model, documents)
+        for label, function in (
+            ("TypeAdapter", lambda docs: with_adapter(adapter, docs)),
+            ("per model", lambda docs: per_model(model, docs)),
+        ):
+            # Warm-up round, not measured
+            function(documents)
+            report(
+                f"{name} list, {label}",
+                args.documents,
+                measure(function, documents, args.rounds),
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--documents", type=int, default=1000)
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    random.seed(args.seed)
+    main(args)
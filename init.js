@@ -56,7 +56,7 @@ db.books.insertMany([
     location: "Shelf A1",
     label: "Data Science Basics",
     type: "datascience",
-    publishDate: "2021-05-15",
+    publishDate: ISODate("2021-05-15"),
     publisher: "Springer",
     language: "English",
     link: "https://example.com/data-science",
@@ -69,7 +69,7 @@ db.books.insertMany([
     location: "Shelf B3",
     label: "Web Technologies",
     type: "web",
-    publishDate: "2023-01-20",
+    publishDate: ISODate("2023-01-20"),
     publisher: "O'Reilly",
     language: "English",
     link: "https://example.com/web-development",
@@ -82,7 +82,7 @@ db.books.insertMany([
     location: "Shelf C2",
     label: "Mathematical Foundations",
     type: "algebra",
-    publishDate: "2019-09-10",
+    publishDate: ISODate("2019-09-10"),
     publisher: "Pearson",
     language: "English",
     link: "https://example.com/linear-algebra",
@@ -95,7 +95,7 @@ db.books.insertMany([
     location: "Shelf D5",
     label: "Advanced Optimization",
     type: "optimization",
-    publishDate: "2022-07-12",
+    publishDate: ISODate("2022-07-12"),
     publisher: "MIT Press",
     language: "English",
     link: "https://example.com/optimization-ml",
@@ -108,7 +108,7 @@ db.books.insertMany([
     location: "Shelf E1",
     label: "Philosophy Insights",
     type: "phylosophy",
-    publishDate: "2018-03-25",
+    publishDate: ISODate("2018-03-25"),
     publisher: "Oxford University Press",
     language: "French",
     link: "https://example.com/philosophy",
@@ -121,7 +121,7 @@ db.books.insertMany([
     location: "Shelf F1",
     label: "Machine Learning",
     type: "optimization",
-    publishDate: "2025-01-15",
+    publishDate: ISODate("2025-01-15"),
     publisher: "MIT Press",
     language: "English",
     link: "https://example.com/advanced-ml",
@@ -165,32 +165,32 @@ db.adherents.insertMany([
 
 db.loans.insertMany([
   { 
-    loanDate: "2012-10-10", 
-    returnDate: "2012-10-27", 
+    loanDate: ISODate("2012-10-10"), 
+    returnDate: ISODate("2012-10-27"), 
     book_id: book1Id, 
     adherent_id: adherent1Id  
   },
   { 
-    loanDate: "2024-12-10", 
-    returnDate: "2024-01-10", 
+    loanDate: ISODate("2024-12-10"), 
+    returnDate: ISODate("2024-01-10"), 
     book_id: book2Id, 
     adherent_id: adherent1Id  
   },
   { 
-    loanDate: "2024-10-06", 
-    returnDate: "2024-12-30", 
+    loanDate: ISODate("2024-10-06"), 
+    returnDate: ISODate("2024-12-30"), 
     book_id: book1Id, 
     adherent_id: adherent2Id  
   },
   { 
-    loanDate: "2012-10-10", 
-    returnDate: "2012-10-27", 
+    loanDate: ISODate("2012-10-10"), 
+    returnDate: ISODate("2012-10-27"), 
     book_id: book2Id, 
     adherent_id: adherent1Id  
   },
   { 
-    loanDate: "2025-02-01", 
-    returnDate: "2025-02-28", 
+    loanDate: ISODate("2025-02-01"), 
+    returnDate: ISODate("2025-02-28"), 
     book_id: book6Id, 
     adherent_id: adherent3Id  
   }